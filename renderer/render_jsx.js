@@ -4,63 +4,363 @@ const {
 } = require("playwright") // 引入 chromium 浏览器，您也可以选择 firefox 或 webkit
 const fs = require("fs")
 const path = require("path")
-const Babel = require("@babel/standalone")
-const sass = require("sass") // 引入 sass 库
+const crypto = require("crypto") // 新增：编译缓存的内容哈希
 const http = require("http") // 新增：引入 Node.js 的 'http' 模块
 const url = require("url") // 新增：引入 Node.js 的 'url' 模块用于路径解析
+const readline = require("readline") // 新增：常驻服务模式下按行读取 stdin 上的渲染任务
 
-// 命令行参数顺序：<output_path_for_screenshot> <jsx_code_base64> <scss_code_base64>
-const outputPath = process.argv[2] // 截图的最终保存路径
-const jsxCodeBase64 = process.argv[3]
-const scssCodeBase64 = process.argv[4]
-
-// 解析输出文件路径，用于保存调试 HTML 和日志
-const outputDir =
-	path.dirname(outputPath)
-const itemBaseName = path.basename(
-	outputPath,
-	".png"
-) // 通常是 rendered_screenshot
-
-const browserLogFilePath = path.join(
-	outputDir,
-	`${itemBaseName}_browser_log.txt`
-)
-const errorLogFilePath = path.join(
-	outputDir,
-	`${itemBaseName}_error_log.txt`
-) // 专门的错误日志文件
-
-// 创建一个写入流，用于捕获所有浏览器控制台和页面错误日志
-const browserLogStream =
-	fs.createWriteStream(
-		browserLogFilePath,
-		{ flags: "w" }
+// 两种运行方式：
+//   单次模式: node render_jsx.js <output_path_for_screenshot> [--headful] < {"jsx": ..., "scss": ...}
+//            代码以 JSON 从 stdin 读入，不受命令行长度限制；
+//            旧的 <output_path> <jsx_code_base64> <scss_code_base64> 参数形式仍然兼容
+//   服务模式: node render_jsx.js --server [--workers N] [--headful]
+// 服务模式下浏览器只启动一次，stdin 每行一个 JSON 任务，stdout 每行一个 JSON 结果。
+// 任务带 return_screenshot 时，结果头中的 screenshot_bytes 给出截图 PNG 的字节数，
+// PNG 原始字节紧跟在该行之后写出；write_file 为 false 时截图不落盘。
+// 两种模式都支持 --compile-cache-dir <dir> [--compile-cache-read-only]，把 Sass/Babel 的编译结果缓存到磁盘，
+// 以及 --log-level off|errors|summary|trace 控制每个任务写出的日志和调试文件 (服务模式下单个任务可用 log_level 覆盖)。
+const VIEWPORT = {
+	width: 780,
+	height: 1760
+}
+const BROWSER_LAUNCH_ARGS = [
+	"--no-sandbox",
+	"--disable-setuid-sandbox",
+	"--disable-gpu",
+	"--disable-dev-shm-usage",
+	"--disable-web-security", // 禁用 Web 安全，对于本地文件非常重要
+	"--allow-insecure-localhost",
+	"--ignore-certificate-errors"
+]
+const DEFAULT_JOB_TIMEOUT_MS = 60000
+const DEFAULT_READY_TIMEOUT_MS = 10000 // 等待页面就绪的上限，超过后直接截图
+
+// 页面依赖的 React/ReactDOM 使用 renderer/node_modules 中的本地副本，由本地 HTTP 服务器在 /vendor/ 下提供，
+// 渲染过程完全离线，且浏览器上下文会按 Cache-Control 缓存它们。
+const VENDOR_SCRIPTS = {
+	"react.production.min.js":
+		"react/umd/react.production.min.js",
+	"react-dom.production.min.js":
+		"react-dom/umd/react-dom.production.min.js"
+}
+
+// 服务模式下 stdout 专用于和 Python 端通信，所有日志都改写到 stderr
+let protocolMode = false
+
+// 日志级别，从少到多：
+//   off:     不写任何日志文件
+//   errors:  只在出错时写 <截图名>_error_log.txt
+//   summary: 另写 <截图名>_browser_log.txt，每个任务只记录几行关键信息
+//   trace:   记录全部细节 (网络请求、控制台输出、完整 CSS)，并保存编译前后的代码、页面 HTML 和最终 DOM 等调试文件
+const LOG_LEVELS = ["off", "errors", "summary", "trace"]
+const DEFAULT_LOG_LEVEL = "errors"
+let defaultLogLevel = DEFAULT_LOG_LEVEL
+
+// 后台异步写文件，退出前统一等待全部完成
+const pendingWrites = new Set()
+function trackWrite(promise, description) {
+	const task = promise
+		.catch((error) => {
+			console.error(
+				`⚠️ 写入${description}失败: ${error.message}`
+			)
+		})
+		.finally(() => pendingWrites.delete(task))
+	pendingWrites.add(task)
+	return task
+}
+function writeFileInBackground(filePath, content) {
+	return trackWrite(
+		fs.promises.writeFile(
+			filePath,
+			content,
+			"utf8"
+		),
+		`文件 ${filePath} `
 	)
+}
+async function flushPendingWrites() {
+	await Promise.allSettled([...pendingWrites])
+}
 
-// 立即记录日志，确保即使在极早期的崩溃也能捕获
-function logToBoth(
-	message,
-	isError = false
-) {
-	const timestamp =
-		new Date().toISOString()
-	const formattedMessage = `[${timestamp}] ${message}`
-	if (isError) {
-		console.error(formattedMessage)
-	} else {
-		console.log(formattedMessage) // <--- 修复：将 formattedFormattedMessage 改为 formattedMessage
+// Babel 和 Sass 体积较大，只在第一次真正需要编译时加载，之后整个进程复用；
+// 编译全部命中缓存时完全不加载它们
+let babelModule = null
+let sassModule = null
+function getBabel() {
+	if (!babelModule) {
+		babelModule = require("@babel/standalone")
 	}
-	browserLogStream.write(
-		formattedMessage + "\n"
-	)
-	if (isError) {
-		fs.appendFileSync(
-			errorLogFilePath,
-			formattedMessage + "\n",
+	return babelModule
+}
+function getSass() {
+	if (!sassModule) {
+		sassModule = require("sass")
+	}
+	return sassModule
+}
+
+// 编译缓存：以 (编译器版本, 本脚本内容, 源码) 的 SHA-256 为键。
+// 进程内先查内存中的 LRU Map，再查磁盘目录 <dir>/<key 前两位>/<key> (与 Python 端 DiskCache 的布局一致)，
+// 服务模式下同一份代码在整个运行期间只编译一次，跨进程 (断点续跑、指标重算、prompt 对比) 也能复用。
+// 编译失败的结果不缓存。
+const COMPILE_CACHE_MEMORY_ENTRIES = 256
+const compileCache = {
+	memory: new Map(),
+	dir: null,
+	readOnly: false,
+	fingerprint: null
+}
+
+function configureCompileCache(dir, readOnly) {
+	compileCache.dir = dir || null
+	compileCache.readOnly = readOnly
+	if (compileCache.dir && !readOnly) {
+		fs.mkdirSync(compileCache.dir, {
+			recursive: true
+		})
+	}
+}
+
+function getCompilerFingerprint() {
+	if (!compileCache.fingerprint) {
+		// 只读取 package.json 获取版本号，不需要加载编译器本身
+		compileCache.fingerprint = [
+			require("@babel/standalone/package.json")
+				.version,
+			require("sass/package.json").version,
+			crypto
+				.createHash("sha256")
+				.update(fs.readFileSync(__filename))
+				.digest("hex")
+		].join("|")
+	}
+	return compileCache.fingerprint
+}
+
+function compileCacheKey(kind, source) {
+	return crypto
+		.createHash("sha256")
+		.update(
+			`${kind}\0${getCompilerFingerprint()}\0`
+		)
+		.update(source)
+		.digest("hex")
+}
+
+function rememberCompiled(key, value) {
+	compileCache.memory.delete(key)
+	compileCache.memory.set(key, value)
+	if (
+		compileCache.memory.size >
+		COMPILE_CACHE_MEMORY_ENTRIES
+	) {
+		compileCache.memory.delete(
+			compileCache.memory.keys().next().value
+		)
+	}
+}
+
+function readCompileCache(key) {
+	if (compileCache.memory.has(key)) {
+		const value = compileCache.memory.get(key)
+		rememberCompiled(key, value)
+		return value
+	}
+	if (!compileCache.dir) {
+		return null
+	}
+	try {
+		const value = fs.readFileSync(
+			path.join(
+				compileCache.dir,
+				key.slice(0, 2),
+				key
+			),
 			"utf8"
-		) // 错误也写入专门的错误文件
+		)
+		rememberCompiled(key, value)
+		return value
+	} catch (error) {
+		return null
+	}
+}
+
+let compileCacheWriteCount = 0
+
+function writeCompileCache(key, value) {
+	rememberCompiled(key, value)
+	if (!compileCache.dir || compileCache.readOnly) {
+		return
+	}
+	// 先写临时文件再原子替换，多个渲染进程可以安全地共享同一个缓存目录；
+	// 临时文件名带进程内的写入序号，服务模式下同一个键的并发写入不会互相覆盖临时文件
+	compileCacheWriteCount += 1
+	const entryPath = path.join(
+		compileCache.dir,
+		key.slice(0, 2),
+		key
+	)
+	const tmpPath = `${entryPath}.${process.pid}.${compileCacheWriteCount}.tmp`
+	trackWrite(
+		fs.promises
+			.mkdir(path.dirname(entryPath), {
+				recursive: true
+			})
+			.then(() =>
+				fs.promises.writeFile(
+					tmpPath,
+					value,
+					"utf8"
+				)
+			)
+			.then(() =>
+				fs.promises.rename(
+					tmpPath,
+					entryPath
+				)
+			),
+		"编译缓存"
+	)
+}
+
+// 为每个渲染任务创建独立的日志函数。
+// logToBoth(message) 记录 trace 级别的细节，logToBoth(message, true) 记录错误，logToBoth.summary(message) 记录关键信息。
+// 日志先缓存在内存里，任务结束 (close) 时一次性异步写入 <截图名>_browser_log.txt / _error_log.txt；
+// 控制台 (服务模式下为 stderr) 只输出错误和关键信息，trace 细节只进日志文件。
+function createJobLogger(outputPath, logLevel) {
+	const levelIndex = Math.max(
+		0,
+		LOG_LEVELS.indexOf(logLevel)
+	)
+	const outputDir =
+		path.dirname(outputPath)
+	const itemBaseName = path.basename(
+		outputPath,
+		".png"
+	) // 通常是 rendered_screenshot
+
+	const browserLogFilePath = path.join(
+		outputDir,
+		`${itemBaseName}_browser_log.txt`
+	)
+	const errorLogFilePath = path.join(
+		outputDir,
+		`${itemBaseName}_error_log.txt`
+	) // 专门的错误日志文件
+
+	// 先删掉上一次渲染留下的日志，避免本次没有出错时旧的错误日志造成误导
+	const staleLogsRemoved = Promise.all([
+		fs.promises.rm(browserLogFilePath, {
+			force: true
+		}),
+		fs.promises.rm(errorLogFilePath, {
+			force: true
+		})
+	]).catch(() => {})
+	const browserLogLines = []
+	const errorLogLines = []
+	let closed = false
+
+	function emit(message, kind) {
+		if (closed) {
+			return
+		}
+		const formattedMessage = `[${new Date().toISOString()}] ${message}`
+		if (kind === "error") {
+			console.error(formattedMessage)
+			errorLogLines.push(formattedMessage)
+		} else if (kind === "summary") {
+			if (protocolMode) {
+				console.error(formattedMessage)
+			} else {
+				console.log(formattedMessage)
+			}
+		}
+		browserLogLines.push(formattedMessage)
+	}
+
+	function logToBoth(
+		message,
+		isError = false
+	) {
+		if (isError) {
+			if (levelIndex >= 1) {
+				emit(message, "error")
+			}
+		} else if (levelIndex >= 3) {
+			emit(message, "trace")
+		}
+	}
+	logToBoth.summary = (message) => {
+		if (levelIndex >= 2) {
+			emit(message, "summary")
+		}
+	}
+	logToBoth.trace = levelIndex >= 3
+	logToBoth.close = () => {
+		if (closed) {
+			return
+		}
+		closed = true
+		const logFiles = []
+		if (
+			levelIndex >= 2 &&
+			browserLogLines.length
+		) {
+			logFiles.push([
+				browserLogFilePath,
+				browserLogLines
+			])
+		}
+		if (errorLogLines.length) {
+			logFiles.push([
+				errorLogFilePath,
+				errorLogLines
+			])
+		}
+		trackWrite(
+			staleLogsRemoved.then(() =>
+				Promise.all(
+					logFiles.map(
+						([filePath, lines]) =>
+							fs.promises.writeFile(
+								filePath,
+								lines.join("\n") + "\n",
+								"utf8"
+							)
+					)
+				)
+			),
+			"日志文件"
+		)
+	}
+	logToBoth.browserLogFilePath =
+		browserLogFilePath
+	return logToBoth
+}
+
+// 启动时一次性把本地 React 脚本读入内存；缺失时立即报错，而不是等到页面渲染出空白
+function loadVendorScripts() {
+	const vendorScripts = new Map()
+	for (const [fileName, modulePath] of Object.entries(
+		VENDOR_SCRIPTS
+	)) {
+		let resolvedPath
+		try {
+			resolvedPath =
+				require.resolve(modulePath)
+		} catch (error) {
+			throw new Error(
+				`找不到本地依赖 ${modulePath}。请在 renderer 目录下运行 npm install (需要 react@18 / react-dom@18)。`
+			)
+		}
+		vendorScripts.set(
+			fileName,
+			fs.readFileSync(resolvedPath)
+		)
 	}
+	return vendorScripts
 }
 
 // 辅助函数：用于本地 HTTP 服务器提供静态文件
@@ -106,379 +406,352 @@ function serveStaticFile(
 	})
 }
 
-logToBoth(
-	`🚀 Playwright 渲染脚本开始执行。浏览器日志将写入: ${browserLogFilePath}`
-)
-
-const jsxCode = Buffer.from(
-	jsxCodeBase64,
-	"base64"
-).toString("utf8")
-const scssCode = scssCodeBase64
-	? Buffer.from(
-			scssCodeBase64,
-			"base64"
-	  ).toString("utf8")
-	: ""
-
-async function renderAndScreenshot() {
-	let browser
-	let server // 声明服务器变量
-	try {
-		// Playwright 不需要手动指定 executablePath，它会管理下载的浏览器
-		logToBoth(
-			`尝试启动 Playwright 浏览器 (Chromium, headless: false)...`
-		)
-		browser = await chromium.launch({
-			headless: false, // 保持为 false，以便您看到浏览器窗口进行调试
-			args: [
-				"--no-sandbox",
-				"--disable-setuid-sandbox",
-				"--disable-gpu",
-				"--disable-dev-shm-usage",
-				"--disable-web-security", // 禁用 Web 安全，对于本地文件非常重要
-				"--allow-insecure-localhost",
-				"--ignore-certificate-errors"
-			]
-		})
-		logToBoth(
-			`✅ Playwright 浏览器已成功启动。`
-		)
-
-		const page = await browser.newPage()
-		await page.setViewportSize({
-			width: 780,
-			height: 1760
-		})
-		logToBoth(
-			`✅ 已创建新页面并设置视口。`
-		)
+// 启动本地 HTTP 服务器。端口由系统分配 (listen 0)，多个渲染进程可以同时运行。
+// 每个任务通过 /jobs/<jobId>/ 前缀挂载到自己的输出目录，一个服务器可同时服务多个任务；
+// 任务的页面 HTML 直接从内存提供，不落盘；
+// /vendor/ 下是内存中的 React 脚本，内容不变，允许浏览器长期缓存。
+async function startStaticServer(vendorScripts) {
+	const mounts = new Map()
 
-		// 捕获所有页面错误和控制台日志
-		page.on("pageerror", (error) => {
-			const logMsg = `❌ 浏览器页面错误 (运行时 JS 错误): ${error.message}\n堆栈: ${error.stack}`
-			logToBoth(logMsg, true)
-		})
-		page.on(
-			"console",
-			async (message) => {
-				const args = await Promise.all(
-					message
-						.args()
-						.map((arg) =>
-							arg.jsonValue()
-						)
-				)
-				const logMsg = `浏览器控制台 [${message.type()}]: ${args.join(
-					" "
-				)}`
-				logToBoth(logMsg)
-				if (
-					message.type() === "error"
-				) {
-					logToBoth(
-						`❌ 浏览器控制台错误: ${args.join(
-							" "
-						)}`,
-						true
-					)
-				}
-			}
-		)
-		page.on("close", () => {
-			logToBoth(
-				"⚠️ 警告: Playwright 页面已关闭。",
-				true
+	const server = http.createServer(
+		(req, res) => {
+			const parsedUrl = url.parse(
+				req.url
 			)
-		})
-		// 捕获浏览器断开连接事件
-		browser.on("disconnected", () => {
-			logToBoth(
-				"💥 Playwright 浏览器连接已断开！这可能意味着浏览器崩溃。",
-				true
+			const segments = decodeURIComponent(
+				parsedUrl.pathname
 			)
-			browserLogStream.end()
-		})
-		// 捕获浏览器内部的进程错误
-		browser.on(
-			"browsererror",
-			(error) => {
-				logToBoth(
-					`🔥 Playwright 浏览器进程错误: ${error.message}`,
-					true
+				.split("/")
+				.filter(Boolean)
+			if (segments[0] === "vendor") {
+				const script = vendorScripts.get(
+					segments[1]
 				)
-				browserLogStream.end()
+				if (!script) {
+					res.writeHead(404, {
+						"Content-Type": "text/plain"
+					})
+					res.end("404 Not Found")
+					return
+				}
+				res.writeHead(200, {
+					"Content-Type":
+						"application/javascript",
+					"Cache-Control":
+						"public, max-age=31536000, immutable"
+				})
+				res.end(script)
+				return
 			}
-		)
-		page.on("load", () => {
-			logToBoth(
-				"✅ Playwright 页面 DOMContentLoaded 或 Load 事件触发。"
-			)
-		})
 
-		// --- 网络请求监听器以捕获图片加载状态 ---
-		page.on("request", (request) => {
-			// 仅记录 http(s) 请求，file:// 请求已不再是主要方式
+			const mount =
+				segments[0] === "jobs"
+					? mounts.get(segments[1])
+					: undefined
+			if (!mount) {
+				res.writeHead(404, {
+					"Content-Type": "text/plain"
+				})
+				res.end("404 Not Found")
+				return
+			}
+
+			const { outputDir, logFn, pages } =
+				mount
+			const inMemoryPage =
+				segments.length === 3
+					? pages.get(segments[2])
+					: undefined
+			if (inMemoryPage !== undefined) {
+				res.writeHead(200, {
+					"Content-Type":
+						"text/html; charset=utf-8",
+					"Cache-Control": "no-store"
+				})
+				res.end(inMemoryPage)
+				return
+			}
+			const filePath = path.join(
+				outputDir,
+				...segments.slice(2)
+			) // 从任务的 outputDir 提供文件
 			if (
-				request
-					.url()
-					.startsWith("http") &&
-				(request.resourceType() ===
-					"image" ||
-					request
-						.url()
-						.includes("assets/"))
+				!filePath.startsWith(outputDir)
 			) {
-				logToBoth(
-					`➡️ 请求资源: ${request.url()} (类型: ${request.resourceType()})`
-				)
-			}
-		})
-		page.on(
-			"response",
-			async (response) => {
-				const request =
-					response.request()
-				if (
-					request
-						.url()
-						.startsWith("http") &&
-					(request.resourceType() ===
-						"image" ||
-						request
-							.url()
-							.includes("assets/"))
-				) {
-					const status =
-						response.status()
-					const responseUrl =
-						response.url() // 使用 responseUrl 来避免与 Node.js url 模块混淆
-					if (
-						status >= 200 &&
-						status < 300
-					) {
-						logToBoth(
-							`✅ 资源加载成功: ${responseUrl} (类型: ${request.resourceType()}, 状态码: ${status})`
-						)
-					} else {
-						logToBoth(
-							`❌ 资源加载失败: ${responseUrl} (类型: ${request.resourceType()}, 状态码: ${status})`,
-							true
-						)
-					}
-				}
+				res.writeHead(403, {
+					"Content-Type": "text/plain"
+				})
+				res.end("403 Forbidden")
+				return
 			}
-		)
-		page.on(
-			"requestfailed",
-			(request) => {
-				if (
-					request
-						.url()
-						.startsWith("http") &&
-					(request.resourceType() ===
-						"image" ||
-						request
-							.url()
-							.includes("assets/"))
-				) {
-					logToBoth(
-						`❌ 资源请求失败 (Request Failed): ${request.url()} 错误: ${
-							request.failure()
-								?.errorText ||
-							"未知错误"
-						}`,
+
+			logFn(
+				`Server Request: ${req.url} -> 尝试提供文件: ${filePath}`
+			)
+
+			fs.stat(filePath, (err, stats) => {
+				if (err) {
+					logFn(
+						`Server Error (stat): ${err.message} for ${filePath}`,
 						true
 					)
+					res.writeHead(404, {
+						"Content-Type": "text/plain"
+					})
+					res.end("404 Not Found")
+					return
 				}
-			}
-		)
-		// --- END NETWORK LISTENERS ---
 
-		logToBoth(`开始编译 SCSS...`)
-		// 1. 编译 SCSS 为 CSS
-		let compiledCss = ""
-		if (scssCode) {
-			try {
-				let processedScss =
-					scssCode.replace(
-						/(\d+)\s*dx/g,
-						"$1px"
+				if (stats.isDirectory()) {
+					// 如果是目录，尝试提供 index.html
+					const indexFilePath = path.join(
+						filePath,
+						"index.html"
 					)
-				// 确保 SCSS 中的图片路径也是相对的，因为它们将通过 HTTP 服务器提供
-				processedScss =
-					processedScss.replace(
-						/\.\.\/img\//g,
-						"./assets/"
+					fs.access(
+						indexFilePath,
+						fs.constants.F_OK,
+						(err) => {
+							if (err) {
+								logFn(
+									`Server Error (access index.html): ${err.message} for ${indexFilePath}`,
+									true
+								)
+								res.writeHead(403, {
+									"Content-Type":
+										"text/plain"
+								})
+								res.end("403 Forbidden")
+							} else {
+								serveStaticFile(
+									indexFilePath,
+									res,
+									logFn
+								)
+							}
+						}
 					)
-
-				const result =
-					sass.compileString(
-						processedScss
+				} else {
+					serveStaticFile(
+						filePath,
+						res,
+						logFn
 					)
-				compiledCss =
-					result.css.toString()
-				logToBoth("SCSS 编译成功。")
-			} catch (sassError) {
-				logToBoth(
-					`❌ SCSS 编译错误: ${sassError.message}`,
-					true
-				)
-				compiledCss = `/* SCSS Compilation Error: ${
-					sassError.message
-				} */ body { background-color: #ffe0e0; padding: 20px; font-family: sans-serif; } #root::before { content: "SCSS ERROR: ${sassError.message
-					.replace(/"/g, "'")
-					.replace(
-						/\n/g,
-						"\\A"
-					)}"; color: red; display: block; white-space: pre-wrap; word-wrap: break-word; }`
-			}
+				}
+			})
 		}
-		fs.writeFileSync(
-			path.join(
-				outputDir,
-				`${itemBaseName}_received_style.scss`
-			),
-			scssCode,
-			"utf8"
-		)
-		fs.writeFileSync(
-			path.join(
-				outputDir,
-				`${itemBaseName}_compiled_style.css`
-			),
-			compiledCss,
-			"utf8"
-		)
-		logToBoth(`SCSS 编译结果已保存。`)
-		logToBoth(
-			"--- 编译后的完整 CSS 内容开始 ---"
-		)
-		logToBoth(compiledCss)
-		logToBoth(
-			"--- 编译后的完整 CSS 内容结束 ---"
+	)
+
+	await new Promise((resolve, reject) => {
+		server.once("error", reject)
+		server.listen(0, "127.0.0.1", () =>
+			resolve()
 		)
+	})
 
-		logToBoth(`开始编译 JSX...`)
-		// 2. 编译 JSX 为纯 JavaScript
-		let compiledJsx
-		let componentName = "App"
-		try {
-			// 确保 JSX 中的图片路径也是相对的
-			let processedJsxCode =
-				jsxCode.replace(
-					/\.\.\/img\//g,
-					"./assets/"
+	return {
+		port: server.address().port,
+		// pages: { 文件名: HTML 内容 }，这些路径直接返回内存中的内容
+		mount(jobId, outputDir, logFn, pages = {}) {
+			mounts.set(String(jobId), {
+				outputDir: path.resolve(outputDir),
+				logFn,
+				pages: new Map(
+					Object.entries(pages)
 				)
+			})
+		},
+		unmount(jobId) {
+			mounts.delete(String(jobId))
+		},
+		close() {
+			return new Promise((resolve) =>
+				server.close(() => resolve())
+			)
+		}
+	}
+}
 
-			compiledJsx = Babel.transform(
-				processedJsxCode,
-				{
-					plugins: [
-						[
-							"transform-react-jsx",
-							{
-								pragma:
-									"React.createElement"
-							}
-						]
-					]
-				}
-			).code
+async function launchBrowser(headful) {
+	return chromium.launch({
+		headless: !headful, // 调试时可通过 --headful 打开浏览器窗口
+		args: BROWSER_LAUNCH_ARGS
+	})
+}
 
-			compiledJsx = compiledJsx.replace(
-				/^import(?:["'].*?['']|.*?;)?\n?/gm,
-				""
-			)
-			compiledJsx = compiledJsx.replace(
-				/export (default )?.*;?\n?/g,
-				""
-			)
+async function createContext(browser) {
+	return browser.newContext({
+		viewport: VIEWPORT
+	})
+}
 
-			const componentNameMatch =
-				compiledJsx.match(
-					/(?:function|class)\s+([A-Z][a-zA-Z0-9]*)\s*(?:\(|extends)/
+// 1. 编译 SCSS 为 CSS。编译失败时返回一段把错误显示在页面上的 CSS。
+// 返回 { css, cacheHit }
+function compileScss(scssCode, logToBoth) {
+	let compiledCss = ""
+	if (scssCode) {
+		const cacheKey = compileCacheKey(
+			"scss",
+			scssCode
+		)
+		const cached = readCompileCache(cacheKey)
+		if (cached !== null) {
+			logToBoth("SCSS 编译结果命中缓存。")
+			return {
+				css: cached,
+				cacheHit: true
+			}
+		}
+		try {
+			let processedScss =
+				scssCode.replace(
+					/(\d+)\s*dx/g,
+					"$1px"
 				)
-			if (
-				componentNameMatch &&
-				componentNameMatch[1]
-			) {
-				componentName =
-					componentNameMatch[1]
-				logToBoth(
-					`找到主组件名: ${componentName}`
+			// 确保 SCSS 中的图片路径也是相对的，因为它们将通过 HTTP 服务器提供
+			processedScss =
+				processedScss.replace(
+					/\.\.\/img\//g,
+					"./assets/"
 				)
-			} else {
-				const topLevelVarMatch =
-					compiledJsx.match(
-						/const\s+([A-Z][a-zA-Z0-9]*)\s*=/
-					)
-				if (
-					topLevelVarMatch &&
-					topLevelVarMatch[1]
-				) {
-					componentName =
-						topLevelVarMatch[1]
-					logToBoth(
-						`找到顶层组件变量: ${componentName}`
-					)
-				} else {
-					logToBoth(
-						'未能可靠地提取组件名。默认为 "App"。',
-						true
-					)
-				}
-			}
 
-			compiledJsx += `\nwindow.App = ${componentName};`
-			compiledJsx = `'use strict';\n${compiledJsx}`
-
-			logToBoth("JSX 编译成功。")
-		} catch (babelError) {
+			const result =
+				getSass().compileString(
+					processedScss
+				)
+			compiledCss =
+				result.css.toString()
+			writeCompileCache(
+				cacheKey,
+				compiledCss
+			)
+			logToBoth("SCSS 编译成功。")
+		} catch (sassError) {
 			logToBoth(
-				`❌ Babel 编译 JSX 错误: ${babelError.message}`,
+				`❌ SCSS 编译错误: ${sassError.message}`,
 				true
 			)
-			await page.setContent(
-				`<html><body><div style="color: red; padding: 20px;">错误：编译 JSX 失败: ${babelError.message}</div></body></html>`
-			)
-			await page.screenshot({
-				path: outputPath
-			})
-			return
+			compiledCss = `/* SCSS Compilation Error: ${
+				sassError.message
+			} */ body { background-color: #ffe0e0; padding: 20px; font-family: sans-serif; } #root::before { content: "SCSS ERROR: ${sassError.message
+				.replace(/"/g, "'")
+				.replace(
+					/\n/g,
+					"\\A"
+				)}"; color: red; display: block; white-space: pre-wrap; word-wrap: break-word; }`
 		}
-		fs.writeFileSync(
-			path.join(
-				outputDir,
-				`${itemBaseName}_received_code.jsx`
-			),
-			jsxCode,
-			"utf8"
+	}
+	return {
+		css: compiledCss,
+		cacheHit: false
+	}
+}
+
+// 2. 编译 JSX 为纯 JavaScript，并把主组件挂到 window.App 上。编译失败时抛出异常。
+// 返回 { js, cacheHit }
+function compileJsx(jsxCode, logToBoth) {
+	const cacheKey = compileCacheKey(
+		"jsx",
+		jsxCode
+	)
+	const cached = readCompileCache(cacheKey)
+	if (cached !== null) {
+		logToBoth("JSX 编译结果命中缓存。")
+		return {
+			js: cached,
+			cacheHit: true
+		}
+	}
+
+	let componentName = "App"
+	// 确保 JSX 中的图片路径也是相对的
+	let processedJsxCode =
+		jsxCode.replace(
+			/\.\.\/img\//g,
+			"./assets/"
 		)
-		fs.writeFileSync(
-			path.join(
-				outputDir,
-				`${itemBaseName}_compiled_code.js`
-			),
-			compiledJsx,
-			"utf8"
+
+	let compiledJsx = getBabel().transform(
+		processedJsxCode,
+		{
+			plugins: [
+				[
+					"transform-react-jsx",
+					{
+						pragma:
+							"React.createElement"
+					}
+				]
+			]
+		}
+	).code
+
+	compiledJsx = compiledJsx.replace(
+		/^import(?:["'].*?['']|.*?;)?\n?/gm,
+		""
+	)
+	compiledJsx = compiledJsx.replace(
+		/export (default )?.*;?\n?/g,
+		""
+	)
+
+	const componentNameMatch =
+		compiledJsx.match(
+			/(?:function|class)\s+([A-Z][a-zA-Z0-9]*)\s*(?:\(|extends)/
+		)
+	if (
+		componentNameMatch &&
+		componentNameMatch[1]
+	) {
+		componentName =
+			componentNameMatch[1]
+		logToBoth(
+			`找到主组件名: ${componentName}`
 		)
-		logToBoth(`JSX 编译结果已保存。`)
+	} else {
+		const topLevelVarMatch =
+			compiledJsx.match(
+				/const\s+([A-Z][a-zA-Z0-9]*)\s*=/
+			)
+		if (
+			topLevelVarMatch &&
+			topLevelVarMatch[1]
+		) {
+			componentName =
+				topLevelVarMatch[1]
+			logToBoth(
+				`找到顶层组件变量: ${componentName}`
+			)
+		} else {
+			logToBoth(
+				'未能可靠地提取组件名。默认为 "App"。',
+				true
+			)
+		}
+	}
 
-		logToBoth(`开始构建 HTML 内容...`)
+	compiledJsx += `\nwindow.App = ${componentName};`
+	compiledJsx = `'use strict';\n${compiledJsx}`
+	writeCompileCache(cacheKey, compiledJsx)
+	return {
+		js: compiledJsx,
+		cacheHit: false
+	}
+}
 
-		// 3. 构建 HTML 页面
-		// 注意：这里的 background-image URL 将使用相对路径，因为将通过 HTTP 服务器提供
-		const htmlContent = `
+// 3. 构建 HTML 页面
+// 注意：这里的 background-image URL 将使用相对路径，因为将通过 HTTP 服务器提供
+function buildHtml(compiledCss, compiledJsx) {
+	return `
             <!DOCTYPE html>
             <html lang="en">
             <head>
                 <meta charset="UTF-8">
                 <meta name="viewport" content="width=device-width, initial-scale=1.0">
                 <title>Generated Page</title>
-                <script src="https://unpkg.com/react@18/umd/react.production.min.js"></script>
-                <script src="https://unpkg.com/react-dom@18/umd/react-dom.production.min.js"></script>
-                
+                <script src="/vendor/react.production.min.js"></script>
+                <script src="/vendor/react-dom.production.min.js"></script>
+
                 <!-- 注入编译后的 CSS -->
                 <style id="generated-style">
                     html, body {
@@ -487,7 +760,7 @@ async function renderAndScreenshot() {
                         margin: 0;
                         padding: 0;
                     }
-                    body { 
+                    body {
                         background-size: cover;
                         background-position: center;
                         background-repeat: no-repeat;
@@ -497,277 +770,474 @@ async function renderAndScreenshot() {
             </head>
             <body>
                 <div id="root" style="min-height: 100vh;"></div>
+                <!-- 错误钩子和就绪探针放在生成代码之前的独立脚本中：生成代码顶层抛错只会中止它自己的脚本，
+                     失败标记仍会被设置，waitForPageReady 立即返回而不是等到超时 -->
                 <script type="text/javascript">
-                    ${compiledJsx}
+                    window.addEventListener('error', function () {
+                        window.__renderFailed = true;
+                    });
 
+                    // 就绪探针：子组件的 effect 先于父组件执行，探针的 effect 触发时 App 的首次提交已完成
+                    function RenderReadyProbe(props) {
+                        React.useEffect(function () {
+                            window.__reactCommitted = true;
+                        }, []);
+                        return props.children;
+                    }
+                </script>
+                <script type="text/javascript">
+                    ${compiledJsx}
+                </script>
+                <script type="text/javascript">
                     console.log('尝试渲染组件...');
                     try {
                         if (typeof window.App === 'function') {
                             console.log('找到组件: window.App. 尝试渲染...');
-                            ReactDOM.createRoot(document.getElementById('root')).render(React.createElement(window.App));
+                            ReactDOM.createRoot(document.getElementById('root')).render(React.createElement(RenderReadyProbe, null, React.createElement(window.App)));
                             console.log('React 组件渲染成功。');
                         } else {
                             const errorMsg = "编译后无法找到 'window.App' React 组件。请检查 compiled_code.js。";
                             console.error('❌', errorMsg);
                             document.getElementById('root').innerHTML = '<div style="color: red; padding: 20px;">组件未找到错误: ' + errorMsg + '</div>';
+                            window.__renderFailed = true;
                         }
                     } catch (renderError) {
                         console.error("❌ 浏览器上下文中 React 渲染错误:", renderError.message);
                         document.getElementById('root').innerHTML = '<div style="color: red; padding: 20px;">React 渲染错误: ' + renderError.message + '</div>';
+                        window.__renderFailed = true;
                     }
                 </script>
             </body>
             </html>
         `
-		logToBoth(`HTML 内容已构建。`)
-
-		// --- MODIFIED: 启动本地 HTTP 服务器 ---
-		const serverPort = 8080 // 您可以根据需要更改此端口
+}
 
-		server = http.createServer(
-			(req, res) => {
-				const parsedUrl = url.parse(
-					req.url
-				)
-				let requestPath =
-					parsedUrl.pathname
+// 等待页面就绪：React 首次提交完成 (或渲染已失败)，且所有 <img>、CSS 背景图解码完成、字体加载完成。
+// 整个等待过程不超过 readyTimeoutMs；超时后不报错，照常截图，并在结果中标记 timedOut。
+async function waitForPageReady(
+	page,
+	readyTimeoutMs
+) {
+	const startedAt = Date.now()
+	try {
+		await page.waitForFunction(
+			() =>
+				window.__reactCommitted ===
+					true ||
+				window.__renderFailed === true,
+			null,
+			{
+				timeout: readyTimeoutMs,
+				polling: "raf"
+			}
+		)
+	} catch (error) {
+		return { timedOut: true }
+	}
 
-				// 移除开头的斜杠，并处理可能的根目录请求
+	const remainingMs = Math.max(
+		0,
+		readyTimeoutMs -
+			(Date.now() - startedAt)
+	)
+	const assetsReady = await page.evaluate(
+		async (remainingMs) => {
+			const backgroundUrls = new Set()
+			for (const element of document.querySelectorAll(
+				"*"
+			)) {
+				const backgroundImage =
+					getComputedStyle(
+						element
+					).backgroundImage
 				if (
-					requestPath.startsWith("/")
+					!backgroundImage ||
+					backgroundImage === "none"
 				) {
-					requestPath =
-						requestPath.substring(1)
+					continue
 				}
+				for (const match of backgroundImage.matchAll(
+					/url\(["']?(.*?)["']?\)/g
+				)) {
+					backgroundUrls.add(match[1])
+				}
+			}
 
-				const filePath = path.join(
-					outputDir,
-					requestPath
-				) // 从 outputDir 提供文件
-
-				logToBoth(
-					`Server Request: ${req.url} -> 尝试提供文件: ${filePath}`
-				)
-
-				fs.stat(
-					filePath,
-					(err, stats) => {
-						if (err) {
-							logToBoth(
-								`Server Error (stat): ${err.message} for ${filePath}`,
-								true
-							)
-							res.writeHead(404, {
-								"Content-Type":
-									"text/plain"
-							})
-							res.end("404 Not Found")
-							return
-						}
-
-						if (stats.isDirectory()) {
-							// 如果是目录，尝试提供 index.html
-							const indexFilePath =
-								path.join(
-									filePath,
-									"index.html"
-								)
-							fs.access(
-								indexFilePath,
-								fs.constants.F_OK,
-								(err) => {
-									if (err) {
-										logToBoth(
-											`Server Error (access index.html): ${err.message} for ${indexFilePath}`,
-											true
-										)
-										res.writeHead(403, {
-											"Content-Type":
-												"text/plain"
-										})
-										res.end(
-											"403 Forbidden"
-										)
-									} else {
-										serveStaticFile(
-											indexFilePath,
-											res,
-											logToBoth
-										)
-									}
-								}
-							)
-						} else {
-							serveStaticFile(
-								filePath,
-								res,
-								logToBoth
-							)
-						}
-					}
+			// 加载失败的图片同样视为“已就绪”，截图中就是它失败后的样子
+			const decodes = [
+				...document.images
+			].map((img) =>
+				img.decode().catch(() => {})
+			)
+			for (const src of backgroundUrls) {
+				const img = new Image()
+				img.src = src
+				decodes.push(
+					img.decode().catch(() => {})
 				)
 			}
-		)
+			if (document.fonts) {
+				decodes.push(document.fonts.ready)
+			}
 
-		await new Promise(
-			(resolve, reject) => {
-				server.listen(
-					serverPort,
-					(err) => {
-						if (err) {
-							logToBoth(
-								`❌ 本地 HTTP 服务器启动失败: ${err.message}`,
-								true
+			const allDecoded = Promise.all(
+				decodes
+			).then(
+				() =>
+					// 再等两帧，确保解码后的图片已经绘制到页面上
+					new Promise((resolve) =>
+						requestAnimationFrame(() =>
+							requestAnimationFrame(() =>
+								resolve(true)
 							)
-							return reject(err)
-						}
-						logToBoth(
-							`✅ 本地 HTTP 服务器已在 http://localhost:${serverPort} 启动`
 						)
-						resolve()
-					}
+					)
+			)
+			const timeout = new Promise(
+				(resolve) =>
+					setTimeout(
+						() => resolve(false),
+						remainingMs
+					)
+			)
+			return Promise.race([
+				allDecoded,
+				timeout
+			])
+		},
+		remainingMs
+	)
+	return { timedOut: !assetsReady }
+}
+
+// 给页面挂上日志监听：页面错误、控制台输出以及图片/资源的网络请求状态。
+// 只有 trace 级别才记录每条控制台输出和每个资源请求，其他级别只监听错误，减少和浏览器之间的往返。
+function attachPageListeners(page, logToBoth) {
+	// 捕获所有页面错误和控制台日志
+	page.on("pageerror", (error) => {
+		const logMsg = `❌ 浏览器页面错误 (运行时 JS 错误): ${error.message}\n堆栈: ${error.stack}`
+		logToBoth(logMsg, true)
+	})
+	page.on(
+		"console",
+		async (message) => {
+			if (
+				!logToBoth.trace &&
+				message.type() !== "error"
+			) {
+				return
+			}
+			const args = await Promise.all(
+				message
+					.args()
+					.map((arg) =>
+						arg
+							.jsonValue()
+							.catch(() => "")
+					)
+			)
+			const logMsg = `浏览器控制台 [${message.type()}]: ${args.join(
+				" "
+			)}`
+			logToBoth(logMsg)
+			if (
+				message.type() === "error"
+			) {
+				logToBoth(
+					`❌ 浏览器控制台错误: ${args.join(
+						" "
+					)}`,
+					true
 				)
 			}
-		)
-		// --- 结束启动本地 HTTP 服务器 ---
+		}
+	)
 
-		// 将 HTML 内容写入临时文件，供服务器提供
-		const tempHtmlFileName = `${itemBaseName}_served_page.html`
-		const tempHtmlFilePath = path.join(
-			outputDir,
-			tempHtmlFileName
-		)
-		fs.writeFileSync(
-			tempHtmlFilePath,
-			htmlContent,
-			"utf8"
-		)
-		logToBoth(
-			`临时 HTML 文件已保存到 ${tempHtmlFilePath}`
-		)
+	// --- 网络请求监听器以捕获图片加载状态 ---
+	const isTrackedRequest = (request) =>
+		request
+			.url()
+			.startsWith("http") &&
+		(request.resourceType() ===
+			"image" ||
+			request
+				.url()
+				.includes("assets/"))
 
-		// 现在让 Playwright 导航到 HTTP URL
-		const pageUrl = `http://localhost:${serverPort}/${tempHtmlFileName}`
-		await page.goto(pageUrl, {
-			waitUntil: "networkidle"
+	if (logToBoth.trace) {
+		page.on("load", () => {
+			logToBoth(
+				"✅ Playwright 页面 DOMContentLoaded 或 Load 事件触发。"
+			)
 		})
-		logToBoth(
-			`✅ Playwright 已导航到 ${pageUrl}`
-		)
-
-		logToBoth(
-			"检查 body 元素的 background-image 样式..."
-		)
-		const backgroundImage =
-			await page.evaluate(() => {
-				const body =
-					document.querySelector("body")
-				if (body) {
-					const computedStyle =
-						window.getComputedStyle(
-							body
-						)
-					return computedStyle.getPropertyValue(
-						"background-image"
+		page.on("request", (request) => {
+			if (isTrackedRequest(request)) {
+				logToBoth(
+					`➡️ 请求资源: ${request.url()} (类型: ${request.resourceType()})`
+				)
+			}
+		})
+	}
+	page.on(
+		"response",
+		async (response) => {
+			const request =
+				response.request()
+			if (isTrackedRequest(request)) {
+				const status =
+					response.status()
+				const responseUrl =
+					response.url() // 使用 responseUrl 来避免与 Node.js url 模块混淆
+				if (
+					status >= 200 &&
+					status < 300
+				) {
+					logToBoth(
+						`✅ 资源加载成功: ${responseUrl} (类型: ${request.resourceType()}, 状态码: ${status})`
+					)
+				} else {
+					logToBoth(
+						`❌ 资源加载失败: ${responseUrl} (类型: ${request.resourceType()}, 状态码: ${status})`,
+						true
 					)
 				}
-				return "body element not found or no background-image."
-			})
-		logToBoth(
-			`<body> 元素的 background-image 计算样式: ${backgroundImage}`
+			}
+		}
+	)
+	page.on(
+		"requestfailed",
+		(request) => {
+			if (isTrackedRequest(request)) {
+				logToBoth(
+					`❌ 资源请求失败 (Request Failed): ${request.url()} 错误: ${
+						request.failure()
+							?.errorText ||
+						"未知错误"
+					}`,
+					true
+				)
+			}
+		}
+	)
+	// --- END NETWORK LISTENERS ---
+}
+
+// 在给定的浏览器上下文中渲染一个任务并截图。
+// job: { id, outputPath, jsxCode, scssCode, readyTimeoutMs, logLevel, writeFile, returnScreenshot }，
+// 返回 { ok, error, readyMs, readyTimedOut, compileCacheHit, screenshot, timings }。
+// outputPath 所在目录同时用于提供 assets 和存放日志；writeFile 为 false 时不把截图写到 outputPath，
+// returnScreenshot 为 true 时成功截图的 PNG 字节放在 screenshot 中返回。
+// timings 记录各阶段耗时 (毫秒)：startup_ms (创建页面)、compile_ms (Sass + Babel)、load_ms (加载到就绪)、screenshot_ms
+async function renderJob(
+	context,
+	staticServer,
+	job
+) {
+	const { outputPath, jsxCode, scssCode } =
+		job
+	const outputDir =
+		path.dirname(outputPath)
+	const itemBaseName = path.basename(
+		outputPath,
+		".png"
+	)
+	const logToBoth = createJobLogger(
+		outputPath,
+		job.logLevel || defaultLogLevel
+	)
+	// 调试文件只在 trace 级别下保存
+	const saveDebugFile = (suffix, content) => {
+		if (logToBoth.trace) {
+			writeFileInBackground(
+				path.join(
+					outputDir,
+					`${itemBaseName}${suffix}`
+				),
+				content
+			)
+		}
+	}
+	const timings = {}
+	// 截图保存路径；不落盘时为 undefined，page.screenshot 只返回字节
+	const screenshotPath =
+		job.writeFile === false
+			? undefined
+			: outputPath
+	let page
+
+	try {
+		let stageStartedAt = Date.now()
+		page = await context.newPage()
+		timings.startup_ms =
+			Date.now() - stageStartedAt
+		job.page = page
+		attachPageListeners(page, logToBoth)
+		logToBoth.summary(
+			`✅ 已创建新页面 (任务 ${job.id})。`
 		)
 
-		logToBoth(
-			"检查 HTML 中 <style> 标签的实际内容..."
+		logToBoth(`开始编译 SCSS...`)
+		stageStartedAt = Date.now()
+		const {
+			css: compiledCss,
+			cacheHit: cssCacheHit
+		} = compileScss(scssCode, logToBoth)
+		saveDebugFile(
+			"_received_style.scss",
+			scssCode
 		)
-		const styleTagContent =
-			await page.evaluate(() => {
-				const styleTag =
-					document.getElementById(
-						"generated-style"
-					)
-				return styleTag
-					? styleTag.textContent
-					: 'Style tag with ID "generated-style" not found.'
+		saveDebugFile(
+			"_compiled_style.css",
+			compiledCss
+		)
+		if (logToBoth.trace) {
+			logToBoth(
+				"--- 编译后的完整 CSS 内容开始 ---"
+			)
+			logToBoth(compiledCss)
+			logToBoth(
+				"--- 编译后的完整 CSS 内容结束 ---"
+			)
+		}
+
+		logToBoth(`开始编译 JSX...`)
+		let compiledJsx
+		let jsxCacheHit
+		try {
+			;({
+				js: compiledJsx,
+				cacheHit: jsxCacheHit
+			} = compileJsx(jsxCode, logToBoth))
+			logToBoth("JSX 编译成功。")
+		} catch (babelError) {
+			timings.compile_ms =
+				Date.now() - stageStartedAt
+			logToBoth(
+				`❌ Babel 编译 JSX 错误: ${babelError.message}`,
+				true
+			)
+			await page.setContent(
+				`<html><body><div style="color: red; padding: 20px;">错误：编译 JSX 失败: ${babelError.message}</div></body></html>`
+			)
+			await page.screenshot({
+				path: screenshotPath
 			})
-		logToBoth(
-			"--- <style> 标签内容开始 ---"
+			return {
+				ok: false,
+				error: `Babel 编译 JSX 错误: ${babelError.message}`,
+				timings
+			}
+		}
+		timings.compile_ms =
+			Date.now() - stageStartedAt
+		saveDebugFile(
+			"_received_code.jsx",
+			jsxCode
 		)
-		logToBoth(styleTagContent)
-		logToBoth(
-			"--- <style> 标签内容结束 ---"
+		saveDebugFile(
+			"_compiled_code.js",
+			compiledJsx
+		)
+		logToBoth.summary(
+			`编译完成，耗时 ${timings.compile_ms} ms (SCSS 缓存: ${
+				cssCacheHit ? "命中" : "未命中"
+			}, JSX 缓存: ${
+				jsxCacheHit ? "命中" : "未命中"
+			})。`
 		)
 
-		logToBoth(
-			"为图片加载后的渲染额外添加 3 秒延迟..."
+		const htmlContent = buildHtml(
+			compiledCss,
+			compiledJsx
+		)
+		// 页面 HTML 由本地 HTTP 服务器直接从内存提供；trace 级别下另存一份供调试
+		const pageFileName = `${itemBaseName}_served_page.html`
+		saveDebugFile(
+			"_served_page.html",
+			htmlContent
 		)
-		await page.waitForTimeout(3000)
-		logToBoth("额外延迟结束。")
 
-		logToBoth(
-			"开始获取页面最终渲染的 DOM..."
+		// 把任务输出目录挂载到本地 HTTP 服务器上 (提供 assets 等静态文件)，让 Playwright 导航到 HTTP URL
+		staticServer.mount(
+			job.id,
+			outputDir,
+			logToBoth,
+			{ [pageFileName]: htmlContent }
 		)
-		const pageContent =
-			await page.content()
-		fs.writeFileSync(
-			path.join(
-				outputDir,
-				`${itemBaseName}_final_rendered_dom.html`
-			),
-			pageContent,
-			"utf8"
+		const pageUrl = `http://127.0.0.1:${staticServer.port}/jobs/${job.id}/${pageFileName}`
+		const navigationStartedAt = Date.now()
+		await page.goto(pageUrl, {
+			waitUntil: "domcontentloaded"
+		})
+		logToBoth(
+			`✅ Playwright 已导航到 ${pageUrl}`
 		)
-		logToBoth("页面渲染 HTML 已保存。")
 
-		const rootContent =
-			await page.evaluate(() =>
-				document.getElementById("root")
-					? document.getElementById(
-							"root"
-					  ).innerHTML
-					: "N/A"
+		const readyTimeoutMs =
+			job.readyTimeoutMs ||
+			DEFAULT_READY_TIMEOUT_MS
+		const { timedOut: readyTimedOut } =
+			await waitForPageReady(
+				page,
+				readyTimeoutMs
 			)
-		fs.writeFileSync(
-			path.join(
-				outputDir,
-				`${itemBaseName}_root_inner_html.html`
-			),
-			rootContent,
-			"utf8"
-		)
-		logToBoth("#root 元素内容已保存。")
+		const readyMs =
+			Date.now() - navigationStartedAt
+		timings.load_ms = readyMs
+		if (readyTimedOut) {
+			logToBoth(
+				`⚠️ 页面在 ${readyTimeoutMs} ms 内未完全就绪 (React 提交或图片解码未完成)，直接截图。`,
+				true
+			)
+		} else {
+			logToBoth.summary(
+				`✅ 页面已就绪，耗时 ${readyMs} ms。`
+			)
+		}
+
+		if (logToBoth.trace) {
+			await dumpPageDiagnostics(
+				page,
+				logToBoth,
+				saveDebugFile
+			)
+		}
 
 		logToBoth("开始截图...")
-		await page.screenshot({
-			path: outputPath,
+		stageStartedAt = Date.now()
+		const screenshot = await page.screenshot({
+			path: screenshotPath,
 			fullPage: true
 		})
-		logToBoth(
-			`✅ 截图已保存到 ${outputPath}`
-		)
-
-		// --- 保持浏览器打开更长时间，以便手动调试 ---
-		logToBoth(
-			`\n✅ Playwright 浏览器已启动并渲染页面。`
-		)
-		logToBoth(
-			`请手动检查浏览器窗口并打开开发者工具 (F12) 进行调试。`
-		)
-		logToBoth(
-			`**浏览器将在 2 分钟后自动关闭。在此之前请手动关闭此 Chrome 窗口以完成脚本。**`
+		timings.screenshot_ms =
+			Date.now() - stageStartedAt
+		logToBoth.summary(
+			screenshotPath
+				? `✅ 截图已保存到 ${screenshotPath}`
+				: `✅ 截图完成 (${screenshot.length} 字节，不落盘)。`
 		)
+		return {
+			ok: true,
+			readyMs,
+			readyTimedOut,
+			screenshot: job.returnScreenshot
+				? screenshot
+				: undefined,
+			// SCSS 为空时无需编译，只看 JSX 是否命中
+			compileCacheHit:
+				(!scssCode || cssCacheHit) &&
+				jsxCacheHit,
+			timings
+		}
 	} catch (error) {
 		const errorMsg = `❌ Playwright 或通用渲染错误 (浏览器上下文之外): ${error.message}\n堆栈: ${error.stack}`
 		logToBoth(errorMsg, true)
 
-		if (
-			browser &&
-			!browser.isClosed()
-		) {
+		// 复用同一个上下文保存错误截图，不再为此单独启动浏览器
+		if (page && !page.isClosed()) {
 			try {
-				const pageText = await browser
-					.pages()[0]
-					?.evaluate(
+				const pageText =
+					await page.evaluate(
 						() =>
 							document.body.innerText
 					)
@@ -780,82 +1250,444 @@ async function renderAndScreenshot() {
 						true
 					)
 				}
-			} catch (innerError) {
+				await page.setContent(
+					`<div style="color: red; padding: 20px;">全局错误: ${error.message}<br>堆栈: ${error.stack}</div>`
+				)
+				if (screenshotPath) {
+					await page.screenshot({
+						path: screenshotPath
+					})
+					logToBoth(
+						`错误截图已保存到 ${screenshotPath}`
+					)
+				}
+			} catch (screenshotError) {
 				logToBoth(
-					`❌ 尝试获取浏览器崩溃前内容时出错: ${innerError.message}`,
+					`❌ 无法保存错误截图: ${screenshotError.message}`,
 					true
 				)
 			}
-			await browser.close()
-		} else if (browser) {
-			logToBoth(
-				"浏览器已断开连接或已关闭，无法在错误中操作页面。",
-				true
-			)
+		}
+		return {
+			ok: false,
+			error: error.message,
+			timings
+		}
+	} finally {
+		staticServer.unmount(job.id)
+		if (page && !page.isClosed()) {
+			await page.close().catch(() => {})
+		}
+		logToBoth.summary(`任务 ${job.id} 结束。`)
+		logToBoth.close()
+	}
+}
+
+// trace 级别的页面诊断：body 背景图、<style> 实际内容、最终 DOM 和 #root 的内容
+async function dumpPageDiagnostics(
+	page,
+	logToBoth,
+	saveDebugFile
+) {
+	const backgroundImage =
+		await page.evaluate(() => {
+			const body =
+				document.querySelector("body")
+			if (body) {
+				const computedStyle =
+					window.getComputedStyle(body)
+				return computedStyle.getPropertyValue(
+					"background-image"
+				)
+			}
+			return "body element not found or no background-image."
+		})
+	logToBoth(
+		`<body> 元素的 background-image 计算样式: ${backgroundImage}`
+	)
+
+	const styleTagContent =
+		await page.evaluate(() => {
+			const styleTag =
+				document.getElementById(
+					"generated-style"
+				)
+			return styleTag
+				? styleTag.textContent
+				: 'Style tag with ID "generated-style" not found.'
+		})
+	logToBoth("--- <style> 标签内容开始 ---")
+	logToBoth(styleTagContent)
+	logToBoth("--- <style> 标签内容结束 ---")
+
+	saveDebugFile(
+		"_final_rendered_dom.html",
+		await page.content()
+	)
+	saveDebugFile(
+		"_root_inner_html.html",
+		await page.evaluate(() =>
+			document.getElementById("root")
+				? document.getElementById("root")
+						.innerHTML
+				: "N/A"
+		)
+	)
+	logToBoth("页面最终 DOM 和 #root 元素内容已保存。")
+}
+
+// 从 stdin 读取单次模式的代码：{"jsx": ..., "scss": ...}
+async function readCodeFromStdin() {
+	const chunks = []
+	for await (const chunk of process.stdin) {
+		chunks.push(chunk)
+	}
+	const input = Buffer.concat(chunks)
+		.toString("utf8")
+		.trim()
+	const request = input
+		? JSON.parse(input)
+		: {}
+	return {
+		jsxCode: request.jsx || "",
+		scssCode: request.scss || ""
+	}
+}
+
+// 单次模式：渲染一个页面后退出。代码从 stdin 读入；仍兼容旧的 base64 命令行参数
+async function runOnce(argv, headful) {
+	const outputPath = argv[0] // 截图的最终保存路径
+	let jsxCode
+	let scssCode
+	try {
+		if (argv.length > 1) {
+			jsxCode = Buffer.from(
+				argv[1] || "",
+				"base64"
+			).toString("utf8")
+			scssCode = argv[2]
+				? Buffer.from(
+						argv[2],
+						"base64"
+				  ).toString("utf8")
+				: ""
 		} else {
-			logToBoth(
-				"浏览器未能启动。",
-				true
-			)
+			;({ jsxCode, scssCode } =
+				await readCodeFromStdin())
 		}
+	} catch (error) {
+		console.error(
+			`❌ 无法读取待渲染的代码: ${error.message}`
+		)
+		process.exitCode = 1
+		return
+	}
 
-		try {
-			const tempBrowser =
-				await chromium.launch({
-					headless: true
-				})
-			const tempPage =
-				await tempBrowser.newPage()
-			await tempPage.setContent(
-				`<div style="color: red; padding: 20px;">全局错误: ${error.message}<br>堆栈: ${error.stack}</div>`
-			)
-			await tempPage.screenshot({
-				path: outputPath
-			})
-			await tempBrowser.close()
-			logToBoth(
-				`错误截图已保存到 ${outputPath}`
+	let browser
+	let staticServer
+	try {
+		const vendorScripts =
+			loadVendorScripts()
+		browser = await launchBrowser(headful)
+		staticServer =
+			await startStaticServer(
+				vendorScripts
 			)
-		} catch (screenshotError) {
-			logToBoth(
-				`❌ 无法保存错误截图: ${screenshotError.message}`,
-				true
+		const context = await createContext(
+			browser
+		)
+		const result = await renderJob(
+			context,
+			staticServer,
+			{
+				id: "once",
+				outputPath,
+				jsxCode,
+				scssCode
+			}
+		)
+		if (!result.ok) {
+			console.error(
+				`❌ 渲染失败: ${result.error}`
 			)
+			process.exitCode = 1
 		}
+	} catch (error) {
+		console.error(
+			`❌ 渲染环境启动失败: ${error.message}`
+		)
+		process.exitCode = 1
 	} finally {
 		if (browser) {
-			// 检查 browser 对象是否存在
-			try {
-				// 尝试关闭（如果它仍然存活）。
-				// 如果浏览器已经关闭或断开连接，Playwright 会抛出错误。
-				await browser.close()
-				logToBoth(
-					"✅ Playwright 浏览器已关闭。"
-				)
-			} catch (closeError) {
-				logToBoth(
-					`⚠️ 关闭浏览器时出错或浏览器已断开连接: ${closeError.message}`,
-					true
-				)
-			}
+			await browser.close().catch(() => {})
 		}
-		if (server) {
-			// 确保服务器在 finally 块中被关闭
-			logToBoth(
-				"关闭本地 HTTP 服务器..."
+		if (staticServer) {
+			await staticServer.close()
+		}
+		await flushPendingWrites()
+	}
+}
+
+// 服务模式：预热 N 个浏览器上下文，按 stdin 上到达的顺序分配任务
+async function runServer(workers, headful) {
+	protocolMode = true
+	// 每条消息是一行 JSON；带 payload (截图 PNG) 时在 JSON 中注明字节数，原始字节紧跟其后。
+	// 两次写入在同一个同步调用中完成，不会与其他消息交错。
+	const send = (message, payload) => {
+		if (payload) {
+			message.screenshot_bytes =
+				payload.length
+		}
+		process.stdout.write(
+			JSON.stringify(message) + "\n"
+		)
+		if (payload) {
+			process.stdout.write(payload)
+		}
+	}
+
+	const vendorScripts = loadVendorScripts()
+	const browser = await launchBrowser(
+		headful
+	)
+	browser.on("disconnected", () => {
+		console.error(
+			"💥 Playwright 浏览器连接已断开！渲染服务退出。"
+		)
+		process.exit(1)
+	})
+	const staticServer =
+		await startStaticServer(
+			vendorScripts
+		)
+
+	const slots = []
+	for (let i = 0; i < workers; i++) {
+		slots.push({
+			id: i,
+			context: await createContext(
+				browser
 			)
-			await new Promise((resolve) =>
-				server.close(() => {
-					logToBoth(
-						"✅ 本地 HTTP 服务器已关闭。"
+		})
+	}
+	const idleSlots = [...slots]
+	const waiters = []
+	const acquireSlot = () =>
+		idleSlots.length
+			? Promise.resolve(idleSlots.pop())
+			: new Promise((resolve) =>
+					waiters.push(resolve)
+			  )
+	const releaseSlot = (slot) => {
+		const next = waiters.shift()
+		if (next) {
+			next(slot)
+		} else {
+			idleSlots.push(slot)
+		}
+	}
+
+	async function handleRequest(request) {
+		const job = {
+			id: String(request.id),
+			outputPath: request.output_path,
+			jsxCode: request.jsx || "",
+			scssCode: request.scss || "",
+			readyTimeoutMs:
+				request.ready_timeout_ms,
+			logLevel: LOG_LEVELS.includes(
+				request.log_level
+			)
+				? request.log_level
+				: defaultLogLevel,
+			writeFile: request.write_file !== false,
+			returnScreenshot:
+				request.return_screenshot === true
+		}
+		const timeoutMs =
+			request.timeout_ms ||
+			DEFAULT_JOB_TIMEOUT_MS
+		const receivedAt = Date.now()
+		const slot = await acquireSlot()
+		const startedAt = Date.now()
+		const queueMs = startedAt - receivedAt // 等待空闲浏览器上下文的时间
+		// 任务拿到上下文后才开始按 timeout_ms 计时：通知 Python 端从此刻起计算该任务的截止时间
+		send({
+			type: "started",
+			id: request.id
+		})
+		let timer
+		try {
+			const timeout = new Promise(
+				(resolve) => {
+					timer = setTimeout(
+						() =>
+							resolve({
+								ok: false,
+								error: `渲染超时 (${timeoutMs} ms)`,
+								timedOut: true
+							}),
+						timeoutMs
 					)
-					resolve()
-				})
+				}
 			)
+			const result = await Promise.race([
+				renderJob(
+					slot.context,
+					staticServer,
+					job
+				),
+				timeout
+			])
+			if (result.timedOut) {
+				// 超时的任务可能仍卡在页面里：直接丢弃整个上下文，换一个新的
+				await slot.context
+					.close()
+					.catch(() => {})
+				slot.context =
+					await createContext(browser)
+			}
+			send({
+				id: request.id,
+				ok: result.ok,
+				error: result.error || null,
+				output_path: job.outputPath,
+				duration_ms:
+					Date.now() - startedAt,
+				ready_ms: result.readyMs ?? null,
+				ready_timed_out:
+					result.readyTimedOut ?? null,
+				compile_cache_hit:
+					result.compileCacheHit ?? null,
+				timings: {
+					queue_ms: queueMs,
+					...result.timings
+				}
+			}, result.ok ? result.screenshot : undefined)
+		} catch (error) {
+			send({
+				id: request.id,
+				ok: false,
+				error: error.message,
+				output_path: job.outputPath,
+				duration_ms:
+					Date.now() - startedAt,
+				timings: {
+					queue_ms: queueMs
+				}
+			})
+		} finally {
+			clearTimeout(timer)
+			releaseSlot(slot)
 		}
-		browserLogStream.end()
-		logToBoth(`脚本执行结束。`)
+	}
+
+	const inFlight = new Set()
+	const rl = readline.createInterface({
+		input: process.stdin,
+		crlfDelay: Infinity
+	})
+	rl.on("line", (line) => {
+		if (!line.trim()) {
+			return
+		}
+		let request
+		try {
+			request = JSON.parse(line)
+		} catch (parseError) {
+			console.error(
+				`❌ 无法解析渲染请求: ${parseError.message}`
+			)
+			return
+		}
+		const task = handleRequest(
+			request
+		).finally(() =>
+			inFlight.delete(task)
+		)
+		inFlight.add(task)
+	})
+	rl.on("close", async () => {
+		// stdin 关闭即表示 Python 端不再提交任务：等待进行中的任务完成后退出
+		await Promise.allSettled([
+			...inFlight
+		])
+		browser.removeAllListeners(
+			"disconnected"
+		)
+		await browser.close().catch(() => {})
+		await staticServer.close()
+		await flushPendingWrites()
+		process.exit(0)
+	})
+
+	send({
+		type: "ready",
+		workers,
+		port: staticServer.port,
+		startup_ms: Math.round(
+			process.uptime() * 1000
+		) // 从进程启动到浏览器和全部上下文就绪的耗时
+	})
+}
+
+function main() {
+	let args = process.argv.slice(2)
+	const headful = args.includes("--headful")
+	const logLevelIndex =
+		args.indexOf("--log-level")
+	if (logLevelIndex >= 0) {
+		const logLevel = args[logLevelIndex + 1]
+		if (!LOG_LEVELS.includes(logLevel)) {
+			console.error(
+				`❌ 未知的日志级别: ${logLevel}，可选值为 ${LOG_LEVELS.join(
+					", "
+				)}`
+			)
+			process.exit(2)
+		}
+		defaultLogLevel = logLevel
+		args.splice(logLevelIndex, 2)
+	}
+	const compileCacheDirIndex = args.indexOf(
+		"--compile-cache-dir"
+	)
+	if (compileCacheDirIndex >= 0) {
+		configureCompileCache(
+			args[compileCacheDirIndex + 1],
+			args.includes("--compile-cache-read-only")
+		)
+		args.splice(compileCacheDirIndex, 2)
+	}
+	args = args.filter(
+		(arg) =>
+			arg !== "--headful" &&
+			arg !== "--compile-cache-read-only"
+	)
+	if (args.includes("--server")) {
+		const workersIndex =
+			args.indexOf("--workers")
+		const workers =
+			workersIndex >= 0
+				? Math.max(
+						1,
+						parseInt(
+							args[workersIndex + 1],
+							10
+						) || 1
+				  )
+				: 1
+		runServer(workers, headful).catch(
+			(error) => {
+				console.error(
+					`❌ 渲染服务启动失败: ${error.message}`
+				)
+				process.exit(1)
+			}
+		)
+	} else {
+		runOnce(args, headful)
 	}
 }
 
-renderAndScreenshot()
+main()
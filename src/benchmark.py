@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+import gpt4o_codegen
+from gpt4o_codegen import generate_code_from_screenshot
+from render_pool import RENDERER_SCRIPT_PATH, RENDER_LOG_LEVELS
+from pipeline import BatchPipeline, default_metric_workers
+from response_cache import DiskCache
+from dataset_index import DatasetIndex, ITEM_FILES, link_assets
+from timing import summarize_timings
+
+DEFAULT_DATASET_ROOT = os.path.join('data', 'processed', 'ui2code_dataset')
+
+
+class ReplayCompletions:
+    """
+    模拟 chat.completions：不访问网络，按当前线程正在处理的项目回放数据集中的真实代码 (index.jsx / style.scss)，
+    并在返回前休眠 latency_ms ± jitter_ms 模拟接口延迟。token 用量按 4 个字符一个 token 粗略估算。
+    """
+
+    def __init__(self, dataset_index: DatasetIndex, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0):
+        self.dataset_index = dataset_index
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._current = threading.local()
+        self._outputs = {}
+
+    def set_current_item(self, item_id: str):
+        self._current.item_id = item_id
+
+    def _model_output(self, item_id: str) -> str:
+        output = self._outputs.get(item_id)
+        if output is None:
+            code = {"jsx": "", "scss": ""}
+            for key in code:
+                path = os.path.join(self.dataset_index.item_dir(item_id), ITEM_FILES[key])
+                if os.path.exists(path):
+                    with open(path, 'r', encoding='utf-8') as f:
+                        code[key] = f.read().strip()
+            output = self._outputs.setdefault(item_id, gpt4o_codegen.format_model_output(code["jsx"], code["scss"]))
+        return output
+
+    def create(self, **request_kwargs):
+        item_id = getattr(self._current, "item_id", None)
+        if item_id is None:
+            raise RuntimeError("ReplayCompletions: 当前线程没有设置要回放的项目")
+        with self._random_lock:
+            delay_ms = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms))
+        time.sleep(delay_ms / 1000)
+
+        output = self._model_output(item_id)
+        num_samples = request_kwargs.get("n", 1)
+        prompt_tokens = len(json.dumps(request_kwargs.get("messages", []), ensure_ascii=False)) // 4
+        completion_tokens = len(output) // 4 * num_samples
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=output)) for _ in range(num_samples)],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                  total_tokens=prompt_tokens + completion_tokens),
+        )
+
+
+def peak_rss_mb() -> dict:
+    """
+    峰值常驻内存 (MB)：self 为当前 Python 进程；children 为已退出的子进程 (渲染服务、指标进程) 中最大的一个。
+    """
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024  # macOS 上 ru_maxrss 以字节为单位，Linux 上为 KB
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit, 1),
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args) -> dict:
+    dataset_index = DatasetIndex.load_or_build(args.dataset, args.dataset_index)
+    item_ids = dataset_index.item_ids()
+    if args.items:
+        item_ids = item_ids[:args.items]
+    if not item_ids:
+        raise SystemExit(f"❌ 错误：数据集 {args.dataset} 中没有可用的项目。")
+    # 每次重复使用独立的输出目录，避免断点续跑式的复用
+    tasks = [(repeat, item_id) for repeat in range(args.repeat) for item_id in item_ids]
+
+    config = gpt4o_codegen.get_config()
+    completions = ReplayCompletions(dataset_index, args.latency_ms, args.latency_jitter_ms, args.seed)
+    # 基准测试不访问真实接口：直接替换模块级 client，不需要配置 API key
+    gpt4o_codegen.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    output_root = args.output_dir or tempfile.mkdtemp(prefix='ui2code_bench_')
+    render_cache = DiskCache(args.cache_dir, 'render') if args.cache_dir else None
+    image_cache = DiskCache(args.cache_dir, 'image_prep') if args.cache_dir else None
+    compile_cache_dir = DiskCache(args.cache_dir, 'compile').root if args.cache_dir else None
+
+    try:
+        with config.create_render_pool(workers=args.render_workers, script_path=args.renderer_script,
+                                       compile_cache_dir=compile_cache_dir,
+                                       log_level=args.render_log_level) as render_pool, \
+             BatchPipeline(
+                 llm_workers=args.llm_workers,
+                 render_workers=args.render_workers,
+                 metric_workers=args.metric_workers,
+                 max_inflight=args.max_inflight
+             ) as pipeline:
+
+            def process_task(task):
+                repeat, item_id = task
+                output_base_dir = os.path.join(output_root, f'repeat_{repeat}')
+                source_assets_dir = os.path.join(dataset_index.item_dir(item_id), 'assets')
+                if os.path.isdir(source_assets_dir):
+                    link_assets(source_assets_dir, os.path.join(output_base_dir, item_id, 'assets'))
+                completions.set_current_item(item_id)
+                return generate_code_from_screenshot(
+                    dataset_index.screenshot_path(item_id),
+                    output_base_dir=output_base_dir,
+                    render_pool=render_pool,
+                    pipeline=pipeline,
+                    render_cache=render_cache,
+                    image_cache=image_cache,
+                    save_screenshots=not args.no_save_screenshots,
+                    dataset_index=dataset_index,
+                    num_samples=args.num_samples
+                )
+
+            started_at = time.perf_counter()
+            results = pipeline.map(process_task, tasks)
+            wall_seconds = time.perf_counter() - started_at
+            render_startup_ms = render_pool.startup_ms
+    finally:
+        if not args.output_dir and not args.keep_outputs:
+            shutil.rmtree(output_root, ignore_errors=True)
+
+    metrics_list = [result.get("metrics", {}) for result in results]
+    return {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "git_revision": git_revision(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "dataset": args.dataset,
+            "items": len(item_ids),
+            "repeat": args.repeat,
+            "llm_workers": args.llm_workers,
+            "render_workers": args.render_workers,
+            "metric_workers": args.metric_workers,
+            "max_inflight": args.max_inflight,
+            "latency_ms": args.latency_ms,
+            "latency_jitter_ms": args.latency_jitter_ms,
+            "num_samples": args.num_samples,
+            "cache": bool(args.cache_dir),
+            "renderer_script": args.renderer_script,
+        },
+        "tasks": len(tasks),
+        "succeeded": sum(1 for result in results if result.get("status") == "success"),
+        "rendered": sum(1 for metrics in metrics_list if metrics.get("rendering_success")),
+        "wall_seconds": round(wall_seconds, 3),
+        "items_per_second": round(len(tasks) / wall_seconds, 3) if wall_seconds > 0 else None,
+        "render_startup_ms": render_startup_ms,
+        "stage_timings_ms": summarize_timings([metrics.get("timings") for metrics in metrics_list]),
+        "peak_rss_mb": peak_rss_mb(),
+        "errors": sorted({metrics.get("error_details") for metrics in metrics_list if metrics.get("error_details")}),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线基准测试：用回放真实代码的模拟模型跑完整的生成 / 渲染 / 打分流水线，输出吞吐量、各阶段耗时分位数和峰值内存 (JSON)。")
+    parser.add_argument('--dataset', default=DEFAULT_DATASET_ROOT, help="数据集目录")
+    parser.add_argument('--dataset-index', default=None, help="数据集索引文件路径，默认为数据集目录下的 dataset_index.json")
+    parser.add_argument('--items', type=int, default=0, help="只使用前 N 个项目 (0 表示全部)")
+    parser.add_argument('--repeat', type=int, default=1, help="整个项目列表重复的次数，用于积累更多样本")
+    parser.add_argument('--latency-ms', type=float, default=2000.0, help="模拟模型的平均响应延迟 (毫秒)")
+    parser.add_argument('--latency-jitter-ms', type=float, default=500.0, help="延迟在平均值上下均匀抖动的幅度 (毫秒)")
+    parser.add_argument('--seed', type=int, default=0, help="延迟抖动的随机种子")
+    parser.add_argument('--llm-workers', type=int, default=4, help="同时进行的 LLM 请求数")
+    parser.add_argument('--render-workers', type=int, default=gpt4o_codegen.get_config().render_workers, help="渲染服务中并发的浏览器上下文数")
+    parser.add_argument('--metric-workers', type=int, default=default_metric_workers(), help="计算指标的进程数 (0 表示在工作线程内直接计算)")
+    parser.add_argument('--max-inflight', type=int, default=None, help="同时在途的项目数上限")
+    parser.add_argument('--num-samples', type=int, default=1, help="best-of-N 的候选数")
+    parser.add_argument('--render-log-level', choices=RENDER_LOG_LEVELS, default='off', help="渲染日志级别 (基准测试默认关闭日志)")
+    parser.add_argument('--renderer-script', default=RENDERER_SCRIPT_PATH, help="渲染脚本路径")
+    parser.add_argument('--cache-dir', default=None, help="使用该目录下的渲染 / 图片预处理 / 编译缓存 (默认不使用缓存，测量冷路径)")
+    parser.add_argument('--no-save-screenshots', action='store_true', help="渲染截图不写入磁盘")
+    parser.add_argument('--output-dir', default=None, help="生成结果的保存目录 (默认使用临时目录并在结束后删除)")
+    parser.add_argument('--keep-outputs', action='store_true', help="保留临时目录中的生成结果")
+    parser.add_argument('--json', default=None, help="把基准测试结果写入该文件 (默认只打印到标准输出)")
+    args = parser.parse_args()
+
+    # 流水线的进度输出转到标准错误，标准输出只保留 JSON 结果
+    with redirect_stdout(sys.stderr):
+        report = run_benchmark(args)
+    report_text = json.dumps(report, indent=4, ensure_ascii=False)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            f.write(report_text)
+    print(report_text)
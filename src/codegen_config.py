@@ -0,0 +1,140 @@
+import os
+import threading
+
+current_script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROMPTS_DIR = os.path.join(current_script_dir, 'prompts')
+# prompt 名称 -> 文件名；system 和 user_template 为必需
+PROMPT_FILES = {
+    "system": 'ui2code_system_prompt.txt',
+    "user_template": 'ui2code_user_template.txt',
+    "shot0_user": 'shot0_user.txt',
+    "shot0_assistant": 'shot0_assistant.txt',
+    "refine_user_template": 'refine_user_template.txt',
+}
+REQUIRED_PROMPTS = ("system", "user_template")
+
+
+class PromptConfigError(RuntimeError):
+    """
+    必需的 prompt 文件缺失或内容为空。
+    """
+
+
+def load_prompt_from_file(filepath: str) -> str:
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        print(f"❌ 错误：Prompt 文件未找到：{filepath}。请检查路径和文件名。")
+        return ""
+    except Exception as e:
+        print(f"❌ 错误：加载 prompt 文件 {filepath} 时出错：{e}")
+        return ""
+
+
+class Prompts:
+    """
+    一次运行使用的全部 prompt 文本。
+    """
+
+    def __init__(self, system: str, user_template: str, shot0_user: str = "", shot0_assistant: str = "",
+                 refine_user_template: str = ""):
+        self.system = system
+        self.user_template = user_template
+        self.shot0_user = shot0_user
+        self.shot0_assistant = shot0_assistant
+        self.refine_user_template = refine_user_template
+
+    @classmethod
+    def load(cls, prompts_dir: str = DEFAULT_PROMPTS_DIR) -> 'Prompts':
+        texts = {name: load_prompt_from_file(os.path.join(prompts_dir, filename)) for name, filename in PROMPT_FILES.items()}
+        missing = [PROMPT_FILES[name] for name in REQUIRED_PROMPTS if not texts[name]]
+        if missing:
+            raise PromptConfigError(f"系统或用户 Prompt 内容为空：{', '.join(missing)}。请检查 {prompts_dir} 中的文件是否正确加载。")
+        return cls(**texts)
+
+
+class CodegenConfig:
+    """
+    生成流程的运行配置：prompt 目录、模型接口 (API key / base url)、渲染服务和限流的默认参数。
+    创建配置时不读取文件、不创建客户端：prompt 在第一次访问 prompts 时读取，
+    客户端和渲染服务由 create_client() / create_llm_client() / create_render_pool() 按需创建。
+    """
+
+    def __init__(self, prompts_dir: str = DEFAULT_PROMPTS_DIR, api_key: str = None, base_url: str = None,
+                 render_workers: int = 2, render_job_timeout: float = 60.0, render_ready_timeout: float = 10.0,
+                 render_log_level: str = 'errors', llm_requests_per_minute: float = None,
+                 llm_tokens_per_minute: float = None):
+        self.prompts_dir = prompts_dir
+        self.api_key = api_key
+        self.base_url = base_url
+        self.render_workers = render_workers                 # 渲染服务中预热的浏览器上下文数量
+        self.render_job_timeout = render_job_timeout         # 单个渲染任务的超时时间 (秒)
+        self.render_ready_timeout = render_ready_timeout     # 等待页面就绪的上限 (秒)，超过后直接截图
+        self.render_log_level = render_log_level             # 渲染日志级别 (off / errors / summary / trace)
+        self.llm_requests_per_minute = llm_requests_per_minute  # 账号的 RPM 限额
+        self.llm_tokens_per_minute = llm_tokens_per_minute      # 账号的 TPM 限额
+        self._prompts = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, env_file: str = None, **overrides) -> 'CodegenConfig':
+        """
+        从环境变量 (以及 .env 文件，如果存在) 读取配置；overrides 中的参数优先。
+        """
+        from dotenv import load_dotenv
+        load_dotenv(env_file)
+
+        def optional_float(name):
+            value = os.getenv(name)
+            return float(value) if value else None
+
+        values = {
+            "api_key": os.getenv("OPENAI_API_KEY"),
+            "base_url": os.getenv("OPENAI_API_BASE"),
+            "render_workers": int(os.getenv("RENDER_WORKERS", "2")),
+            "render_job_timeout": float(os.getenv("RENDER_JOB_TIMEOUT", "60")),
+            "render_ready_timeout": float(os.getenv("RENDER_READY_TIMEOUT", "10")),
+            "render_log_level": os.getenv("RENDER_LOG_LEVEL", "errors"),
+            "llm_requests_per_minute": optional_float("LLM_RPM"),
+            "llm_tokens_per_minute": optional_float("LLM_TPM"),
+        }
+        values.update(overrides)
+        return cls(**values)
+
+    @property
+    def prompts(self) -> Prompts:
+        """
+        第一次访问时从 prompts_dir 读取；必需的 prompt 为空时抛出 PromptConfigError。
+        """
+        with self._lock:
+            if self._prompts is None:
+                self._prompts = Prompts.load(self.prompts_dir)
+            return self._prompts
+
+    def create_client(self):
+        """
+        创建同步的 OpenAI 客户端。
+        """
+        from openai import OpenAI
+        return OpenAI(api_key=self.api_key, base_url=self.base_url)
+
+    def create_llm_client(self, **options):
+        """
+        创建带限流、重试和预算控制的 LLMClient；options 覆盖默认参数。
+        """
+        from llm_client import LLMClient
+        options.setdefault("requests_per_minute", self.llm_requests_per_minute)
+        options.setdefault("tokens_per_minute", self.llm_tokens_per_minute)
+        return LLMClient(api_key=self.api_key, base_url=self.base_url, **options)
+
+    def create_render_pool(self, **options):
+        """
+        创建常驻渲染服务 (尚未启动)；options 覆盖默认参数。
+        """
+        from render_pool import RenderPool
+        options.setdefault("workers", self.render_workers)
+        options.setdefault("job_timeout", self.render_job_timeout)
+        options.setdefault("ready_timeout", self.render_ready_timeout)
+        options.setdefault("log_level", self.render_log_level)
+        return RenderPool(**options)
@@ -0,0 +1,202 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+
+INDEX_VERSION = 1
+INDEX_FILENAME = 'dataset_index.json'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.svg')
+# 每个项目目录中的固定文件：截图和真实代码
+ITEM_FILES = {"screenshot": 'screenshot.png', "jsx": 'index.jsx', "scss": 'style.scss'}
+
+_SVG_HEAD_BYTES = 4096
+_SVG_TAG_PATTERN = re.compile(rb'<svg\b[^>]*>', re.IGNORECASE | re.DOTALL)
+_SVG_LENGTH_PATTERN = r'\b{}\s*=\s*["\']\s*([\d.]+)\s*(?:px)?\s*["\']'
+_SVG_VIEWBOX_PATTERN = re.compile(rb'\bviewBox\s*=\s*["\']\s*[-\d.]+[\s,]+[-\d.]+[\s,]+([\d.]+)[\s,]+([\d.]+)\s*["\']', re.IGNORECASE)
+
+
+def read_image_size(image_path: str) -> tuple[int, int] | None:
+    """
+    只读取文件头获取图片的 (宽, 高)，不解码像素。
+    位图使用 PIL 的延迟加载；SVG 读取根元素的 width/height 属性，缺失时使用 viewBox。无法识别时返回 None。
+    """
+    if image_path.lower().endswith('.svg'):
+        with open(image_path, 'rb') as f:
+            match = _SVG_TAG_PATTERN.search(f.read(_SVG_HEAD_BYTES))
+        if not match:
+            return None
+        tag = match.group()
+        width = re.search(_SVG_LENGTH_PATTERN.format('width').encode(), tag)
+        height = re.search(_SVG_LENGTH_PATTERN.format('height').encode(), tag)
+        if width and height:
+            return round(float(width.group(1))), round(float(height.group(1)))
+        viewbox = _SVG_VIEWBOX_PATTERN.search(tag)
+        if viewbox:
+            return round(float(viewbox.group(1))), round(float(viewbox.group(2)))
+        return None
+    from PIL import Image
+    try:
+        with Image.open(image_path) as img:
+            return img.size
+    except (OSError, SyntaxError):
+        return None
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_entry(path: str, stat: os.stat_result, previous: dict | None) -> dict:
+    """
+    生成单个文件的索引条目。大小和修改时间都没变时直接沿用上一次的条目，不再读取文件内容。
+    """
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime_ns") == stat.st_mtime_ns:
+        return previous
+    entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": _sha256_file(path)}
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        size = read_image_size(path)
+        entry["width"], entry["height"] = size if size else (None, None)
+    return entry
+
+
+class DatasetIndex:
+    """
+    数据集索引 (JSON 清单)。每个 item_* 目录记录截图、真实代码 (index.jsx / style.scss) 和 assets/ 中每个文件的
+    大小、修改时间、SHA-256，图片另记录宽高 (只读文件头)。
+    load_or_build 时按 (大小, 修改时间) 增量更新：未变化的文件不重新读取，只有新增或改动的文件才会计算哈希和尺寸。
+    """
+
+    def __init__(self, dataset_root: str, items: dict, index_path: str = None):
+        self.dataset_root = dataset_root
+        self.items = items
+        self.index_path = index_path
+
+    @classmethod
+    def load_or_build(cls, dataset_root: str, index_path: str = None) -> 'DatasetIndex':
+        index_path = index_path or os.path.join(dataset_root, INDEX_FILENAME)
+        previous_items = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+                if stored.get("version") == INDEX_VERSION:
+                    previous_items = stored.get("items", {})
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"⚠️ 警告：无法读取数据集索引 {index_path}，将重新构建：{e}")
+
+        items = {}
+        with os.scandir(dataset_root) as entries:
+            item_entries = sorted((e for e in entries if e.is_dir() and e.name.startswith('item_')), key=lambda e: e.name)
+        for item_entry in item_entries:
+            items[item_entry.name] = cls._scan_item(item_entry.path, previous_items.get(item_entry.name, {}))
+
+        index = cls(dataset_root, items, index_path)
+        if items != previous_items:
+            index.save()
+        return index
+
+    @staticmethod
+    def _scan_item(item_dir: str, previous: dict) -> dict:
+        item = {}
+        for key, filename in ITEM_FILES.items():
+            path = os.path.join(item_dir, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                item[key] = None
+                continue
+            item[key] = {"path": filename, **_file_entry(path, stat, previous.get(key))}
+
+        assets = {}
+        previous_assets = previous.get("assets") or {}
+        assets_dir = os.path.join(item_dir, 'assets')
+        if os.path.isdir(assets_dir):
+            with os.scandir(assets_dir) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    if entry.is_file():
+                        assets[entry.name] = _file_entry(entry.path, entry.stat(), previous_assets.get(entry.name))
+        item["assets"] = assets
+        return item
+
+    def save(self):
+        """
+        原子地写回索引文件 (先写临时文件再替换)。
+        """
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": INDEX_VERSION, "items": self.items}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"⚠️ 警告：无法写入数据集索引 {self.index_path}：{e}")
+
+    # --- 查询接口 ---
+    def item_ids(self, require_screenshot: bool = True) -> list:
+        return [item_id for item_id, item in self.items.items() if item.get("screenshot") or not require_screenshot]
+
+    def item_dir(self, item_id: str) -> str:
+        return os.path.join(self.dataset_root, item_id)
+
+    def screenshot_path(self, item_id: str) -> str:
+        return os.path.join(self.item_dir(item_id), ITEM_FILES["screenshot"])
+
+    def assets_list(self, item_id: str) -> str | None:
+        """
+        生成 prompt 中的图片资产列表 (与 get_image_assets_list 的格式相同)。项目不在索引中时返回 None。
+        """
+        item = self.items.get(item_id)
+        if item is None:
+            return None
+        image_details = []
+        for filename, entry in item["assets"].items():
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if entry.get("width") is None:
+                image_details.append(f"- {filename} (无法读取尺寸，可能文件损坏或非图像格式)")
+            else:
+                image_details.append(f"- {filename} (Width: {entry['width']}px, Height: {entry['height']}px)")
+        return "\n".join(sorted(image_details)) if image_details else "无图片资产。"
+
+    def assets_fingerprint(self, item_id: str) -> list | None:
+        """
+        [[文件名, SHA-256], ...]，用于渲染缓存键。项目不在索引中时返回 None。
+        """
+        item = self.items.get(item_id)
+        if item is None:
+            return None
+        return [[filename, entry["sha256"]] for filename, entry in item["assets"].items()]
+
+
+def link_assets(source_dir: str, target_dir: str) -> str:
+    """
+    把 source_dir 中的文件链接到 target_dir，代替整目录复制：优先硬链接，跨文件系统时退回符号链接，
+    都不支持时才复制。已存在的文件 (例如断点续跑) 保持不变。返回实际使用的方式 (hardlink / symlink / copy)。
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    method = 'hardlink'
+    for entry in os.scandir(source_dir):
+        target_path = os.path.join(target_dir, entry.name)
+        if entry.is_dir():
+            link_assets(entry.path, target_path)
+            continue
+        if os.path.lexists(target_path):
+            continue
+        if method == 'hardlink':
+            try:
+                os.link(entry.path, target_path)
+                continue
+            except OSError:
+                method = 'symlink'
+        if method == 'symlink':
+            try:
+                os.symlink(os.path.abspath(entry.path), target_path)
+                continue
+            except OSError:
+                method = 'copy'
+        shutil.copy2(entry.path, target_path)
+    return method
@@ -1,61 +1,83 @@
 import os
-from pathlib import Path
-import shutil
-from dotenv import load_dotenv
-from openai import OpenAI
-import base64
+import sys
 import json 
 from datetime import datetime 
-import subprocess # 新增：用于调用 Node.js 渲染脚本
-from PIL import Image # 新增：用于图像处理
-from skimage.metrics import structural_similarity as ssim # 新增：用于 SSIM 计算
-import numpy as np # 新增：用于图像处理
-import difflib # 新增：用于代码相似度计算
+import atexit
+import argparse
+import threading
+from contextlib import nullcontext, contextmanager, ExitStack
 import re
-import cv2 # 新增：用于读取图片尺寸
-load_dotenv()
+from render_pool import RenderPool, RENDERER_SCRIPT_PATH, RENDER_LOG_LEVELS # 新增：常驻的 Node.js 渲染服务
+from image_prep import prepare_upload_images, to_image_content_parts, DEFAULT_IMAGE_OPTIONS, IMAGE_FORMATS # 新增：上传前的截图预处理
+from pipeline import BatchPipeline, default_metric_workers, completed_future # 新增：并发批处理流水线
+from response_cache import DiskCache, CACHE_MODES # 新增：LLM 响应和渲染结果的内容寻址缓存
+from timing import StageTimer, TimingAggregate # 新增：各阶段耗时统计
+from dataset_index import DatasetIndex, IMAGE_EXTENSIONS, read_image_size, link_assets # 新增：数据集索引 (预先计算的资产尺寸和哈希)
+from llm_client import LLMClient, BudgetExhaustedError # 新增：带限流、重试和预算控制的异步 LLM 客户端
+from codegen_config import CodegenConfig, Prompts, PromptConfigError # 新增：运行配置 (prompt、模型接口、渲染参数)
+from results_store import ResultsStore, RESULTS_DB_FILENAME, GROUP_BY_FIELDS # 新增：只追加的结果库 (SQLite)
+import hashlib
+import time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+# numpy / PIL / scipy 相关的指标模块 (image_metrics、code_metrics) 和 openai 都在第一次使用时才导入，
+# 导入本模块 (包括指标进程池中的子进程) 只需要几十毫秒
 
-# --- Prompt 文件路径和加载函数 (这部分保持不变) ---
-current_script_dir = os.path.dirname(os.path.abspath(__file__))
-SYSTEM_PROMPT_FILE = os.path.join(current_script_dir, 'prompts', 'ui2code_system_prompt.txt')
-USER_PROMPT_TEMPLATE_FILE = os.path.join(current_script_dir, 'prompts', 'ui2code_user_template.txt')
-SHOT0_USER_PROMPT_TEMPLATE_FILE = os.path.join(current_script_dir, 'prompts', 'shot0_user.txt')
-SHOT0_ASSISTANT_PROMPT_TEMPLATE_FILE = os.path.join(current_script_dir, 'prompts', 'shot0_assistant.txt')
+# --- 运行配置与模型客户端 (按需创建，导入时不读取文件、不创建客户端) ---
+_config = None
+_config_lock = threading.Lock()
+client = None # 模块级的同步 OpenAI 客户端，第一次请求模型时按配置创建；测试或基准测试可以直接替换
 
-def load_prompt_from_file(filepath: str) -> str:
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        print(f"❌ 错误：Prompt 文件未找到：{filepath}。请检查路径和文件名。")
-        return ""
-    except Exception as e:
-        print(f"❌ 错误：加载 prompt 文件 {filepath} 时出错：{e}")
-        return ""
-
-SYSTEM_PROMPT = load_prompt_from_file(SYSTEM_PROMPT_FILE)
-USER_PROMPT_TEMPLATE = load_prompt_from_file(USER_PROMPT_TEMPLATE_FILE)
-SHOT0_USER_PROMPT_TEMPLATE = load_prompt_from_file(SHOT0_USER_PROMPT_TEMPLATE_FILE)
-SHOT0_ASSISTANT_PROMPT_TEMPLATE = load_prompt_from_file(SHOT0_ASSISTANT_PROMPT_TEMPLATE_FILE)
-
-if not SYSTEM_PROMPT or not USER_PROMPT_TEMPLATE:
-    print("❌ 错误：系统或用户 Prompt 内容为空。请检查文件是否正确加载。")
-    exit()
+def configure(config: CodegenConfig) -> CodegenConfig:
+    """
+    指定本模块使用的运行配置。之后按需创建的客户端和默认渲染服务都使用该配置。
+    """
+    global _config, client
+    with _config_lock:
+        _config = config
+        client = None
+    return config
 
+def get_config() -> CodegenConfig:
+    """
+    获取当前运行配置；未调用 configure() 时从环境变量 (和 .env) 读取。
+    """
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = CodegenConfig.from_env()
+        return _config
 
-proxy_base_url = os.getenv("OPENAI_API_BASE")
+def get_prompts():
+    """
+    当前配置的 prompt 文本 (第一次调用时读取文件，必需的 prompt 为空时抛出 PromptConfigError)。
+    """
+    return get_config().prompts
 
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url=proxy_base_url 
-)
+def get_client():
+    """
+    获取 (必要时创建) 模块级的同步 OpenAI 客户端。
+    """
+    global client
+    config = get_config()
+    with _config_lock:
+        if client is None:
+            client = config.create_client()
+        return client
 
-# --- 辅助函数：图片编码  ---
-def encode_image(image_path: str) -> str:
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-    
+# 兼容旧的模块级 prompt 常量：第一次访问时才读取文件
+_PROMPT_ATTRIBUTES = {
+    "SYSTEM_PROMPT": "system",
+    "USER_PROMPT_TEMPLATE": "user_template",
+    "SHOT0_USER_PROMPT_TEMPLATE": "shot0_user",
+    "SHOT0_ASSISTANT_PROMPT_TEMPLATE": "shot0_assistant",
+    "REFINE_USER_PROMPT_TEMPLATE": "refine_user_template",
+}
 
+def __getattr__(name):
+    if name in _PROMPT_ATTRIBUTES:
+        return getattr(get_prompts(), _PROMPT_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- 新增函数：解析模型输出，提取 JSX 和 SCSS ---
 def parse_model_output(output_text: str) -> tuple[str, str]:
@@ -77,126 +99,114 @@ def parse_model_output(output_text: str) -> tuple[str, str]:
     return jsx_code, scss_code
 
 
-def base64_encode_image(image_path):
+# --- 渲染 JSX 代码为图片 (新增 SCSS 参数) ---
+# 渲染服务只启动一次并在整个运行期间复用，避免每个项目都重新启动 Node.js 和 Chromium
+_default_render_pool = None
+
+def get_default_render_pool() -> RenderPool:
     """
-    将图片文件编码为 Base64 字符串。
+    获取（必要时创建）全局共享的渲染服务，进程退出时自动关闭。
     """
-    try:
-        with open(image_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('ascii')
-        return encoded_string
-    except FileNotFoundError:
-        print(f"❌ 错误：图片文件未找到，无法进行 Base64 编码：{image_path}")
-        return None
-    except Exception as e:
-        print(f"❌ Base64 编码过程中发生错误：{e}")
-        return None
+    global _default_render_pool
+    if _default_render_pool is None:
+        _default_render_pool = get_config().create_render_pool()
+        atexit.register(_default_render_pool.close)
+    return _default_render_pool
 
+def render_code(jsx_code: str, scss_code: str, output_path: str, render_pool: RenderPool = None,
+                return_screenshot: bool = False, write_file: bool = True) -> dict:
+    """
+    使用常驻的 Node.js 渲染服务渲染 JSX 代码为图片，并应用 SCSS 样式。
+    未传入 render_pool 时使用全局共享的渲染服务。
+    返回渲染服务的结果字典 (ok, error, ready_ms, ready_timed_out 等)。
+    return_screenshot 为 True 时截图 PNG 字节在结果的 screenshot 字段中；write_file 为 False 时截图不写入 output_path。
+    """
+    render_pool = render_pool or get_default_render_pool()
 
+    try:
+        result = render_pool.render(jsx_code, scss_code, output_path,
+                                    return_screenshot=return_screenshot, write_file=write_file)
+    except FileNotFoundError as e:
+        print(f"❌ 错误：{e}")
+        return {"ok": False, "error": str(e)}
+    except Exception as e:
+        print(f"❌ 渲染 JSX 时发生意外错误: {e}")
+        return {"ok": False, "error": str(e)}
 
+    if not result.get("ok"):
+        print(f"❌ 渲染 JSX 出错: {result.get('error')}")
+    return result
 
-# --- 渲染 JSX 代码为图片 (新增 SCSS 参数) ---
-def render_jsx_to_screenshot(jsx_code: str, scss_code: str, output_path: str) -> bool:
+def add_render_timings(timer: StageTimer, render_result: dict):
     """
-    使用 Node.js 脚本渲染 JSX 代码为图片，并应用 SCSS 样式。
+    把渲染服务内部的细分耗时 (排队、创建页面、Sass/Babel 编译、页面加载、截图) 记入 timer 的 render_* 阶段。
     """
-    # 假设 renderer 目录在项目根目录下，与 src 目录同级
-    renderer_script_path = os.path.join(os.path.dirname(current_script_dir), 'renderer', 'render_jsx.js')
-    
-    if not os.path.exists(renderer_script_path):
-        print(f"❌ 错误：JSX 渲染脚本未找到：{renderer_script_path}。请确保已设置 renderer 目录。")
-        return False
+    for stage_name, elapsed_ms in (render_result.get("timings") or {}).items():
+        timer.add(f"render_{stage_name.removesuffix('_ms')}", elapsed_ms)
 
-    jsx_code_base64 = base64.b64encode(jsx_code.encode('utf-8')).decode('utf-8')
-    scss_code_base64 = base64.b64encode(scss_code.encode('utf-8')).decode('utf-8')
+def render_jsx_to_screenshot(jsx_code: str, scss_code: str, output_path: str, render_pool: RenderPool = None) -> bool:
+    """
+    渲染 JSX 代码为图片，只返回是否成功。
+    """
+    return bool(render_code(jsx_code, scss_code, output_path, render_pool).get("ok"))
 
-    try:
-        # 调用 Node.js 脚本，传递输出路径、Base64 编码的 JSX 和 SCSS 代码
-        result = subprocess.run(
-            ['node', renderer_script_path, output_path, jsx_code_base64, scss_code_base64],
-            capture_output=True,
-            text=True,
-            encoding='utf-8', # <-- 新增：明确指定编码为 UTF-8
-            check=True
-        )
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"❌ 渲染 JSX 出错 (Node.js 退出码: {e.returncode}): {e.stderr}")
-        return False
-    except FileNotFoundError:
-        print(f"❌ 错误：Node.js 命令未找到。请确保 Node.js 已安装并配置在 PATH 中。")
-        return False
-    except Exception as e:
-        print(f"❌ 渲染 JSX 时发生意外错误: {e}")
-        return False
-  
 # --- 新增函数：计算图像相似度 (SSIM) ---
-def calculate_image_ssim(img1_path: str, img2_path: str) -> float:
+def calculate_visual_metrics(reference_path: str, rendered: str | bytes) -> dict:
     """
-    计算两张图片之间的结构相似性指数 (SSIM)。
-    图片会被转换为灰度图并调整大小以匹配。
+    计算参考截图与渲染截图之间的视觉指标 (ssim / ms_ssim / mse / psnr / tiles)。
+    rendered 可以是渲染截图的路径，也可以是渲染服务直接返回的 PNG 字节 (不经过磁盘)。
+    参考截图在每个进程内只解码一次；渲染图按宽度等比缩放后对齐，不再扭曲纵横比。
     """
+    import image_metrics
     try:
-        img1 = Image.open(img1_path).convert('L') # 转换为灰度图
-        img2 = Image.open(img2_path).convert('L')
-
-        # 确保图片大小一致，以较小者为准，防止 SSIM 报错
-        min_width = min(img1.width, img2.width)
-        min_height = min(img1.height, img2.height)
-        img1 = img1.resize((min_width, min_height))
-        img2 = img2.resize((min_width, min_height))
-
-        img1_np = np.array(img1)
-        img2_np = np.array(img2)
-
-        # SSIM 分数通常在 -1 到 1 之间，1 表示完全相同
-        score = ssim(img1_np, img2_np, data_range=img1_np.max() - img1_np.min(), channel_axis=None)
-        return score
+        return image_metrics.score_pair(reference_path, rendered)
     except FileNotFoundError:
-        print(f"❌ 错误：图片文件未找到，无法计算 SSIM。请检查路径：{img1_path} 或 {img2_path}")
-        return 0.0
+        rendered_description = rendered if isinstance(rendered, str) else "内存中的渲染截图"
+        print(f"❌ 错误：图片文件未找到，无法计算 SSIM。请检查路径：{reference_path} 或 {rendered_description}")
+        return {}
     except Exception as e:
         print(f"❌ 计算 SSIM 时出错：{e}")
-        return 0.0
+        return {}
 
-# --- 计算代码相似度 (简单的行相似度) ---
-def calculate_code_similarity(code1: str, code2: str) -> float:
+def calculate_image_ssim(img1_path: str, img2_path: str) -> float:
     """
-    计算两段代码的简单行相似度（基于 difflib 的 SequenceMatcher）。
-    它会忽略空白行和每行前后的空格。
+    计算两张图片之间的结构相似性指数 (SSIM)。
     """
-    # 将代码按行分割，移除空行和每行前后的空格
-    lines1 = [line.strip() for line in code1.splitlines() if line.strip()]
-    lines2 = [line.strip() for line in code2.splitlines() if line.strip()]
+    return calculate_visual_metrics(img1_path, img2_path).get("ssim", 0.0)
 
-    # 处理空代码情况
-    if not lines1 and not lines2:
-        return 1.0 # 两段都是空代码，视为完全相似
-    if not lines1 or not lines2:
-        return 0.0 # 一段为空，另一段不为空，视为不相似
-
-    # 使用 difflib 的 SequenceMatcher 计算相似度
-    s = difflib.SequenceMatcher(None, lines1, lines2)
-    return s.ratio() # 返回相似度分数 (0.0 到 1.0)
+# --- 计算代码相似度 (基于 token 的 LCS 相似度) ---
+def calculate_code_similarity(code1: str, code2: str) -> float:
+    """
+    计算两段代码的相似度：把代码切分为 token (忽略注释和空白) 后，
+    用位并行 LCS 算出 2 * LCS / token 总数，量纲与 difflib 的 ratio 相同。
+    需要更多细节 (n-gram Jaccard、token 数、耗时) 时直接使用 code_metrics.compare_code。
+    """
+    import code_metrics
+    return code_metrics.compare_code(code1, code2)["lcs_ratio"]
 
-def get_image_assets_list(screenshot_path: str) -> str:
+def get_image_assets_list(screenshot_path: str, dataset_index: DatasetIndex = None) -> str:
     """
     根据截图路径，获取其同级目录下的 'assets/' 文件夹中的图片文件名列表，并包含尺寸信息。
+    传入 dataset_index 时直接使用索引中预先读取的尺寸；否则只读取各图片的文件头，不解码像素。
     """
     page_instance_dir = os.path.dirname(screenshot_path)
-    assets_dir = os.path.join(page_instance_dir, 'assets')
+    if dataset_index is not None:
+        assets_list = dataset_index.assets_list(os.path.basename(page_instance_dir))
+        if assets_list is not None:
+            return assets_list
 
+    assets_dir = os.path.join(page_instance_dir, 'assets')
     if not os.path.isdir(assets_dir):
         return "无图片资产。"
 
     image_details = []
     for filename in os.listdir(assets_dir):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.svg')):
+        if filename.lower().endswith(IMAGE_EXTENSIONS):
             image_full_path = os.path.join(assets_dir, filename)
             try:
-                img = cv2.imread(image_full_path)
-                if img is not None:
-                    height, width, _ = img.shape
+                size = read_image_size(image_full_path)
+                if size is not None:
+                    width, height = size
                     image_details.append(f"- {filename} (Width: {width}px, Height: {height}px)")
                 else:
                     image_details.append(f"- {filename} (无法读取尺寸，可能文件损坏或非图像格式)")
@@ -220,11 +230,19 @@ def save_generated_result(
     model_name: str,
     system_prompt_content: str,
     user_prompt_content: str,
-    metrics: dict 
+    metrics: dict,
+    timer: StageTimer = None,
+    results_store: ResultsStore = None,
+    run_id: str = None,
+    status: str = None
 ):
     """
     保存模型生成的代码和相关元数据。
+    传入 timer 时，把保存耗时计入 save 阶段，并把全部阶段耗时写入 metrics["timings"]。
+    传入 results_store 时，元数据追加到结果库 (prompt 以哈希引用)，项目目录中只写代码文件；
+    否则与以前一样写入截图路径、资产列表和 metadata.json (含完整的 prompt)。
     """
+    save_started_at = time.perf_counter()
     item_output_dir = os.path.join(output_dir, item_id)
     os.makedirs(item_output_dir, exist_ok=True) # 确保目录存在
 
@@ -238,17 +256,6 @@ def save_generated_result(
     with open(scss_filepath, 'w', encoding='utf-8') as f:
         f.write(generated_scss_code)
     
-    # 保存输入截图的路径
-    screenshot_path_filepath = os.path.join(item_output_dir, 'input_screenshot_path.txt')
-    with open(screenshot_path_filepath, 'w', encoding='utf-8') as f:
-        f.write(screenshot_path)
-
-    # 保存输入给模型的图片资产列表
-    image_assets_filepath = os.path.join(item_output_dir, 'input_image_assets.txt')
-    with open(image_assets_filepath, 'w', encoding='utf-8') as f:
-        f.write(image_assets_info)
-
-    # 保存元数据和指标
     metadata = {
         "timestamp": datetime.now().isoformat(),
         "item_id": item_id,
@@ -256,32 +263,543 @@ def save_generated_result(
         "input_screenshot_path": screenshot_path,
         "generated_screenshot_path": generated_screenshot_path, # 记录生成图片的路径
         "input_image_assets_info": image_assets_info,
-        "system_prompt_used": system_prompt_content,
-        "user_prompt_content_sent": user_prompt_content, # 实际发送给模型的用户prompt
         "generated_jsx_filepath": os.path.relpath(jsx_filepath, output_dir), # 相对路径
         "generated_scss_filepath": os.path.relpath(scss_filepath, output_dir), # 新增 SCSS 路径
         "metrics": metrics # 将指标添加到元数据中
     }
+    if results_store is not None:
+        metadata["system_prompt_hash"] = results_store.put_prompt(system_prompt_content)
+        metadata["user_prompt_hash"] = results_store.put_prompt(user_prompt_content)
+        if timer is not None:
+            timer.add("save", (time.perf_counter() - save_started_at) * 1000)
+            metrics["timings"] = timer.as_dict()
+        results_store.append_result(run_id or os.path.basename(os.path.normpath(output_dir)), item_id, metadata, status)
+        return
+
+    # 保存输入截图的路径
+    screenshot_path_filepath = os.path.join(item_output_dir, 'input_screenshot_path.txt')
+    with open(screenshot_path_filepath, 'w', encoding='utf-8') as f:
+        f.write(screenshot_path)
+
+    # 保存输入给模型的图片资产列表
+    image_assets_filepath = os.path.join(item_output_dir, 'input_image_assets.txt')
+    with open(image_assets_filepath, 'w', encoding='utf-8') as f:
+        f.write(image_assets_info)
+
+    # 保存元数据和指标
+    if timer is not None:
+        timer.add("save", (time.perf_counter() - save_started_at) * 1000)
+        metrics["timings"] = timer.as_dict()
+    metadata["system_prompt_used"] = system_prompt_content
+    metadata["user_prompt_content_sent"] = user_prompt_content # 实际发送给模型的用户prompt
     metadata_filepath = os.path.join(item_output_dir, 'metadata.json')
     with open(metadata_filepath, 'w', encoding='utf-8') as f:
         json.dump(metadata, f, indent=4, ensure_ascii=False)
 
 
+# --- 新增函数：渲染缓存键 ---
+@lru_cache(maxsize=1)
+def get_renderer_fingerprint() -> str:
+    """
+    渲染脚本内容的哈希。渲染脚本改动后，旧的渲染缓存自动失效。
+    """
+    with open(RENDERER_SCRIPT_PATH, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def compute_render_cache_key(jsx_code: str, scss_code: str, screenshot_path: str, dataset_index: DatasetIndex = None) -> str:
+    """
+    渲染结果只取决于 JSX、SCSS、页面引用的图片资产和渲染脚本本身。
+    相同代码 + 相同资产的渲染 (例如重复运行、缓存命中的 LLM 输出) 共享同一个缓存条目。
+    传入 dataset_index 时用索引中资产的内容哈希，否则用文件大小。
+    """
+    item_dir = os.path.dirname(screenshot_path)
+    assets_fingerprint = dataset_index.assets_fingerprint(os.path.basename(item_dir)) if dataset_index is not None else None
+    if assets_fingerprint is None:
+        assets_dir = os.path.join(item_dir, 'assets')
+        assets_fingerprint = []
+        if os.path.isdir(assets_dir):
+            for filename in sorted(os.listdir(assets_dir)):
+                assets_fingerprint.append([filename, os.path.getsize(os.path.join(assets_dir, filename))])
+    return DiskCache.make_key({
+        "jsx": jsx_code,
+        "scss": scss_code,
+        "assets": assets_fingerprint,
+        "renderer": get_renderer_fingerprint()
+    })
+
+
+# --- 新增函数：断点续跑时读取已有结果 ---
+def load_previous_item_state(output_base_dir: str, item_id: str, results_store: ResultsStore = None, run_id: str = None) -> dict | None:
+    """
+    读取上一次运行中该项目的元数据以及已生成的代码。
+    传入 results_store 时优先使用结果库中最新的记录，库中没有时退回 metadata.json (旧的运行目录)。
+    返回 {"metadata", "jsx", "scss", "has_rendered_screenshot"}；没有可用的记录时返回 None。
+    """
+    item_output_dir = os.path.join(output_base_dir, item_id)
+    metadata = None
+    if results_store is not None:
+        metadata = results_store.latest_metadata(run_id or os.path.basename(os.path.normpath(output_base_dir)), item_id)
+    if metadata is None:
+        metadata_filepath = os.path.join(item_output_dir, 'metadata.json')
+        if not os.path.exists(metadata_filepath):
+            return None
+        try:
+            with open(metadata_filepath, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️ 警告：无法读取 {metadata_filepath}，将重新处理该项目：{e}")
+            return None
+
+    state = {"metadata": metadata, "jsx": None, "scss": None, "has_rendered_screenshot": False}
+    jsx_filepath = os.path.join(item_output_dir, 'generated_code.jsx')
+    scss_filepath = os.path.join(item_output_dir, 'generated_style.scss')
+    if os.path.exists(jsx_filepath):
+        with open(jsx_filepath, 'r', encoding='utf-8') as f:
+            state["jsx"] = f.read()
+    if os.path.exists(scss_filepath):
+        with open(scss_filepath, 'r', encoding='utf-8') as f:
+            state["scss"] = f.read()
+    state["has_rendered_screenshot"] = os.path.exists(os.path.join(item_output_dir, 'rendered_screenshot.png'))
+    return state
+
+def get_completed_stages(previous_state: dict | None) -> set:
+    """
+    根据上一次的记录判断哪些阶段已经成功完成：generation、render、metrics。
+    后一个阶段依赖前一个阶段的产物，因此前一阶段未完成时后面的阶段也视为未完成。
+    """
+    if not previous_state:
+        return set()
+    previous_metrics = previous_state["metadata"].get("metrics", {})
+    completed = set()
+    if previous_metrics.get("generation_success") and previous_state["jsx"]:
+        completed.add("generation")
+        if previous_metrics.get("rendering_success") and previous_state["has_rendered_screenshot"]:
+            completed.add("render")
+            if previous_metrics.get("metrics_computed"):
+                completed.add("metrics")
+    return completed
+
+
+# --- 新增函数：计算单个项目的指标 (CPU 密集，可在进程池中运行) ---
+def score_generated_item(
+    screenshot_path: str,
+    generated_screenshot: str | bytes,
+    generated_jsx_code: str,
+    original_jsx_code: str | None,
+    rendered: bool,
+    generated_scss_code: str = "",
+    original_scss_code: str | None = None
+) -> dict:
+    """
+    计算代码相似度和视觉相似度。参数和返回值都可以被 pickle，便于交给进程池执行。
+    generated_screenshot 是渲染截图的路径或 PNG 字节。
+    original_jsx_code / original_scss_code 为 None 表示没有对应的真实代码，rendered 为 False 表示没有渲染截图。
+    code_metrics 中按文件记录 LCS 相似度、n-gram Jaccard、token 数和耗时；timings 记录代码相似度和 SSIM 的计算耗时 (毫秒)。
+    """
+    import code_metrics
+    scores = {}
+    code_details = {}
+    timings = {}
+    if original_jsx_code is not None:
+        code_details["jsx"] = code_metrics.compare_code(generated_jsx_code, original_jsx_code)
+        scores["code_similarity_score"] = code_details["jsx"]["lcs_ratio"]
+    if original_scss_code is not None:
+        code_details["scss"] = code_metrics.compare_code(generated_scss_code, original_scss_code)
+        scores["scss_similarity_score"] = code_details["scss"]["lcs_ratio"]
+    if code_details:
+        scores["code_metrics"] = code_details
+        timings["code_similarity"] = sum(details["elapsed_ms"] for details in code_details.values())
+    if rendered:
+        started_at = time.perf_counter()
+        visual_metrics = calculate_visual_metrics(screenshot_path, generated_screenshot)
+        timings["ssim"] = (time.perf_counter() - started_at) * 1000
+        scores["visual_similarity_ssim_score"] = visual_metrics.get("ssim", 0.0)
+        scores["visual_metrics"] = visual_metrics
+    scores["timings"] = timings
+    return scores
+
+
+# --- 新增：best-of-N 多候选生成与选择 ---
+# 选择最佳候选的目标函数，输入为候选的 visual_metrics。只依赖参考截图 (生成时可得的信息)，不使用真实代码
+SELECTION_OBJECTIVES = {
+    "ssim": lambda visual: visual.get("ssim", 0.0),
+    "ms_ssim": lambda visual: visual.get("ms_ssim", 0.0),
+    "psnr": lambda visual: visual.get("psnr", 0.0),
+    "min_tile": lambda visual: min((min(row) for row in visual.get("tiles") or []), default=0.0), # 最差分区的 SSIM，惩罚局部严重错位
+}
+
+def request_completions(request_kwargs: dict, llm_client: LLMClient = None, estimated_prompt_tokens: int = 0) -> tuple[list, dict]:
+    """
+    请求 request_kwargs["n"] (默认 1) 个补全，返回 (输出文本列表, token 用量合计)。
+    部分兼容 OpenAI 的接口会忽略 n，返回的数量不足时并发补发单个补全的请求补齐。
+    """
+    def complete(kwargs):
+        if llm_client is not None:
+            return llm_client.complete(kwargs, estimated_prompt_tokens=estimated_prompt_tokens)
+        return get_client().chat.completions.create(**kwargs)
+
+    num_samples = request_kwargs.get("n", 1)
+    responses = [complete(request_kwargs)]
+    missing = num_samples - len(responses[0].choices)
+    if missing > 0:
+        single_kwargs = {key: value for key, value in request_kwargs.items() if key != "n"}
+        with ThreadPoolExecutor(max_workers=missing) as executor:
+            responses.extend(executor.map(complete, [single_kwargs] * missing))
+
+    outputs = [(choice.message.content or "").strip() for response in responses for choice in response.choices][:num_samples]
+    usage_totals = {}
+    for response in responses:
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            continue
+        for usage_key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            usage_totals[usage_key] = usage_totals.get(usage_key, 0) + (getattr(usage, usage_key, 0) or 0)
+    return outputs, usage_totals
+
+def evaluate_candidates(
+    candidates: list,
+    screenshot_path: str,
+    item_output_dir: str,
+    original_jsx_code: str | None,
+    original_scss_code: str | None,
+    render_pool: RenderPool = None,
+    render_cache: DiskCache = None,
+    dataset_index: DatasetIndex = None,
+    pipeline: BatchPipeline = None,
+    timer: StageTimer = None
+):
+    """
+    渲染并打分 best-of-N 的全部候选 ([{"index", "jsx", "scss"}, ...])，结果原地写回每个候选：
+    rendering_success / render_cache_hit / screenshot (PNG 字节) / render_result / scores。
+    渲染缓存未命中的候选并行提交给渲染服务，每个候选占用流水线的一个渲染名额；
+    打分任务同时提交到指标进程池，参考截图在每个进程中只解码一次。
+    """
+    render_pool = render_pool or get_default_render_pool()
+    render_stage = pipeline.render_stage if pipeline else nullcontext
+    submit_metrics = pipeline.submit_metrics if pipeline else completed_future
+    timer = timer or StageTimer()
+
+    to_render = []
+    for candidate in candidates:
+        candidate.update(rendering_success=False, render_cache_hit=False, screenshot=None, render_result={})
+        if not candidate["jsx"]:
+            continue
+        candidate["render_cache_key"] = compute_render_cache_key(candidate["jsx"], candidate["scss"], screenshot_path, dataset_index) if render_cache else None
+        cached_screenshot = render_cache.get(candidate["render_cache_key"]) if render_cache else None
+        if cached_screenshot is not None:
+            candidate.update(rendering_success=True, render_cache_hit=True, screenshot=cached_screenshot)
+        else:
+            to_render.append(candidate)
+
+    if to_render:
+        # 候选截图只在内存中打分；output_path 决定 assets 的位置和日志文件名
+        jobs = [{"jsx_code": candidate["jsx"], "scss_code": candidate["scss"],
+                 "output_path": os.path.join(item_output_dir, f"rendered_candidate_{candidate['index']}.png")}
+                for candidate in to_render]
+
+        def render_job(job):
+            # 每个候选单独占用一个渲染名额，best-of-N 不会让单个项目占满渲染服务的全部上下文
+            with render_stage():
+                return render_pool.render(job["jsx_code"], job["scss_code"], job["output_path"],
+                                          return_screenshot=True, write_file=False)
+
+        render_results = []
+        with timer.stage("render"), ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            for future in [executor.submit(render_job, job) for job in jobs]:
+                try:
+                    render_results.append(future.result())
+                except Exception as e:
+                    print(f"❌ 渲染候选代码时发生意外错误: {e}")
+                    render_results.append({"ok": False, "error": str(e)})
+        for candidate, render_result in zip(to_render, render_results):
+            add_render_timings(timer, render_result) # 各候选的细分耗时累加到项目的计时中
+            candidate["screenshot"] = render_result.pop("screenshot", None)
+            candidate["render_result"] = render_result
+            candidate["rendering_success"] = bool(render_result.get("ok")) and candidate["screenshot"] is not None
+            if candidate["rendering_success"] and render_cache:
+                render_cache.put(candidate["render_cache_key"], candidate["screenshot"])
+
+    with timer.stage("metrics"):
+        futures = [
+            submit_metrics(score_generated_item, screenshot_path, candidate["screenshot"], candidate["jsx"], original_jsx_code,
+                           candidate["rendering_success"], candidate["scss"], original_scss_code)
+            for candidate in candidates
+        ]
+        for candidate, future in zip(candidates, futures):
+            candidate["scores"] = future.result()
+
+def select_best_candidate(candidates: list, objective: str = "ssim") -> dict:
+    """
+    按 objective 从已渲染的候选中选出得分最高的一个 (并列时取序号小的)。
+    没有候选渲染成功时，退回第一个生成了 JSX 的候选。
+    """
+    objective_fn = SELECTION_OBJECTIVES[objective]
+    rendered_candidates = [candidate for candidate in candidates if candidate["rendering_success"]]
+    if rendered_candidates:
+        return max(rendered_candidates, key=lambda candidate: objective_fn(candidate["scores"].get("visual_metrics") or {}))
+    return next((candidate for candidate in candidates if candidate["jsx"]), candidates[0])
+
+def save_candidates(output_dir: str, item_id: str, candidates: list, objective: str = "ssim") -> list:
+    """
+    把每个候选的代码保存到 <item>/candidates/ 下，返回写入 metadata.json 的候选得分列表。
+    """
+    candidates_dir = os.path.join(output_dir, item_id, 'candidates')
+    os.makedirs(candidates_dir, exist_ok=True)
+    summaries = []
+    for candidate in candidates:
+        jsx_filepath = os.path.join(candidates_dir, f"candidate_{candidate['index']}.jsx")
+        scss_filepath = os.path.join(candidates_dir, f"candidate_{candidate['index']}.scss")
+        with open(jsx_filepath, 'w', encoding='utf-8') as f:
+            f.write(candidate["jsx"])
+        with open(scss_filepath, 'w', encoding='utf-8') as f:
+            f.write(candidate["scss"])
+
+        scores = candidate.get("scores") or {}
+        visual_metrics = scores.get("visual_metrics") or {}
+        summaries.append({
+            "index": candidate["index"],
+            "generation_success": bool(candidate["jsx"]),
+            "rendering_success": candidate["rendering_success"],
+            "render_cache_hit": candidate["render_cache_hit"],
+            "objective_score": SELECTION_OBJECTIVES[objective](visual_metrics) if candidate["rendering_success"] else None,
+            "visual_similarity_ssim_score": scores.get("visual_similarity_ssim_score"),
+            "ms_ssim": visual_metrics.get("ms_ssim"),
+            "psnr": visual_metrics.get("psnr"),
+            "code_similarity_score": scores.get("code_similarity_score"),
+            "scss_similarity_score": scores.get("scss_similarity_score"),
+            "render_error": candidate["render_result"].get("error"),
+            "generated_jsx_filepath": os.path.relpath(jsx_filepath, output_dir),
+            "generated_scss_filepath": os.path.relpath(scss_filepath, output_dir),
+        })
+    return summaries
+
+
+# --- 新增：基于视觉反馈的迭代修正 ---
+REFINE_WORST_TILES = 3 # 每轮反馈给模型的差异最大的分区数
+
+def format_model_output(jsx_code: str, scss_code: str) -> str:
+    """
+    把代码还原为模型输出的格式 (parse_model_output 的逆操作)，用作修正对话中的 assistant 消息。
+    """
+    return f"```jsx\n{jsx_code}\n```\n```scss\n{scss_code}\n```"
+
+def refine_generated_code(
+    screenshot_path: str,
+    output_base_dir: str,
+    item_id: str,
+    user_prompt_content: str,
+    jsx_code: str,
+    scss_code: str,
+    rendered_screenshot: bytes,
+    scores: dict,
+    original_jsx_code: str | None,
+    original_scss_code: str | None,
+    model: str = "gpt-4o",
+    max_rounds: int = 2,
+    min_gain: float = 0.005,
+    max_seconds: float = None,
+    max_tokens: int = None,
+    render_pool: RenderPool = None,
+    pipeline: BatchPipeline = None,
+    llm_client: LLMClient = None,
+    llm_cache: DiskCache = None,
+    render_cache: DiskCache = None,
+    image_options: dict = None,
+    image_cache: DiskCache = None,
+    dataset_index: DatasetIndex = None,
+    prompts: Prompts = None,
+    temperature: float = 0.7
+) -> dict:
+    """
+    迭代修正：每轮把目标截图、当前最佳代码、它的渲染截图和 SSIM 最差的几个分区发给模型，
+    要求输出修正后的代码，再渲染、打分。新代码的 SSIM 更高时成为新的最佳代码。
+    以下任一条件满足时提前停止：本轮 SSIM 提升小于 min_gain (stop_reason=no_gain)、累计耗时超过 max_seconds
+    (time_budget)、累计 token 超过 max_tokens (token_budget)、请求出错 (error)；否则跑满 max_rounds 轮 (max_rounds)。
+    每轮复用常驻渲染服务、渲染/LLM 缓存和进程内已解码的参考截图，只付出一次请求 + 一次渲染 + 一次打分的代价。
+    返回 {"jsx", "scss", "screenshot", "scores", "rounds", "stop_reason", "token_usage", "improved"}，
+    rounds 中每轮记录得分、提升、是否采纳、token 用量和各步耗时；每轮的代码保存在 <item>/refinement/ 下。
+    prompts / temperature 与首次生成使用的相同 (prompts 默认为当前配置的 prompt)。
+    """
+    import image_metrics
+    prompts = prompts or get_prompts()
+    llm_stage = pipeline.llm_stage if pipeline else nullcontext
+    render_stage = pipeline.render_stage if pipeline else nullcontext
+    run_metrics = pipeline.run_metrics if pipeline else (lambda fn, *args: fn(*args))
+    item_output_dir = os.path.join(output_base_dir, item_id)
+    refinement_dir = os.path.join(item_output_dir, 'refinement')
+    os.makedirs(refinement_dir, exist_ok=True)
+    image_options = image_options or DEFAULT_IMAGE_OPTIONS
+
+    best = {"jsx": jsx_code, "scss": scss_code, "screenshot": rendered_screenshot, "scores": scores, "round": 0}
+    reference_size = read_image_size(screenshot_path)
+    reference_image = prepare_upload_images(screenshot_path, cache=image_cache, **image_options)
+    reference_parts = to_image_content_parts(reference_image, detail="high")
+    rounds = []
+    token_usage = {}
+    stop_reason = "max_rounds"
+    started_at = time.perf_counter()
+
+    for round_index in range(1, max_rounds + 1):
+        if max_seconds is not None and time.perf_counter() - started_at >= max_seconds:
+            stop_reason = "time_budget"
+            break
+        if max_tokens is not None and token_usage.get("total_tokens", 0) >= max_tokens:
+            stop_reason = "token_budget"
+            break
+
+        round_timer = StageTimer()
+        visual_metrics = best["scores"].get("visual_metrics") or {}
+        best_ssim = best["scores"].get("visual_similarity_ssim_score", 0.0)
+        tiles = image_metrics.worst_tiles(visual_metrics.get("tiles") or [], *reference_size, count=REFINE_WORST_TILES) if reference_size else []
+        round_record = {"round": round_index, "base_round": best["round"], "worst_tiles": tiles}
+        try:
+            with round_timer.stage("prompt_build"):
+                rendered_image = prepare_upload_images(best["screenshot"], cache=image_cache, **image_options)
+                tiles_description = "\n".join(f"- {tile['box']} SSIM {tile['ssim']:.4f}" for tile in tiles) or "- (无分区得分)"
+                previous_output = format_model_output(best["jsx"], best["scss"])
+                refine_prompt_content = prompts.refine_user_template.format(ssim_score=best_ssim, worst_tiles=tiles_description)
+                request_kwargs = {
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": prompts.system},
+                        {"role": "user", "content": [{"type": "text", "text": user_prompt_content}, *reference_parts]},
+                        {"role": "assistant", "content": previous_output},
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": refine_prompt_content},
+                                *to_image_content_parts(rendered_image, detail="high")
+                            ]
+                        }
+                    ],
+                    "temperature": temperature,
+                    "max_tokens": 4000
+                }
+
+            llm_cache_key = DiskCache.make_key(request_kwargs) if llm_cache else None
+            model_output = llm_cache.get_text(llm_cache_key) if llm_cache else None
+            round_record["llm_cache_hit"] = model_output is not None
+            if model_output is None:
+                with llm_stage(), round_timer.stage("llm"):
+                    estimated_prompt_tokens = reference_image["estimated_tokens"] + rendered_image["estimated_tokens"] + (
+                        len(prompts.system) + len(user_prompt_content) + len(previous_output) + len(refine_prompt_content)) // 4
+                    model_outputs, round_usage = request_completions(request_kwargs, llm_client, estimated_prompt_tokens)
+                model_output = model_outputs[0]
+                for usage_key, usage_value in round_usage.items():
+                    token_usage[usage_key] = token_usage.get(usage_key, 0) + usage_value
+                round_record["token_usage"] = round_usage
+                if llm_cache:
+                    llm_cache.put_text(llm_cache_key, model_output)
+        except Exception as e:
+            print(f"⚠️ {item_id} 第 {round_index} 轮修正请求失败：{e}")
+            round_record["error"] = str(e)
+            round_record["timings"] = round_timer.as_dict()
+            rounds.append(round_record)
+            stop_reason = "error"
+            break
+
+        with round_timer.stage("parse"):
+            refined_jsx, refined_scss = parse_model_output(model_output)
+        with open(os.path.join(refinement_dir, f"round_{round_index}.jsx"), 'w', encoding='utf-8') as f:
+            f.write(refined_jsx)
+        with open(os.path.join(refinement_dir, f"round_{round_index}.scss"), 'w', encoding='utf-8') as f:
+            f.write(refined_scss)
+
+        refined_screenshot = None
+        round_record["render_cache_hit"] = False
+        if refined_jsx:
+            render_cache_key = compute_render_cache_key(refined_jsx, refined_scss, screenshot_path, dataset_index) if render_cache else None
+            refined_screenshot = render_cache.get(render_cache_key) if render_cache else None
+            if refined_screenshot is not None:
+                round_record["render_cache_hit"] = True
+            else:
+                with render_stage(), round_timer.stage("render"):
+                    render_result = render_code(refined_jsx, refined_scss, os.path.join(item_output_dir, f"rendered_refine_{round_index}.png"),
+                                                render_pool, return_screenshot=True, write_file=False)
+                refined_screenshot = render_result.pop("screenshot", None) if render_result.get("ok") else None
+                if refined_screenshot is not None and render_cache:
+                    render_cache.put(render_cache_key, refined_screenshot)
+        round_record["rendering_success"] = refined_screenshot is not None
+
+        if refined_screenshot is not None:
+            with round_timer.stage("metrics"):
+                refined_scores = run_metrics(score_generated_item, screenshot_path, refined_screenshot, refined_jsx, original_jsx_code,
+                                             True, refined_scss, original_scss_code)
+            refined_scores.pop("timings", None)
+            refined_ssim = refined_scores.get("visual_similarity_ssim_score", 0.0)
+        else:
+            refined_scores, refined_ssim = {}, 0.0
+
+        gain = refined_ssim - best_ssim
+        round_record.update({
+            "ssim": refined_ssim if refined_screenshot is not None else None,
+            "ms_ssim": (refined_scores.get("visual_metrics") or {}).get("ms_ssim"),
+            "gain": gain,
+            "code_similarity_score": refined_scores.get("code_similarity_score"),
+            "scss_similarity_score": refined_scores.get("scss_similarity_score"),
+            "accepted": refined_screenshot is not None and gain > 0,
+            "timings": round_timer.as_dict(),
+        })
+        rounds.append(round_record)
+        if round_record["accepted"]:
+            best = {"jsx": refined_jsx, "scss": refined_scss, "screenshot": refined_screenshot, "scores": refined_scores, "round": round_index}
+        if gain < min_gain:
+            stop_reason = "no_gain"
+            break
+
+    return {
+        "jsx": best["jsx"],
+        "scss": best["scss"],
+        "screenshot": best["screenshot"],
+        "scores": best["scores"],
+        "selected_round": best["round"],
+        "rounds": rounds,
+        "stop_reason": stop_reason,
+        "token_usage": token_usage,
+        "improved": best["round"] > 0,
+        "elapsed_ms": (time.perf_counter() - started_at) * 1000,
+    }
+
+
 # --- 生成代码的核心函数 (修改以包含保存和计算指标逻辑) ---
-def generate_code_from_screenshot(screenshot_path: str, output_base_dir: str, model: str = "gpt-4o") -> dict:
+def generate_code_from_screenshot(
+    screenshot_path: str,
+    output_base_dir: str,
+    model: str = "gpt-4o",
+    render_pool: RenderPool = None,
+    pipeline: BatchPipeline = None,
+    llm_cache: DiskCache = None,
+    render_cache: DiskCache = None,
+    resume: bool = False,
+    image_options: dict = None,
+    image_cache: DiskCache = None,
+    save_screenshots: bool = True,
+    dataset_index: DatasetIndex = None,
+    llm_client: LLMClient = None,
+    num_samples: int = 1,
+    selection_objective: str = "ssim",
+    refine_rounds: int = 0,
+    refine_min_gain: float = 0.005,
+    refine_max_seconds: float = None,
+    refine_max_tokens: int = None,
+    results_store: ResultsStore = None,
+    run_id: str = None,
+    prompts: Prompts = None,
+    few_shot: bool = False,
+    temperature: float = 0.7
+) -> dict:
     """
     根据页面截图生成 React + SCSS 代码，并计算相关指标。
-    返回包含生成结果和指标的字典。
+    返回包含生成结果和指标的字典。其余参数都是可选的运行选项，分组说明见 add_run_arguments。
     """
     if not os.path.exists(screenshot_path):
         return {"status": "error", "message": f"❌ 错误：截图文件不存在：{screenshot_path}", "item_id": os.path.basename(os.path.dirname(screenshot_path)), "metrics": {}}
 
-    base64_image = encode_image(screenshot_path)
-    image_assets_info = get_image_assets_list(screenshot_path)
-
-    f = open(USER_PROMPT_TEMPLATE_FILE,'r', encoding='utf-8')
-    final_user_prompt_content = f.read()
-    final_user_prompt_content = final_user_prompt_content.format(image_assets_list=image_assets_info)
+    prompts = prompts or get_prompts()
+    timer = StageTimer()
+    with timer.stage("prompt_build"):
+        image_assets_info = get_image_assets_list(screenshot_path, dataset_index)
+        final_user_prompt_content = prompts.user_template.format(image_assets_list=image_assets_info)
 
     item_id = os.path.basename(os.path.dirname(screenshot_path))
     if not item_id.startswith("item_"):
@@ -290,81 +808,243 @@ def generate_code_from_screenshot(screenshot_path: str, output_base_dir: str, mo
 
     generated_jsx_code = ""
     generated_scss_code = ""
+    candidates = [] # best-of-N 的候选 (断点续跑复用已生成代码时为空)
     status_message = "成功"
     metrics = {
         "code_similarity_score": 0.0,
         "visual_similarity_ssim_score": 0.0,
         "generation_success": False, # 指代码生成是否成功 (LLM响应)
         "rendering_success": False,  # 指渲染是否成功 (Node.js)
+        "llm_cache_hit": False,
+        "render_cache_hit": False,
         "error_details": ""
     }
     generated_screenshot_path = "" # 初始化，可能不会生成
 
+    previous_state = load_previous_item_state(output_base_dir, item_id, results_store, run_id) if resume else None
+    completed_stages = get_completed_stages(previous_state)
+    if completed_stages >= {"generation", "render", "metrics"}:
+        # 所有阶段都已完成，直接沿用上一次的结果
+        return {"status": "success", "message": "已完成 (断点续跑时跳过)", "metrics": previous_state["metadata"]["metrics"], "item_id": item_id, "resumed": True}
+    metrics["resumed_stages"] = sorted(completed_stages)
+
+    llm_stage = pipeline.llm_stage if pipeline else nullcontext
+    render_stage = pipeline.render_stage if pipeline else nullcontext
+    run_metrics = pipeline.run_metrics if pipeline else (lambda fn, *args: fn(*args))
+
     try:
-        # 调用大模型生成代码和样式
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                # {"role": "user", "content": SHOT0_USER_PROMPT_TEMPLATE},
-                # {"role": "assistant", "content": SHOT0_ASSISTANT_PROMPT_TEMPLATE},
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": final_user_prompt_content},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}",
-                                "detail": "high"
-                            }
-                        }
-                    ]
-                }
-            ],
-            temperature=0.7,
-            max_tokens=4000
-        )
-        full_model_output = response.choices[0].message.content.strip()
-       
-        # 解析模型输出，提取 JSX 和 SCSS
-        generated_jsx_code, generated_scss_code = parse_model_output(full_model_output)
-        
-        # 如果成功提取到JSX，则认为生成成功
-        if generated_jsx_code:
-            metrics["generation_success"] = True
+        if "generation" in completed_stages:
+            # 上一次已成功生成代码：直接复用，不再调用大模型
+            generated_jsx_code, generated_scss_code = previous_state["jsx"], previous_state["scss"] or ""
         else:
-            metrics["error_details"] += "No valid JSX generated or parsed. "
-            status_message = "JSX生成或解析失败"
+            # 调用大模型生成代码和样式
+            with timer.stage("image_encode"):
+                prepared_image = prepare_upload_images(screenshot_path, cache=image_cache, **(image_options or DEFAULT_IMAGE_OPTIONS))
+            metrics["image_upload_bytes"] = prepared_image["upload_bytes"]
+            metrics["image_original_bytes"] = prepared_image["original_bytes"]
+            metrics["image_tiles"] = len(prepared_image["images"])
+            metrics["image_estimated_tokens"] = prepared_image["estimated_tokens"]
+            few_shot_messages = [
+                {"role": "user", "content": prompts.shot0_user},
+                {"role": "assistant", "content": prompts.shot0_assistant}
+            ] if few_shot else []
+            request_kwargs = {
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": prompts.system},
+                    *few_shot_messages,
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": final_user_prompt_content},
+                            *to_image_content_parts(prepared_image, detail="high")
+                        ]
+                    }
+                ],
+                "temperature": temperature,
+                "max_tokens": 4000
+            }
+            if num_samples > 1:
+                request_kwargs["n"] = num_samples
+            # 缓存键覆盖完整的请求负载：截图、资产列表、prompt、模型名和采样参数 (含 n) 任一变化都会重新请求
+            llm_cache_key = DiskCache.make_key(request_kwargs) if llm_cache else None
+            cached_output = llm_cache.get_text(llm_cache_key) if llm_cache else None
+            if cached_output is not None:
+                # 多候选时缓存的是全部输出的 JSON 列表
+                model_outputs = json.loads(cached_output) if num_samples > 1 else [cached_output]
+                metrics["llm_cache_hit"] = True
+            else:
+                with llm_stage(), timer.stage("llm"):
+                    # 输入 token 的粗略预估：图片按预处理时的估算，文本按 4 个字符一个 token
+                    estimated_prompt_tokens = prepared_image["estimated_tokens"] + (
+                        len(prompts.system) + len(final_user_prompt_content) + sum(len(message["content"]) for message in few_shot_messages)) // 4
+                    model_outputs, token_usage = request_completions(request_kwargs, llm_client, estimated_prompt_tokens)
+                if token_usage:
+                    metrics["token_usage"] = token_usage
+                if llm_cache:
+                    llm_cache.put_text(llm_cache_key, json.dumps(model_outputs, ensure_ascii=False) if num_samples > 1 else model_outputs[0])
+
+            # 解析模型输出，提取 JSX 和 SCSS
+            with timer.stage("parse"):
+                candidates = []
+                for candidate_index, model_output in enumerate(model_outputs):
+                    candidate_jsx, candidate_scss = parse_model_output(model_output)
+                    candidates.append({"index": candidate_index, "jsx": candidate_jsx, "scss": candidate_scss})
+            generated_jsx_code, generated_scss_code = candidates[0]["jsx"], candidates[0]["scss"]
 
         # --- 获取真实代码 (Ground Truth) ---
         original_jsx_path = os.path.join(os.path.dirname(screenshot_path), 'index.jsx')
-        # original_scss_path = os.path.join(os.path.dirname(screenshot_path), 'Activity.scss') # 假设真实SCSS名为 Activity.scss
-        
-        original_jsx_code = ""
-        # original_scss_code = "" # 如果需要计算SCSS相似度，需要读取
+        original_scss_path = os.path.join(os.path.dirname(screenshot_path), 'style.scss')
+
+        original_jsx_code = None
+        original_scss_code = None
 
         if os.path.exists(original_jsx_path):
             with open(original_jsx_path, 'r', encoding='utf-8') as f: # 确保读取原始JSX也用UTF-8
                 original_jsx_code = f.read().strip()
-            metrics["code_similarity_score"] = calculate_code_similarity(generated_jsx_code, original_jsx_code)
         else:
             print(f"⚠️ 警告：未找到原始 JSX 代码：{original_jsx_path}。无法计算代码相似度。")
             metrics["error_details"] += "Original JSX not found. "
+        if os.path.exists(original_scss_path):
+            with open(original_scss_path, 'r', encoding='utf-8') as f:
+                original_scss_code = f.read().strip()
+
+        # --- best-of-N：并行渲染、打分全部候选，保留目标得分最高的一个 ---
+        selected_candidate = None
+        if len(candidates) > 1:
+            evaluate_candidates(candidates, screenshot_path, os.path.join(output_base_dir, item_id), original_jsx_code, original_scss_code,
+                                render_pool, render_cache, dataset_index, pipeline, timer)
+            selected_candidate = select_best_candidate(candidates, selection_objective)
+            generated_jsx_code, generated_scss_code = selected_candidate["jsx"], selected_candidate["scss"]
+            metrics["selection_objective"] = selection_objective
+            metrics["selected_candidate"] = selected_candidate["index"]
+            metrics["candidates"] = save_candidates(output_base_dir, item_id, candidates, selection_objective)
+
+        # 如果成功提取到JSX，则认为生成成功
+        if generated_jsx_code:
+            metrics["generation_success"] = True
+        else:
+            metrics["error_details"] += "No valid JSX generated or parsed. "
+            status_message = "JSX生成或解析失败"
 
-        # --- 渲染生成的代码并计算视觉相似度 ---
+        # --- 渲染生成的代码 ---
         generated_screenshot_path = os.path.join(output_base_dir, item_id, 'rendered_screenshot.png')
         os.makedirs(os.path.dirname(generated_screenshot_path), exist_ok=True)
 
         # 调用渲染函数，传入 JSX 和 SCSS
-        if generated_jsx_code and render_jsx_to_screenshot(generated_jsx_code, generated_scss_code, generated_screenshot_path):
+        rendered_screenshot = None # 内存中的渲染截图 (PNG 字节)，有值时直接用于打分，不再从磁盘读回
+        if "render" in completed_stages:
+            # 上一次已成功渲染同一份代码，截图仍在磁盘上
             metrics["rendering_success"] = True
-            metrics["visual_similarity_ssim_score"] = calculate_image_ssim(screenshot_path, generated_screenshot_path)
-        else:
+        elif selected_candidate is not None:
+            # best-of-N 时已在候选评估中渲染过，直接使用选中候选的截图
+            rendered_screenshot = selected_candidate["screenshot"]
+            render_result = selected_candidate["render_result"]
+            metrics["rendering_success"] = selected_candidate["rendering_success"]
+            metrics["render_cache_hit"] = selected_candidate["render_cache_hit"]
+            metrics["render_ready_ms"] = render_result.get("ready_ms")
+            metrics["render_ready_timed_out"] = render_result.get("ready_timed_out")
+            metrics["render_compile_cache_hit"] = render_result.get("compile_cache_hit")
+            if save_screenshots and rendered_screenshot is not None:
+                with open(generated_screenshot_path, 'wb') as f:
+                    f.write(rendered_screenshot)
+        elif generated_jsx_code:
+            render_cache_key = compute_render_cache_key(generated_jsx_code, generated_scss_code, screenshot_path, dataset_index) if render_cache else None
+            cached_screenshot = render_cache.get(render_cache_key) if render_cache else None
+            if cached_screenshot is not None:
+                rendered_screenshot = cached_screenshot
+                if save_screenshots:
+                    with open(generated_screenshot_path, 'wb') as f:
+                        f.write(cached_screenshot)
+                metrics["rendering_success"] = True
+                metrics["render_cache_hit"] = True
+            else:
+                with render_stage(), timer.stage("render"):
+                    render_result = render_code(generated_jsx_code, generated_scss_code, generated_screenshot_path, render_pool,
+                                                return_screenshot=True, write_file=save_screenshots)
+                rendered_screenshot = render_result.pop("screenshot", None)
+                add_render_timings(timer, render_result)
+                metrics["rendering_success"] = bool(render_result.get("ok"))
+                metrics["render_ready_ms"] = render_result.get("ready_ms")
+                metrics["render_ready_timed_out"] = render_result.get("ready_timed_out")
+                metrics["render_compile_cache_hit"] = render_result.get("compile_cache_hit")
+                if metrics["rendering_success"] and render_cache and rendered_screenshot is not None:
+                    render_cache.put(render_cache_key, rendered_screenshot)
+        if not metrics["rendering_success"]:
             print(f"❌ 渲染 '{item_id}' 的生成代码失败。")
             metrics["error_details"] += "Rendering failed. "
             status_message = "渲染失败"
 
+        # --- 计算代码相似度和视觉相似度 ---
+        if selected_candidate is not None:
+            scores = dict(selected_candidate["scores"]) # 已在候选评估中计算
+        else:
+            with timer.stage("metrics"):
+                scores = run_metrics(
+                    score_generated_item,
+                    screenshot_path,
+                    rendered_screenshot if rendered_screenshot is not None else generated_screenshot_path,
+                    generated_jsx_code,
+                    original_jsx_code,
+                    metrics["rendering_success"],
+                    generated_scss_code,
+                    original_scss_code
+                )
+        for stage_name, elapsed_ms in scores.pop("timings", {}).items():
+            timer.add(stage_name, elapsed_ms)
+        metrics.update(scores)
+        metrics["metrics_computed"] = True
+
+        # --- 可选：基于视觉反馈的迭代修正 ---
+        if refine_rounds > 0 and metrics["rendering_success"]:
+            if rendered_screenshot is None:
+                # 断点续跑时复用了上一次的渲染，截图在磁盘上
+                with open(generated_screenshot_path, 'rb') as f:
+                    rendered_screenshot = f.read()
+            with timer.stage("refine"):
+                refinement = refine_generated_code(
+                    screenshot_path, output_base_dir, item_id, final_user_prompt_content,
+                    generated_jsx_code, generated_scss_code, rendered_screenshot, scores,
+                    original_jsx_code, original_scss_code,
+                    model=model,
+                    max_rounds=refine_rounds,
+                    min_gain=refine_min_gain,
+                    max_seconds=refine_max_seconds,
+                    max_tokens=refine_max_tokens,
+                    render_pool=render_pool,
+                    pipeline=pipeline,
+                    llm_client=llm_client,
+                    llm_cache=llm_cache,
+                    render_cache=render_cache,
+                    image_options=image_options,
+                    image_cache=image_cache,
+                    dataset_index=dataset_index,
+                    prompts=prompts,
+                    temperature=temperature
+                )
+            metrics["refinement"] = {
+                "initial_ssim": metrics.get("visual_similarity_ssim_score", 0.0),
+                "final_ssim": refinement["scores"].get("visual_similarity_ssim_score", 0.0),
+                "selected_round": refinement["selected_round"],
+                "stop_reason": refinement["stop_reason"],
+                "elapsed_ms": refinement["elapsed_ms"],
+                "rounds": refinement["rounds"]
+            }
+            if refinement["token_usage"]:
+                token_usage = metrics.setdefault("token_usage", {})
+                for usage_key, usage_value in refinement["token_usage"].items():
+                    token_usage[usage_key] = token_usage.get(usage_key, 0) + usage_value
+            if refinement["improved"]:
+                generated_jsx_code, generated_scss_code = refinement["jsx"], refinement["scss"]
+                rendered_screenshot = refinement["screenshot"]
+                metrics.update(refinement["scores"])
+                if save_screenshots or os.path.exists(generated_screenshot_path):
+                    # 不留下与最终代码不一致的旧截图
+                    with open(generated_screenshot_path, 'wb') as f:
+                        f.write(rendered_screenshot)
+        if not (save_screenshots or "render" in completed_stages) or not os.path.exists(generated_screenshot_path):
+            generated_screenshot_path = "" # 本次的渲染截图没有写入磁盘
+
         # --- 保存所有结果 ---
         save_generated_result(
             output_dir=output_base_dir,
@@ -375,19 +1055,26 @@ def generate_code_from_screenshot(screenshot_path: str, output_base_dir: str, mo
             generated_screenshot_path=generated_screenshot_path,
             image_assets_info=image_assets_info,
             model_name=model,
-            system_prompt_content=SYSTEM_PROMPT,
+            system_prompt_content=prompts.system,
             user_prompt_content=final_user_prompt_content,
-            metrics=metrics
+            metrics=metrics,
+            timer=timer,
+            results_store=results_store,
+            run_id=run_id,
+            status="success"
         )
-        
+
         return {"status": "success", "message": "生成和评估成功", "metrics": metrics, "item_id": item_id}
 
     except Exception as e:
         metrics["generation_success"] = False
+        if isinstance(e, BudgetExhaustedError):
+            # 预算用完时未发起请求，断点续跑会重新生成该项目
+            metrics["budget_exhausted"] = True
         metrics["error_details"] += f"An unexpected error occurred during generation or evaluation: {e}. "
         status_message = f"总错误: {e}"
         print(f"❌ 处理 {item_id} 时出错了：{e}")
-        
+
         # 即使失败也尝试保存（可能会保存部分代码或仅错误信息）
         save_generated_result(
             output_dir=output_base_dir,
@@ -398,88 +1085,608 @@ def generate_code_from_screenshot(screenshot_path: str, output_base_dir: str, mo
             generated_screenshot_path=generated_screenshot_path, # 如果渲染失败，这里可能为空
             image_assets_info=image_assets_info,
             model_name=model,
-            system_prompt_content=SYSTEM_PROMPT,
+            system_prompt_content=prompts.system,
             user_prompt_content=final_user_prompt_content,
-            metrics=metrics
+            metrics=metrics,
+            timer=timer,
+            results_store=results_store,
+            run_id=run_id,
+            status="error"
         )
         return {"status": "error", "message": status_message, "metrics": metrics, "item_id": item_id}
 
 
-if __name__ == "__main__":
-    # 定义数据集的根目录
-    DATASET_ROOT_DIR = os.path.join('data', 'processed', 'ui2code_dataset')
-    
-    # 定义结果保存的根目录，每次运行生成一个带时间戳的子目录
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    RESULTS_BASE_DIR = os.path.join('data', 'generated_results', f'run_{timestamp}')
-    os.makedirs(RESULTS_BASE_DIR, exist_ok=True) # 确保结果目录存在
+def print_item_result(item_dir_name: str, result: dict):
+    """
+    打印单个项目的简要结果。
+    """
+    print(f"项目 {item_dir_name} 状态: {result.get('status')}")
+    if 'metrics' in result:
+        metrics = result['metrics']
+        print(f"  - 生成代码成功: {'是' if metrics.get('generation_success') else '否'}")
+        print(f"  - 渲染页面成功: {'是' if metrics.get('rendering_success') else '否'}")
+        print(f"  - 代码相似度: {metrics.get('code_similarity_score', 0.0):.4f}")
+        if 'scss_similarity_score' in metrics:
+            print(f"  - 样式相似度 (SCSS): {metrics['scss_similarity_score']:.4f}")
+        print(f"  - 视觉相似度 (SSIM): {metrics.get('visual_similarity_ssim_score', 0.0):.4f}")
+        if metrics.get('candidates'):
+            objective_scores = [f"{c['objective_score']:.4f}" if c['objective_score'] is not None else "-" for c in metrics['candidates']]
+            print(f"  - 候选 ({metrics['selection_objective']}): {', '.join(objective_scores)}，选中第 {metrics['selected_candidate']} 个")
+        if metrics.get('refinement'):
+            refinement = metrics['refinement']
+            print(f"  - 修正: {len(refinement['rounds'])} 轮，SSIM {refinement['initial_ssim']:.4f} -> {refinement['final_ssim']:.4f} (停止原因: {refinement['stop_reason']})")
+        if metrics.get('error_details'):
+            print(f"  - 错误详情: {metrics.get('error_details')}")
 
-    all_item_results = [] # 存储所有项目的评估结果
 
-    print(f"🚀 开始批量处理数据集 '{DATASET_ROOT_DIR}'...")
-    print(f"所有结果将保存到: {RESULTS_BASE_DIR}")
+# --- 新增：汇总与报告 (generate 和 summarize 子命令共用) ---
+SUMMARY_WRITE_INTERVAL = 30.0 # 运行中每隔多少秒重写一次 summary_metrics.json
 
-    # 遍历数据集目录下的所有 item_XXXXX 文件夹
-    # 确保只处理目录，且以 'item_' 开头
-    item_dirs = [d for d in os.listdir(DATASET_ROOT_DIR) 
-                 if os.path.isdir(os.path.join(DATASET_ROOT_DIR, d)) and d.startswith('item_')]
-    item_dirs.sort() # 按名称排序，确保处理顺序一致
+class ResultsSummary:
+    """
+    增量汇总项目结果：每完成一个项目调用一次 add()，只保留计数、相似度总和、token 合计和各阶段耗时的有界汇总
+    (见 timing.TimingAggregate)，不保留每个项目的元数据，内存占用不随项目数增长；as_dict() 随时给出当前的汇总。
+    断点续跑时跳过的项目 (resumed) 计入成功数和平均分，但不计入耗时和 token 用量 (它们属于上一次运行)。
+    """
 
-    total_items = len(item_dirs)
-    processed_count = 0
+    def __init__(self, total_items: int = None):
+        self.total_items = total_items
+        self.items = 0
+        self.generated = 0
+        self.rendered = 0
+        self.resumed = 0
+        self.token_usage = {}
+        self._score_sums = {} # 指标名 -> [总和, 个数]
+        self._timings = TimingAggregate()
 
-    for item_dir_name in item_dirs:
-        processed_count += 1
-        item_screenshot_path = os.path.join(DATASET_ROOT_DIR, item_dir_name, 'screenshot.png')
-        
-        print(f"\n--- 处理 {item_dir_name} ({processed_count}/{total_items}) ---")
-        if not os.path.exists(item_screenshot_path):
-            print(f"⚠️ 警告：跳过 {item_dir_name}，因为未找到 'screenshot.png'。")
+    def _add_score(self, name: str, value):
+        if value is not None:
+            score_sum = self._score_sums.setdefault(name, [0.0, 0])
+            score_sum[0] += value
+            score_sum[1] += 1
+
+    def add(self, result: dict):
+        metrics = result.get('metrics', {})
+        self.items += 1
+        # 没有成功生成代码的项目相似度可能为 0，不计入平均值
+        if metrics.get('generation_success'):
+            self.generated += 1
+            self._add_score('avg_code_similarity', metrics.get('code_similarity_score'))
+            self._add_score('avg_scss_similarity', metrics.get('scss_similarity_score'))
+        if metrics.get('rendering_success'):
+            self.rendered += 1
+            self._add_score('avg_ssim', metrics.get('visual_similarity_ssim_score'))
+            self._add_score('avg_ms_ssim', metrics.get('visual_metrics', {}).get('ms_ssim'))
+        if result.get('resumed'):
+            self.resumed += 1
+            return
+        for usage_key, usage_value in (metrics.get('token_usage') or {}).items():
+            self.token_usage[usage_key] = self.token_usage.get(usage_key, 0) + (usage_value or 0)
+        self._timings.add(metrics.get('timings'))
+
+    def _average(self, name: str) -> float:
+        score_sum, count = self._score_sums.get(name, (0.0, 0))
+        return score_sum / count if count else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "total_items": self.total_items if self.total_items is not None else self.items,
+            "generated": self.generated,
+            "rendered": self.rendered,
+            "resumed": self.resumed,
+            "avg_code_similarity": self._average('avg_code_similarity'),
+            "avg_scss_similarity": self._average('avg_scss_similarity'),
+            "avg_ssim": self._average('avg_ssim'),
+            "avg_ms_ssim": self._average('avg_ms_ssim'),
+            "timings": self._timings.summary(),
+            "token_usage": dict(self.token_usage),
+        }
+
+def summarize_results(item_results: list, total_items: int = None) -> dict:
+    """
+    汇总所有项目的结果：成功数、平均相似度、各阶段耗时分位数和 token 用量 (见 ResultsSummary)。
+    """
+    summary = ResultsSummary(total_items)
+    for result in item_results:
+        summary.add(result)
+    return summary.as_dict()
+
+def print_summary_report(summary: dict, cache_stats: dict = None, llm_stats: dict = None):
+    total_items = summary["total_items"] or 1 # 避免空数据集时除以 0
+    print("\n--- 🚀 整体评估报告 (Summary Report) 🚀 ---")
+    print(f"总处理项目数: {summary['total_items']}")
+    print(f"成功生成代码的项目数: {summary['generated']}/{summary['total_items']} ({summary['generated']/total_items:.2%})")
+    print(f"成功渲染页面的项目数: {summary['rendered']}/{summary['total_items']} ({summary['rendered']/total_items:.2%})")
+    print(f"平均代码相似度 (针对成功生成的): {summary['avg_code_similarity']:.4f}")
+    print(f"平均样式相似度 (SCSS, 针对成功生成的): {summary['avg_scss_similarity']:.4f}")
+    print(f"平均视觉相似度 (SSIM, 针对成功渲染的): {summary['avg_ssim']:.4f}")
+    print(f"平均多尺度 SSIM (针对成功渲染的): {summary['avg_ms_ssim']:.4f}")
+    for cache_name, stats in (cache_stats or {}).items():
+        print(f"{cache_name} 缓存: 命中 {stats['hits']} / 未命中 {stats['misses']} (命中率 {stats['hit_rate']:.2%})")
+    token_usage_totals = summary["token_usage"]
+    if token_usage_totals:
+        print(f"Token 用量: 输入 {token_usage_totals.get('prompt_tokens', 0)} / 输出 {token_usage_totals.get('completion_tokens', 0)} / 合计 {token_usage_totals.get('total_tokens', 0)}")
+    if llm_stats:
+        print(f"LLM 请求: {llm_stats['requests']} 次 (重试 {llm_stats['retries']}，限流 {llm_stats['rate_limited']})，估算费用 ${llm_stats['cost_usd']:.4f}")
+        if llm_stats['budget_exhausted']:
+            print("⚠️ LLM 预算已用完，部分项目未生成；可用 --resume 提高预算后继续。")
+    if summary["timings"]:
+        print("\n各阶段耗时 (毫秒):")
+        print(f"{'阶段':<20}{'次数':>8}{'p50':>12}{'p95':>12}{'max':>12}")
+        for stage_name, stats in summary["timings"].items():
+            print(f"{stage_name:<20}{stats['count']:>8}{stats['p50']:>12.1f}{stats['p95']:>12.1f}{stats['max']:>12.1f}")
+
+def print_aggregate_table(rows: list, group_by: tuple):
+    """
+    打印 ResultsStore.aggregate() 的结果：每个分组一行 (tokens 不含复用的结果)。
+    """
+    if not rows:
+        print("结果库中没有符合条件的记录。")
+        return
+    key_widths = [max(len(field), *(len(str(row[field])) for row in rows)) + 2 for field in group_by]
+    header = "".join(f"{field:<{width}}" for field, width in zip(group_by, key_widths))
+    print(f"{header}{'项目':>6}{'生成':>6}{'渲染':>6}{'复用':>6}{'SSIM':>9}{'MS-SSIM':>9}{'代码':>8}{'SCSS':>8}{'tokens':>12}")
+    for row in rows:
+        keys = "".join(f"{str(row[field]):<{width}}" for field, width in zip(group_by, key_widths))
+        averages = "".join(f"{row[name] if row[name] is not None else 0.0:>{width}.4f}" for name, width in
+                           (("avg_ssim", 9), ("avg_ms_ssim", 9), ("avg_code_similarity", 8), ("avg_scss_similarity", 8)))
+        print(f"{keys}{row['items']:>6}{row['generated'] or 0:>6}{row['rendered'] or 0:>6}{row['reused'] or 0:>6}{averages}{row['total_tokens'] or 0:>12}")
+
+def default_results_db_path(run_dir: str) -> str:
+    """
+    运行目录默认使用的结果库：结果根目录 (运行目录的上一级) 下的 results.sqlite。
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(run_dir)), RESULTS_DB_FILENAME)
+
+def find_run_in_results_db(run_dir: str, results_db_path: str = None) -> tuple:
+    """
+    按输出目录在结果库中查找运行目录对应的运行，返回 (结果库路径, run_id)；找不到时返回 (None, None)。
+    未指定结果库时依次尝试 generate 的布局 (结果根目录/run_<时间戳>) 和扫参的布局 (结果根目录/sweep_<时间戳>/<配置名>)。
+    """
+    output_dir = os.path.abspath(run_dir)
+    candidate_paths = [results_db_path] if results_db_path else [
+        default_results_db_path(output_dir),
+        default_results_db_path(os.path.dirname(output_dir))
+    ]
+    for candidate_path in candidate_paths:
+        if not os.path.exists(candidate_path):
             continue
+        with ResultsStore(candidate_path) as results_store:
+            run_id = results_store.find_run(output_dir)
+        if run_id is not None:
+            return candidate_path, run_id
+    return None, None
 
-        shutil.copytree(os.path.join(DATASET_ROOT_DIR, item_dir_name, 'assets'),os.path.join(RESULTS_BASE_DIR, item_dir_name,'assets') )
-            
-        # 调用核心生成和评估函数
-        result = generate_code_from_screenshot(item_screenshot_path, output_base_dir=RESULTS_BASE_DIR)
-        all_item_results.append(result)
-        
-        # 打印当前项目的简要结果
-        print(f"项目 {item_dir_name} 状态: {result.get('status')}")
-        if 'metrics' in result:
-            metrics = result['metrics']
-            print(f"  - 生成代码成功: {'是' if metrics.get('generation_success') else '否'}")
-            print(f"  - 渲染页面成功: {'是' if metrics.get('rendering_success') else '否'}")
-            print(f"  - 代码相似度: {metrics.get('code_similarity_score', 0.0):.4f}")
-            print(f"  - 视觉相似度 (SSIM): {metrics.get('visual_similarity_ssim_score', 0.0):.4f}")
-            if metrics.get('error_details'):
-                print(f"  - 错误详情: {metrics.get('error_details')}")
-
-
-    # --- 汇总并保存所有指标 ---
-    summary_filepath = os.path.join(RESULTS_BASE_DIR, 'summary_metrics.json')
-    with open(summary_filepath, 'w', encoding='utf-8') as f:
-        json.dump(all_item_results, f, indent=4, ensure_ascii=False)
+def load_run_results(run_dir: str) -> list:
+    """
+    读取运行目录中每个项目的 metadata.json，组装为与 generate 相同格式的结果列表 (按项目名排序)。
+    用于结果库出现之前的旧运行目录。
+    """
+    item_results = []
+    for item_id in sorted(os.listdir(run_dir)):
+        metadata_filepath = os.path.join(run_dir, item_id, 'metadata.json')
+        if not item_id.startswith('item_') or not os.path.exists(metadata_filepath):
+            continue
+        try:
+            with open(metadata_filepath, 'r', encoding='utf-8') as f:
+                metrics = json.load(f).get("metrics", {})
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️ 警告：无法读取 {metadata_filepath}：{e}")
+            continue
+        item_results.append({"status": "success" if metrics.get("metrics_computed") else "error", "metrics": metrics, "item_id": item_id})
+    return item_results
+
+
+# --- 命令行子命令 ---
+def create_caches(args) -> dict:
+    """
+    按命令行参数创建 llm / image_prep / render / compile 四类磁盘缓存，并先淘汰过期或超出大小的条目。
+    """
+    cache_options = {
+        "mode": args.cache_mode,
+        "max_bytes": int(args.cache_max_size_mb * 1024 * 1024),
+        "max_age_seconds": args.cache_max_age_days * 24 * 3600
+    }
+    # compile 是渲染服务内 Sass/Babel 编译结果的磁盘缓存，由 Node.js 端直接读写，这里只负责淘汰
+    caches = {namespace: DiskCache(args.cache_dir, namespace, **cache_options) for namespace in ('llm', 'image_prep', 'render', 'compile')}
+    for cache in caches.values():
+        cache.evict()
+    print(f"缓存: {args.cache_dir} (模式: {args.cache_mode})")
+    return caches
+
+def image_options_from_args(args) -> dict:
+    return {
+        "max_edge": args.image_max_edge,
+        "tile_height": args.image_tile_height,
+        "image_format": args.image_format,
+        "quality": args.image_quality,
+        "keep_alpha": args.keep_alpha
+    }
+
+@contextmanager
+def open_run_services(config: CodegenConfig, args, compile_cache: DiskCache):
+    """
+    按命令行参数启动一次运行共享的渲染服务、LLM 客户端和流水线，产出 (render_pool, llm_client, pipeline)，退出时依次关闭。
+    """
+    with config.create_render_pool(workers=args.render_workers, ready_timeout=args.render_ready_timeout,
+                                   compile_cache_dir=None if args.cache_mode == 'bypass' else compile_cache.root,
+                                   compile_cache_read_only=args.cache_mode == 'read-only',
+                                   log_level=args.render_log_level) as render_pool, \
+         config.create_llm_client(
+             requests_per_minute=args.rpm,
+             tokens_per_minute=args.tpm,
+             max_concurrency=args.llm_workers,
+             max_retries=args.llm_max_retries,
+             timeout=args.llm_timeout,
+             max_total_tokens=args.max_total_tokens,
+             max_total_cost=args.max_total_cost
+         ) as llm_client, \
+         BatchPipeline(
+             llm_workers=args.llm_workers,
+             render_workers=args.render_workers,
+             metric_workers=args.metric_workers,
+             max_inflight=args.max_inflight
+         ) as pipeline:
+        print(f"并发设置: LLM={pipeline.llm_workers}, 渲染={pipeline.render_workers}, 指标进程={pipeline.metric_workers}, 在途上限={pipeline.max_inflight}")
+        yield render_pool, llm_client, pipeline
+
+def cmd_generate(args) -> int:
+    """
+    批量根据截图生成代码、渲染并评估。
+    """
+    config = get_config()
+    dataset_root_dir = args.dataset
+    if not os.path.isdir(dataset_root_dir):
+        print(f"❌ 错误：数据集目录不存在：{dataset_root_dir}")
+        return 1
+
+    # 定义结果保存的根目录，每次运行生成一个带时间戳的子目录；断点续跑时沿用指定的目录
+    if args.resume:
+        if not os.path.isdir(args.resume):
+            print(f"❌ 错误：要继续的运行目录不存在：{args.resume}")
+            return 1
+        results_base_dir = args.resume
+        print(f"🔁 断点续跑模式：将复用 {results_base_dir} 中已完成的阶段。")
+    else:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        results_base_dir = os.path.join(args.output_root, f'run_{timestamp}')
+    os.makedirs(results_base_dir, exist_ok=True) # 确保结果目录存在
+
+    try:
+        prompts = get_prompts()
+    except PromptConfigError as e:
+        print(f"❌ 错误：{e}")
+        return 1
+    if args.few_shot and not (prompts.shot0_user and prompts.shot0_assistant):
+        print("❌ 错误：--few-shot 需要 shot0_user.txt 和 shot0_assistant.txt 中的示例。")
+        return 1
+    if args.refine_rounds > 0 and not prompts.refine_user_template:
+        print("❌ 错误：--refine-rounds 需要 refine_user_template.txt 中的修正 prompt 模板。")
+        return 1
+
+    print(f"🚀 开始批量处理数据集 '{dataset_root_dir}'...")
+    print(f"所有结果将保存到: {results_base_dir}")
+
+    # 读取 (必要时增量更新) 数据集索引：只有新增或改动的文件才会重新计算哈希和图片尺寸
+    dataset_index = DatasetIndex.load_or_build(dataset_root_dir, args.dataset_index)
+    print(f"数据集索引: {dataset_index.index_path}")
+
+    # 索引中的 item_XXXXX 已按名称排序，确保处理顺序一致
+    item_dirs = list(dataset_index.items)
+    runnable_item_dirs = dataset_index.item_ids()
+    for item_dir_name in sorted(set(item_dirs) - set(runnable_item_dirs)):
+        print(f"⚠️ 警告：跳过 {item_dir_name}，因为未找到 'screenshot.png'。")
+
+    caches = create_caches(args)
+    llm_cache, image_cache, render_cache = caches["llm"], caches["image_prep"], caches["render"]
+    image_options = image_options_from_args(args)
+
+    # 结果库默认放在结果根目录下，由所有运行共享，便于跨运行比较；运行目录名作为 run_id
+    run_id = os.path.basename(os.path.normpath(results_base_dir))
+    results_db_path = args.results_db or default_results_db_path(results_base_dir)
+    results_store = ResultsStore(results_db_path)
+    results_store.start_run(run_id, os.path.abspath(results_base_dir), {
+        "dataset": dataset_root_dir,
+        "model": args.model,
+        "temperature": args.temperature,
+        "few_shot": args.few_shot,
+        "num_samples": args.num_samples,
+        "selection_objective": args.selection_objective,
+        "refine_rounds": args.refine_rounds,
+        "image_options": image_options
+    })
+    print(f"结果库: {results_db_path} (run_id: {run_id})")
+
+    summary_filepath = os.path.join(results_base_dir, 'summary_metrics.json')
+    running_summary = ResultsSummary(total_items=len(item_dirs))
+    processed_count = 0
+    last_summary_write = time.monotonic()
+
+    def write_summary_metrics(finished: bool) -> dict:
+        # 先写临时文件再替换，运行中读取 summary_metrics.json 不会读到写了一半的内容
+        summary = running_summary.as_dict()
+        temp_filepath = f"{summary_filepath}.tmp"
+        with open(temp_filepath, 'w', encoding='utf-8') as f:
+            json.dump({
+                "finished": finished,
+                "processed": processed_count,
+                "cache": {"llm": llm_cache.stats(), "render": render_cache.stats()},
+                "timings": summary["timings"],
+                "token_usage": summary["token_usage"],
+                "render_startup_ms": render_pool.startup_ms,
+                "llm": llm_client.stats(),
+                "summary": summary,
+                "results_db": os.path.abspath(results_db_path),
+                "run_id": run_id
+            }, f, indent=4, ensure_ascii=False)
+        os.replace(temp_filepath, summary_filepath)
+        return summary
+
+    with results_store, ExitStack() as services:
+        try:
+            render_pool, llm_client, pipeline = services.enter_context(open_run_services(config, args, caches["compile"]))
+        except (OSError, RuntimeError) as e:
+            # 例如未安装 Node.js 或渲染服务启动超时
+            print(f"❌ 错误：{e}")
+            return 1
+
+        def process_item(item_dir_name):
+            # 渲染时页面从结果目录加载 assets：用硬链接 (或符号链接) 代替复制
+            source_assets_dir = os.path.join(dataset_root_dir, item_dir_name, 'assets')
+            if os.path.isdir(source_assets_dir):
+                link_assets(source_assets_dir, os.path.join(results_base_dir, item_dir_name, 'assets'))
+            item_screenshot_path = dataset_index.screenshot_path(item_dir_name)
+            # 调用核心生成和评估函数
+            return generate_code_from_screenshot(
+                item_screenshot_path,
+                output_base_dir=results_base_dir,
+                model=args.model,
+                render_pool=render_pool,
+                pipeline=pipeline,
+                llm_cache=llm_cache,
+                render_cache=render_cache,
+                resume=bool(args.resume),
+                image_options=image_options,
+                image_cache=image_cache,
+                save_screenshots=not args.no_save_screenshots,
+                dataset_index=dataset_index,
+                llm_client=llm_client,
+                num_samples=args.num_samples,
+                selection_objective=args.selection_objective,
+                refine_rounds=args.refine_rounds,
+                refine_min_gain=args.refine_min_gain,
+                refine_max_seconds=args.refine_max_seconds,
+                refine_max_tokens=args.refine_max_tokens,
+                results_store=results_store,
+                run_id=run_id,
+                few_shot=args.few_shot,
+                temperature=args.temperature
+            )
+
+        def on_item_done(item_dir_name, result):
+            nonlocal processed_count, last_summary_write
+            processed_count += 1
+            result.setdefault("item_id", item_dir_name)
+            running_summary.add(result)
+            # 打印当前项目的简要结果
+            print(f"\n--- 完成 {item_dir_name} ({processed_count}/{len(runnable_item_dirs)}) ---")
+            print_item_result(item_dir_name, result)
+            if time.monotonic() - last_summary_write >= SUMMARY_WRITE_INTERVAL:
+                write_summary_metrics(finished=False)
+                last_summary_write = time.monotonic()
+
+        # 结果在每个项目完成时已写入结果库并计入 running_summary，这里不再在内存中保留全部结果
+        pipeline.map(process_item, runnable_item_dirs, on_result=on_item_done, collect=False)
+
+    for cache in caches.values():
+        cache.evict()
+    # --- 汇总并保存所有指标 (每个项目的结果在结果库中) ---
+    summary = write_summary_metrics(finished=True)
+    cache_stats = {"llm": llm_cache.stats(), "render": render_cache.stats()}
+    llm_stats = llm_client.stats()
+    if args.resume:
+        print(f"\n🔁 断点续跑：{summary['resumed']} 个项目已完成并被跳过，其余项目只重跑了缺失的阶段。")
     print(f"\n✅ 所有项目的汇总指标已保存到: {summary_filepath}")
 
-    # --- 计算并打印总体统计信息 ---
-    # 过滤掉没有成功生成代码的项目，因为这些项目的相似度可能为0，影响平均值
-    successful_generations = [r for r in all_item_results if r.get('metrics', {}).get('generation_success')]
-    successful_renders = [r for r in all_item_results if r.get('metrics', {}).get('rendering_success')]
+    print_summary_report(summary, cache_stats, llm_stats)
+    print(f"\n详细结果请查看: {os.path.abspath(results_base_dir)}")
+    return 0
 
-    total_generated_success = len(successful_generations)
-    total_rendered_success = len(successful_renders)
-    
-    # 确保在计算平均值时只考虑有效的相似度分数
-    valid_code_scores = [r['metrics']['code_similarity_score'] for r in successful_generations if r['metrics'].get('code_similarity_score') is not None]
-    valid_visual_scores = [r['metrics']['visual_similarity_ssim_score'] for r in successful_renders if r['metrics'].get('visual_similarity_ssim_score') is not None]
+def cmd_render(args) -> int:
+    """
+    渲染单个 JSX (+ SCSS) 文件为截图，输出渲染结果 (JSON)。
+    """
+    with open(args.jsx, 'r', encoding='utf-8') as f:
+        jsx_code = f.read()
+    scss_code = ""
+    if args.scss:
+        with open(args.scss, 'r', encoding='utf-8') as f:
+            scss_code = f.read()
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+    if args.assets:
+        link_assets(args.assets, os.path.join(output_dir, 'assets'))
 
-    avg_code_sim = np.mean(valid_code_scores) if valid_code_scores else 0.0
-    avg_visual_sim = np.mean(valid_visual_scores) if valid_visual_scores else 0.0
+    try:
+        with get_config().create_render_pool(workers=1, log_level=args.render_log_level) as render_pool:
+            result = render_code(jsx_code, scss_code, args.output, render_pool)
+    except (OSError, RuntimeError) as e:
+        print(f"❌ 错误：{e}")
+        return 1
+    print(json.dumps(result, indent=4, ensure_ascii=False))
+    return 0 if result.get("ok") else 1
 
-    print("\n--- 🚀 整体评估报告 (Summary Report) 🚀 ---")
-    print(f"总处理项目数: {total_items}")
-    print(f"成功生成代码的项目数: {total_generated_success}/{total_items} ({total_generated_success/total_items:.2%})")
-    print(f"成功渲染页面的项目数: {total_rendered_success}/{total_items} ({total_rendered_success/total_items:.2%})")
-    print(f"平均代码相似度 (针对成功生成的): {avg_code_sim:.4f}")
-    print(f"平均视觉相似度 (SSIM, 针对成功渲染的): {avg_visual_sim:.4f}")
-    print(f"\n详细结果请查看: {os.path.abspath(RESULTS_BASE_DIR)}")
\ No newline at end of file
+def cmd_score(args) -> int:
+    """
+    对一张渲染截图 (以及可选的生成代码 / 真实代码) 打分，输出指标 (JSON)。
+    """
+    def read_optional(path):
+        if not path:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+
+    generated_jsx_code = read_optional(args.jsx) or ""
+    generated_scss_code = read_optional(args.scss) or ""
+    scores = score_generated_item(args.reference, args.rendered, generated_jsx_code, read_optional(args.original_jsx),
+                                  True, generated_scss_code, read_optional(args.original_scss))
+    print(json.dumps(scores, indent=4, ensure_ascii=False))
+    return 0 if scores.get("visual_metrics") else 1
+
+def cmd_summarize(args) -> int:
+    """
+    指定运行目录时，重新汇总并打印该次运行的报告 (可用于未完成或多次续跑的运行)：
+    优先读取结果库，库中没有该运行时读取各项目的 metadata.json。
+    不指定运行目录时，按 --group-by 汇总结果库中的所有运行 (可用 --run / --model 过滤)，便于跨运行、跨模型比较。
+    """
+    if args.run_dir is None:
+        results_db_path = args.db or os.path.join('data', 'generated_results', RESULTS_DB_FILENAME)
+        if not os.path.exists(results_db_path):
+            print(f"❌ 错误：结果库不存在：{results_db_path}")
+            return 1
+        with ResultsStore(results_db_path) as results_store:
+            rows = results_store.aggregate(tuple(args.group_by), run_ids=args.run, models=args.model)
+        print_aggregate_table(rows, tuple(args.group_by))
+        if not rows:
+            return 1
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(rows, f, indent=4, ensure_ascii=False)
+            print(f"\n✅ 汇总结果已保存到: {args.json}")
+        return 0
+
+    if not os.path.isdir(args.run_dir):
+        print(f"❌ 错误：运行目录不存在：{args.run_dir}")
+        return 1
+    results_db_path, run_id = find_run_in_results_db(args.run_dir, args.db)
+    if run_id is not None:
+        print(f"结果库: {results_db_path} (run_id: {run_id})")
+        with ResultsStore(results_db_path) as results_store:
+            item_results = results_store.latest_results(run_id)
+    else:
+        item_results = load_run_results(args.run_dir)
+    if not item_results:
+        print(f"❌ 错误：结果库和运行目录中都没有该运行的结果：{args.run_dir}")
+        return 1
+    summary = summarize_results(item_results)
+    print_summary_report(summary)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=4, ensure_ascii=False)
+        print(f"\n✅ 汇总结果已保存到: {args.json}")
+    return 0
+
+SUBCOMMANDS = ('generate', 'render', 'score', 'summarize', 'sweep')
+
+def add_run_arguments(parser: argparse.ArgumentParser, config: CodegenConfig):
+    """
+    批量运行 (generate / sweep) 共用的命令行参数。各组与 generate_code_from_screenshot 的可选参数对应：
+      - 并发：pipeline / render_pool / llm_client，LLM 调用、渲染和指标计算分别受各阶段的并发限制，指标在进程池中计算
+      - 限流与预算：llm_client 的 RPM / TPM 限流、重试和整次运行的 token / 费用预算
+      - 图片预处理：image_options / image_cache，截图上传前缩放、切分和重新编码 (见 image_prep.DEFAULT_IMAGE_OPTIONS)
+      - 缓存：llm_cache / render_cache，完全相同的请求或代码直接复用模型输出或渲染截图
+      - best-of-N：num_samples / selection_objective，一次请求 N 个补全，并行渲染、打分后保留最好的一个
+      - 视觉反馈修正：refine_*，首次渲染成功后按截图差异修正代码 (见 refine_generated_code)
+      - 断点续跑与结果库：resume / results_store / run_id，只重新执行失败或缺失的阶段，元数据追加到结果库
+      - 其他：dataset_index (资产列表和渲染缓存键取自数据集索引)，save_screenshots (是否写入 rendered_screenshot.png)
+    模型、prompt、few_shot 和 temperature 由 generate 和 sweep 各自的参数给出。
+    """
+    parser.add_argument('--dataset', default=os.path.join('data', 'processed', 'ui2code_dataset'), help="数据集目录")
+    parser.add_argument('--output-root', default=os.path.join('data', 'generated_results'), help="结果根目录，每次运行在其下创建带时间戳的子目录 (run_<时间戳> 或 sweep_<时间戳>)")
+    parser.add_argument('--llm-workers', type=int, default=4, help="同时进行的 LLM 请求数")
+    parser.add_argument('--render-workers', type=int, default=config.render_workers, help="渲染服务中并发的浏览器上下文数")
+    parser.add_argument('--metric-workers', type=int, default=default_metric_workers(), help="计算指标的进程数 (0 表示在工作线程内直接计算)")
+    parser.add_argument('--max-inflight', type=int, default=None, help="同时在途的项目数上限，默认按各阶段并发数自动推算")
+    parser.add_argument('--render-log-level', choices=RENDER_LOG_LEVELS, default=config.render_log_level, help="渲染日志级别：off / errors (仅出错时) / summary / trace (保存编译产物和 DOM 等调试文件)")
+    parser.add_argument('--render-ready-timeout', type=float, default=config.render_ready_timeout, help="等待页面就绪 (React 提交 + 图片解码) 的上限秒数，超过后直接截图")
+    parser.add_argument('--image-max-edge', type=int, default=DEFAULT_IMAGE_OPTIONS["max_edge"], help="上传截图的长边上限 (像素)")
+    parser.add_argument('--image-tile-height', type=int, default=DEFAULT_IMAGE_OPTIONS["tile_height"], help="大于 0 时把长截图按该高度切成多张图片上传")
+    parser.add_argument('--image-format', choices=IMAGE_FORMATS, default=DEFAULT_IMAGE_OPTIONS["image_format"], help="上传截图重新编码的格式")
+    parser.add_argument('--image-quality', type=int, default=DEFAULT_IMAGE_OPTIONS["quality"], help="webp / jpeg 的压缩质量")
+    parser.add_argument('--keep-alpha', action='store_true', help="保留截图的透明通道 (默认去掉)")
+    parser.add_argument('--dataset-index', default=None, help="数据集索引文件路径，默认为数据集目录下的 dataset_index.json")
+    parser.add_argument('--no-save-screenshots', action='store_true', help="渲染截图只在内存中打分，不写入 rendered_screenshot.png")
+    parser.add_argument('--num-samples', type=int, default=1, help="best-of-N：每个项目生成的候选数，大于 1 时并行渲染、打分并保留最好的一个")
+    parser.add_argument('--selection-objective', choices=sorted(SELECTION_OBJECTIVES), default='ssim', help="best-of-N 选择候选的目标 (只依赖参考截图)")
+    parser.add_argument('--refine-rounds', type=int, default=0, help="视觉反馈修正的最大轮数 (0 表示不修正)")
+    parser.add_argument('--refine-min-gain', type=float, default=0.005, help="单轮 SSIM 提升低于该值时停止修正")
+    parser.add_argument('--refine-max-seconds', type=float, default=None, help="每个项目修正阶段的耗时上限 (秒)")
+    parser.add_argument('--refine-max-tokens', type=int, default=None, help="每个项目修正阶段的 token 上限")
+    parser.add_argument('--rpm', type=float, default=config.llm_requests_per_minute, help="每分钟最多发起的 LLM 请求数 (不设置则不限)")
+    parser.add_argument('--tpm', type=float, default=config.llm_tokens_per_minute, help="每分钟最多消耗的 token 数 (按 预估输入 + max_tokens 预扣，不设置则不限)")
+    parser.add_argument('--llm-max-retries', type=int, default=6, help="429、超时、连接错误和 5xx 的最大重试次数")
+    parser.add_argument('--llm-timeout', type=float, default=120.0, help="单次 LLM 请求的超时时间 (秒)")
+    parser.add_argument('--max-total-tokens', type=int, default=None, help="整次运行的 token 预算，用完后不再发起新的请求；每个请求按 预估输入 + max_tokens 的最坏情况预留，实际能完成的请求比 预算/平均用量 少")
+    parser.add_argument('--max-total-cost', type=float, default=None, help="整次运行的费用预算 (美元)，用完后不再发起新的请求；与 token 预算一样按 max_tokens 的最坏情况预留")
+    parser.add_argument('--results-db', default=None, help="结果库 (SQLite) 路径，默认为结果根目录下的 results.sqlite，由所有运行共享")
+    parser.add_argument('--resume', metavar='RUN_DIR', default=None, help="在已有的运行目录上继续，跳过已完成的项目，只重跑失败或缺失的阶段")
+    parser.add_argument('--cache-mode', choices=CACHE_MODES, default='read-write', help="LLM 响应与渲染结果缓存的使用方式")
+    parser.add_argument('--cache-dir', default=os.path.join('data', 'cache'), help="缓存目录")
+    parser.add_argument('--cache-max-size-mb', type=float, default=2048, help="每类缓存的最大总大小 (MB)，超出时淘汰最久未使用的条目")
+    parser.add_argument('--cache-max-age-days', type=float, default=30, help="缓存条目的最长保留天数")
+
+def import_sweep_module():
+    """
+    导入 sweep 模块。以脚本方式运行时本模块名为 __main__，先把它登记为 gpt4o_codegen，
+    避免 sweep 再导入一份独立的副本 (两份副本的配置、客户端等全局状态互不相通)。
+    """
+    sys.modules.setdefault('gpt4o_codegen', sys.modules[__name__])
+    import sweep
+    return sweep
+
+def build_parser() -> argparse.ArgumentParser:
+    config = get_config()
+    parser = argparse.ArgumentParser(description="根据截图生成 React + SCSS 代码并评估。不指定子命令时等同于 generate。")
+    subparsers = parser.add_subparsers(dest='command')
+
+    generate_parser = subparsers.add_parser('generate', help="批量根据截图生成代码、渲染并评估")
+    generate_parser.add_argument('--model', default='gpt-4o', help="使用的模型")
+    generate_parser.add_argument('--temperature', type=float, default=0.7, help="采样温度")
+    generate_parser.add_argument('--few-shot', action='store_true', help="在系统 prompt 之后加入 shot0 示例对话")
+    add_run_arguments(generate_parser, config)
+    generate_parser.set_defaults(handler=cmd_generate)
+
+    render_parser = subparsers.add_parser('render', help="渲染单个 JSX (+ SCSS) 文件为截图")
+    render_parser.add_argument('jsx', help="JSX 文件")
+    render_parser.add_argument('--scss', default=None, help="SCSS 文件")
+    render_parser.add_argument('--output', '-o', required=True, help="截图输出路径 (PNG)")
+    render_parser.add_argument('--assets', default=None, help="页面引用的图片资产目录，会链接到截图所在目录的 assets/ 下")
+    render_parser.add_argument('--render-log-level', choices=RENDER_LOG_LEVELS, default=config.render_log_level, help="渲染日志级别")
+    render_parser.set_defaults(handler=cmd_render)
+
+    score_parser = subparsers.add_parser('score', help="对渲染截图 (和可选的代码) 打分")
+    score_parser.add_argument('reference', help="参考截图")
+    score_parser.add_argument('rendered', help="渲染截图")
+    score_parser.add_argument('--jsx', default=None, help="生成的 JSX 文件")
+    score_parser.add_argument('--original-jsx', default=None, help="真实的 JSX 文件")
+    score_parser.add_argument('--scss', default=None, help="生成的 SCSS 文件")
+    score_parser.add_argument('--original-scss', default=None, help="真实的 SCSS 文件")
+    score_parser.set_defaults(handler=cmd_score)
+
+    summarize_parser = subparsers.add_parser('summarize', help="重新汇总一个运行目录的结果，或跨运行比较结果库中的所有运行")
+    summarize_parser.add_argument('run_dir', nargs='?', default=None, help="运行目录 (data/generated_results/run_<时间戳>)；省略时汇总结果库中的所有运行")
+    summarize_parser.add_argument('--db', default=None, help="结果库路径，默认按运行目录的位置查找 (generate 和扫参的结果根目录)，不指定运行目录时为 data/generated_results 下的 results.sqlite")
+    summarize_parser.add_argument('--group-by', nargs='+', choices=GROUP_BY_FIELDS, default=list(GROUP_BY_FIELDS), help="跨运行汇总时的分组字段")
+    summarize_parser.add_argument('--run', nargs='+', default=None, help="只汇总这些 run_id")
+    summarize_parser.add_argument('--model', nargs='+', default=None, help="只汇总这些模型")
+    summarize_parser.add_argument('--json', default=None, help="把汇总结果写入该文件")
+    summarize_parser.set_defaults(handler=cmd_summarize)
+
+    sweep = import_sweep_module()
+    sweep_parser = subparsers.add_parser('sweep', help="扫参：比较 模型 × prompt 变体 × few-shot × 温度 的网格",
+                                         description=sweep.SWEEP_DESCRIPTION)
+    sweep.add_sweep_arguments(sweep_parser, config)
+    sweep_parser.set_defaults(handler=sweep.run_sweep)
+    return parser
+
+def main(argv: list = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # 兼容旧的用法：不带子命令时等同于 generate
+    if not argv or argv[0] not in SUBCOMMANDS and argv[0] not in ('-h', '--help'):
+        argv.insert(0, 'generate')
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
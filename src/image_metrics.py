@@ -0,0 +1,207 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+from scipy.ndimage import uniform_filter
+
+from pipeline import metric_process_context
+
+# SSIM 参数与 skimage.metrics.structural_similarity 的默认值保持一致 (7x7 均值窗口，样本协方差)
+SSIM_WIN_SIZE = 7
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+DATA_RANGE = 255.0
+MS_SSIM_FACTORS = (2, 4, 8)  # 多尺度 SSIM 使用的下采样倍数
+DEFAULT_TILE_GRID = (4, 2)   # 分区得分的 (行数, 列数)
+PAD_VALUE = 255.0            # 渲染图比参考图短时，用白色补齐
+MAX_PSNR = 100.0             # 两图完全相同时 PSNR 为无穷大，记为该上限以便写入 JSON
+
+# 参考截图解码后的灰度数组缓存 (每个进程一份)：同一张参考图只解码一次
+_REFERENCE_CACHE_SIZE = 64
+_reference_cache = OrderedDict()
+_reference_cache_lock = threading.Lock()
+
+
+def load_grayscale(image) -> np.ndarray:
+    """
+    把图片解码为 float32 灰度数组。image 可以是文件路径、PNG 字节串或已经解码好的数组。
+    """
+    if isinstance(image, np.ndarray):
+        return image.astype(np.float32, copy=False)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    with Image.open(image) as img:
+        return np.asarray(img.convert('L'), dtype=np.float32)
+
+
+def load_reference(image_path: str) -> np.ndarray:
+    """
+    读取参考截图并缓存解码结果。以 (路径, 修改时间, 文件大小) 为键，文件变化后自动重新解码。
+    """
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+    with _reference_cache_lock:
+        cached = _reference_cache.get(key)
+        if cached is not None:
+            _reference_cache.move_to_end(key)
+            return cached
+
+    array = load_grayscale(image_path)
+    array.setflags(write=False)
+    with _reference_cache_lock:
+        _reference_cache[key] = array
+        while len(_reference_cache) > _REFERENCE_CACHE_SIZE:
+            _reference_cache.popitem(last=False)
+    return array
+
+
+def align_to_reference(reference: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """
+    把渲染图对齐到参考图的尺寸，且不扭曲纵横比：
+    先按宽度等比缩放，再按参考图高度裁剪 (整页截图更长时) 或用白色补齐 (更短时)。
+    """
+    ref_height, ref_width = reference.shape
+    cand_height, cand_width = candidate.shape
+    if cand_width != ref_width:
+        scaled_height = max(1, round(cand_height * ref_width / cand_width))
+        resized = Image.fromarray(candidate).resize((ref_width, scaled_height), Image.BILINEAR)
+        candidate = np.asarray(resized, dtype=np.float32)
+
+    if candidate.shape[0] >= ref_height:
+        return candidate[:ref_height]
+    padded = np.full(reference.shape, PAD_VALUE, dtype=np.float32)
+    padded[:candidate.shape[0]] = candidate
+    return padded
+
+
+def ssim_map(image1: np.ndarray, image2: np.ndarray, win_size: int = SSIM_WIN_SIZE) -> np.ndarray:
+    """
+    计算 SSIM 图。结果对应 skimage 默认参数下去掉边缘 (win_size-1)/2 像素后的区域。
+    五个窗口统计量堆叠在一起，用一次 uniform_filter 向量化求出；float32 即可满足精度。
+    """
+    x = image1.astype(np.float32, copy=False)
+    y = image2.astype(np.float32, copy=False)
+    num_pixels = win_size * win_size
+    cov_norm = num_pixels / (num_pixels - 1)  # 样本协方差
+
+    ux, uy, uxx, uyy, uxy = uniform_filter(np.stack([x, y, x * x, y * y, x * y]), size=(1, win_size, win_size))
+    ux_uy = ux * uy
+    ux_sq = ux * ux
+    uy_sq = uy * uy
+
+    c1 = (SSIM_K1 * DATA_RANGE) ** 2
+    c2 = (SSIM_K2 * DATA_RANGE) ** 2
+    numerator = (2 * ux_uy + c1) * (2 * cov_norm * (uxy - ux_uy) + c2)
+    denominator = (ux_sq + uy_sq + c1) * (cov_norm * (uxx - ux_sq + uyy - uy_sq) + c2)
+    pad = (win_size - 1) // 2
+    return (numerator / denominator)[pad:-pad, pad:-pad]
+
+
+def _downscale(image: np.ndarray, factor: int) -> np.ndarray:
+    """
+    按 factor x factor 块取均值下采样 (丢弃不足一块的边缘)。
+    """
+    height = image.shape[0] // factor * factor
+    width = image.shape[1] // factor * factor
+    blocks = image[:height, :width].reshape(height // factor, factor, width // factor, factor)
+    return blocks.mean(axis=(1, 3))
+
+
+def _tile_scores(score_map: np.ndarray, tile_grid: tuple) -> list:
+    rows, cols = tile_grid
+    row_edges = np.linspace(0, score_map.shape[0], rows + 1).astype(int)
+    col_edges = np.linspace(0, score_map.shape[1], cols + 1).astype(int)
+    return [
+        [float(score_map[row_edges[r]:row_edges[r + 1], col_edges[c]:col_edges[c + 1]].mean(dtype=np.float64))
+         for c in range(cols)]
+        for r in range(rows)
+    ]
+
+
+def worst_tiles(tiles: list, width: int, height: int, count: int = 3) -> list:
+    """
+    从 compare_images 返回的分区得分中取出得分最低的 count 个分区，
+    返回 [{"row", "col", "ssim", "box": [左, 上, 右, 下]}, ...]，box 为参考图中的像素坐标 (与分区的划分方式一致)。
+    """
+    rows, cols = len(tiles), len(tiles[0]) if tiles else 0
+    row_edges = np.linspace(0, height, rows + 1).astype(int)
+    col_edges = np.linspace(0, width, cols + 1).astype(int)
+    cells = sorted((score, r, c) for r, row in enumerate(tiles) for c, score in enumerate(row))
+    return [
+        {"row": r, "col": c, "ssim": score,
+         "box": [int(col_edges[c]), int(row_edges[r]), int(col_edges[c + 1]), int(row_edges[r + 1])]}
+        for score, r, c in cells[:count]
+    ]
+
+
+def compare_images(reference: np.ndarray, candidate: np.ndarray, tile_grid: tuple = DEFAULT_TILE_GRID) -> dict:
+    """
+    一次性计算参考图与渲染图之间的多项视觉指标：
+      - ssim:     全分辨率 SSIM
+      - ms_ssim:  在 MS_SSIM_FACTORS 各个下采样尺度上的 SSIM 均值 (对细小偏移不那么敏感)
+      - mse/psnr: 像素级均方误差与峰值信噪比
+      - tiles:    按 tile_grid 划分的分区 SSIM，可用于定位差异最大的区域
+    """
+    candidate = align_to_reference(reference, candidate)
+    if min(reference.shape) < SSIM_WIN_SIZE:
+        raise ValueError(f"图片尺寸过小，无法计算 SSIM：{reference.shape}")
+
+    full_map = ssim_map(reference, candidate)
+    scale_scores = []
+    for factor in MS_SSIM_FACTORS:
+        if min(reference.shape) // factor < SSIM_WIN_SIZE:
+            break
+        scale_scores.append(float(ssim_map(_downscale(reference, factor), _downscale(candidate, factor)).mean(dtype=np.float64)))
+
+    diff = reference - candidate
+    mse = float(np.mean(diff * diff, dtype=np.float64))
+    psnr = MAX_PSNR if mse == 0 else min(MAX_PSNR, float(10 * np.log10(DATA_RANGE ** 2 / mse)))
+
+    # float32 运算在两图完全相同时可能略超过 1，这里截断
+    ssim_score = min(1.0, float(full_map.mean(dtype=np.float64)))
+    return {
+        "ssim": ssim_score,
+        "ms_ssim": min(1.0, float(np.mean(scale_scores))) if scale_scores else ssim_score,
+        "mse": mse,
+        "psnr": psnr,
+        "tiles": _tile_scores(full_map, tile_grid),
+    }
+
+
+def score_pair(reference_path: str, candidate, tile_grid: tuple = DEFAULT_TILE_GRID) -> dict:
+    """
+    对一对截图打分。参考图走解码缓存，candidate 可以是路径、PNG 字节串或数组。
+    """
+    return compare_images(load_reference(reference_path), load_grayscale(candidate), tile_grid)
+
+
+def _score_pair_safe(args) -> dict:
+    reference_path, candidate, tile_grid = args
+    try:
+        return score_pair(reference_path, candidate, tile_grid)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def score_pairs(pairs: list, workers: int = None, tile_grid: tuple = DEFAULT_TILE_GRID) -> list:
+    """
+    批量打分：pairs 为 [(参考图路径, 渲染图), ...]，按输入顺序返回结果列表。
+    使用进程池并行计算；同一参考图的任务尽量分到同一批，以复用各进程中的解码缓存。
+    单个任务失败时对应结果为 {"error": ...}。
+    """
+    tasks = [(reference_path, candidate, tile_grid) for reference_path, candidate in pairs]
+    if workers == 0 or len(tasks) <= 1:
+        return [_score_pair_safe(task) for task in tasks]
+
+    order = sorted(range(len(tasks)), key=lambda i: tasks[i][0])
+    results = [None] * len(tasks)
+    # 与流水线的指标进程池相同，不用 fork：调用方可能已有 LLM 事件循环和渲染服务的线程
+    with ProcessPoolExecutor(max_workers=workers, mp_context=metric_process_context()) as executor:
+        chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 4))
+        for index, result in zip(order, executor.map(_score_pair_safe, [tasks[i] for i in order], chunksize=chunksize)):
+            results[index] = result
+    return results
@@ -0,0 +1,137 @@
+import io
+import json
+import math
+import base64
+import hashlib
+
+from response_cache import DiskCache
+
+IMAGE_FORMATS = ('webp', 'jpeg', 'png')
+_MIME_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+# OpenAI 视觉模型 detail=high 时的计费规则：先缩放到 2048x2048 以内，再把短边缩到 768，
+# 然后按 512x512 的块计费，每块 170 token，另加 85 token 的基础费用
+_HIGH_DETAIL_MAX_EDGE = 2048
+_HIGH_DETAIL_SHORT_EDGE = 768
+_TILE_SIZE = 512
+_TOKENS_PER_TILE = 170
+_BASE_TOKENS = 85
+
+DEFAULT_IMAGE_OPTIONS = {
+    "max_edge": 2048,       # 长边上限 (像素)，超出时等比缩小
+    "tile_height": 0,       # >0 时把长截图按该高度切成多张图片分别上传
+    "image_format": 'webp', # 重新编码的格式
+    "quality": 90,          # webp / jpeg 的压缩质量
+    "keep_alpha": False,    # 截图通常不需要透明通道，默认去掉
+}
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = 'high') -> int:
+    """
+    按 OpenAI 的规则估算一张图片消耗的输入 token 数。
+    """
+    if detail == 'low':
+        return _BASE_TOKENS
+    scale = min(1.0, _HIGH_DETAIL_MAX_EDGE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, _HIGH_DETAIL_SHORT_EDGE / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / _TILE_SIZE) * math.ceil(height / _TILE_SIZE)
+    return _BASE_TOKENS + _TOKENS_PER_TILE * tiles
+
+
+def _encode(img, image_format: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == 'png':
+        img.save(buffer, format='PNG', optimize=True)
+    elif image_format == 'jpeg':
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    else:
+        img.save(buffer, format='WEBP', quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def _process(image_bytes: bytes, max_edge: int, tile_height: int, image_format: str, quality: int, keep_alpha: bool) -> list:
+    from PIL import Image  # 只在真正需要重新编码时才加载 PIL
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        if keep_alpha and has_alpha and image_format != 'jpeg':
+            img = img.convert('RGBA')
+        else:
+            img = img.convert('RGB')
+
+    if max_edge and max(img.size) > max_edge:
+        scale = max_edge / max(img.size)
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+
+    if tile_height and img.height > tile_height:
+        boxes = [(0, top, img.width, min(top + tile_height, img.height)) for top in range(0, img.height, tile_height)]
+    else:
+        boxes = [(0, 0, img.width, img.height)]
+
+    tiles = []
+    for box in boxes:
+        tile = img.crop(box) if box != (0, 0, img.width, img.height) else img
+        encoded = _encode(tile, image_format, quality)
+        tiles.append({
+            "mime_type": _MIME_TYPES[image_format],
+            "width": tile.width,
+            "height": tile.height,
+            "bytes": len(encoded),
+            "estimated_tokens": estimate_image_tokens(tile.width, tile.height),
+            "base64": base64.b64encode(encoded).decode('ascii'),
+        })
+    return tiles
+
+
+def prepare_upload_images(image_path: str | bytes, cache: DiskCache = None, max_edge: int = 2048, tile_height: int = 0,
+                          image_format: str = 'webp', quality: int = 90, keep_alpha: bool = False) -> dict:
+    """
+    上传前预处理截图：限制长边、可选按高度切块、重新编码为更紧凑的格式、去掉透明通道。
+    image_path 也可以直接是图片字节 (例如渲染服务返回的截图)。
+    返回 {"images": [...], "original_bytes", "upload_bytes", "estimated_tokens", "cache_hit"}，
+    images 中每项包含 mime_type / width / height / bytes / estimated_tokens / base64。
+    传入 cache 时以 (原图内容哈希, 预处理参数) 为键缓存结果，不会修改数据集中的原图。
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"不支持的图片格式：{image_format}，可选值为 {', '.join(IMAGE_FORMATS)}")
+    if isinstance(image_path, (bytes, bytearray)):
+        image_bytes = bytes(image_path)
+    else:
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+
+    options = {"max_edge": max_edge, "tile_height": tile_height, "image_format": image_format,
+               "quality": quality, "keep_alpha": keep_alpha}
+    cache_key = DiskCache.make_key({"image_sha256": hashlib.sha256(image_bytes).hexdigest(), **options}) if cache else None
+    cached = cache.get_text(cache_key) if cache else None
+    if cached is not None:
+        images = json.loads(cached)
+    else:
+        images = _process(image_bytes, **options)
+        if cache:
+            cache.put_text(cache_key, json.dumps(images))
+
+    return {
+        "images": images,
+        "original_bytes": len(image_bytes),
+        "upload_bytes": sum(image["bytes"] for image in images),
+        "estimated_tokens": sum(image["estimated_tokens"] for image in images),
+        "cache_hit": cached is not None,
+    }
+
+
+def to_image_content_parts(prepared: dict, detail: str = 'high') -> list:
+    """
+    把预处理结果转换为 chat.completions 消息中的 image_url 内容块。
+    """
+    return [
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{image['mime_type']};base64,{image['base64']}",
+                "detail": detail
+            }
+        }
+        for image in prepared["images"]
+    ]
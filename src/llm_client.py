@@ -0,0 +1,340 @@
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+# 每百万 token 的价格 (美元)：(输入, 输出)。模型名按最长前缀匹配，未知模型不计费用
+DEFAULT_PRICES_PER_MILLION = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+}
+
+
+class BudgetExhaustedError(RuntimeError):
+    """
+    运行级别的 token / 费用预算已用完，不再发起新的请求。
+    """
+
+
+class RequestOverBudgetError(BudgetExhaustedError):
+    """
+    单个请求的预估用量 (按 max_tokens 上限计算) 本身就超出了整次运行的预算，无论已用多少都无法发起。
+    """
+
+
+class _RateLimiter:
+    """
+    令牌桶：容量为每分钟的额度，按 额度/60 每秒匀速补充。
+    只在 LLMClient 的事件循环线程中使用，等待者按到达顺序排队。
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float):
+        # 单个请求超过整桶容量时，最多等到桶满再放行，避免永远等待
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                await asyncio.sleep((amount - self.available) / self.rate)
+
+    def adjust(self, delta: float):
+        """
+        按实际用量修正：delta 为 实际 - 预估，正数表示补扣，负数表示退还。
+        """
+        self._refill()
+        self.available = min(self.capacity, self.available - delta)
+
+
+class _Budget:
+    """
+    运行级别的预算。发起请求前按预估用量 (token 和费用) 预留，完成后按实际用量结算。
+    只因在途请求的预留而超出上限时等待它们结算；已用部分加上本次预估仍超出上限时拒绝新的请求。
+    因此并发的在途请求合计也不会超出 token / 费用上限。
+    预估按 max_tokens 的上限计算，比实际用量保守：预算接近用完时，剩余额度放不下一个最坏情况的请求就会停止，
+    实际能完成的请求数会少于 预算 / 平均用量。
+    只在 LLMClient 的事件循环线程中使用。
+    """
+
+    def __init__(self, max_tokens: int = None, max_cost: float = None):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.spent_tokens = 0
+        self.spent_cost = 0.0
+        self.reserved_tokens = 0
+        self.reserved_cost = 0.0
+        self.exhausted = False
+        self._settled = asyncio.Condition()
+
+    def _check(self, estimated_tokens: int, estimated_cost: float):
+        if (self.max_tokens is not None and estimated_tokens > self.max_tokens) or \
+                (self.max_cost is not None and estimated_cost > self.max_cost):
+            limits = []
+            if self.max_tokens is not None:
+                limits.append(f"{self.max_tokens} token")
+            if self.max_cost is not None:
+                limits.append(f"${self.max_cost:.4f}")
+            raise RequestOverBudgetError(
+                f"单个请求的预估用量 ({estimated_tokens} token / ${estimated_cost:.4f}，按 max_tokens 上限计算) "
+                f"超出了整次运行的预算 ({' / '.join(limits)})，请提高预算或降低 max_tokens")
+        over_tokens = self.max_tokens is not None and self.spent_tokens + estimated_tokens > self.max_tokens
+        over_cost = self.max_cost is not None and self.spent_cost + estimated_cost > self.max_cost
+        if over_tokens or over_cost:
+            self.exhausted = True
+        if self.exhausted:
+            raise BudgetExhaustedError(
+                f"LLM 预算已用完 (已用 {self.spent_tokens} token / ${self.spent_cost:.4f})，不再发起新的请求")
+
+    def _waiting_for_reservations(self, estimated_tokens: int, estimated_cost: float) -> bool:
+        over_tokens = self.max_tokens is not None and self.spent_tokens + self.reserved_tokens + estimated_tokens > self.max_tokens
+        over_cost = self.max_cost is not None and self.spent_cost + self.reserved_cost + estimated_cost > self.max_cost
+        return over_tokens or over_cost
+
+    async def reserve(self, estimated_tokens: int, estimated_cost: float = 0.0):
+        async with self._settled:
+            self._check(estimated_tokens, estimated_cost)
+            while self._waiting_for_reservations(estimated_tokens, estimated_cost):
+                await self._settled.wait()
+                self._check(estimated_tokens, estimated_cost)
+            self.reserved_tokens += estimated_tokens
+            self.reserved_cost += estimated_cost
+
+    async def settle(self, estimated_tokens: int, estimated_cost: float, used_tokens: int, cost: float):
+        async with self._settled:
+            self.reserved_tokens -= estimated_tokens
+            self.reserved_cost -= estimated_cost
+            self.spent_tokens += used_tokens
+            self.spent_cost += cost
+            self._settled.notify_all()
+
+
+def _retry_after_seconds(error: Exception) -> float | None:
+    """
+    从错误响应中读取服务端建议的等待时间 (retry-after-ms / retry-after，后者可以是秒数或 HTTP 日期)。
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    import openai
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):  # 含超时
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES
+
+
+class LLMClient:
+    """
+    带限流、重试和预算控制的 LLM 客户端。
+    内部在独立线程中运行一个 asyncio 事件循环，使用 AsyncOpenAI 和显式配置的 httpx 连接池 (长连接复用)；
+    流水线的工作线程调用 complete() 提交请求并阻塞等待结果。
+      - requests_per_minute / tokens_per_minute: 令牌桶限流 (token 按 预估输入 + max_tokens 预扣，完成后按实际用量修正)
+      - max_retries: 对 429、超时、连接错误和 5xx 做带抖动的指数退避重试，优先遵守服务端的 Retry-After；
+        收到 429 时所有新请求一起暂停，避免继续撞限额
+      - max_total_tokens / max_total_cost: 整次运行的预算 (按 max_tokens 上限保守预留)，用完后新的请求直接抛出 BudgetExhaustedError；
+        单个请求的预估就超出预算时抛出 RequestOverBudgetError
+    """
+
+    def __init__(self, api_key: str = None, base_url: str = None, requests_per_minute: float = None,
+                 tokens_per_minute: float = None, max_concurrency: int = 16, max_retries: int = 6,
+                 timeout: float = 120.0, backoff_base: float = 1.0, backoff_max: float = 60.0,
+                 max_total_tokens: int = None, max_total_cost: float = None,
+                 prices_per_million: dict = None, async_client=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.prices_per_million = prices_per_million or DEFAULT_PRICES_PER_MILLION
+
+        self._async_client = async_client  # 测试或自定义时可直接传入 AsyncOpenAI 兼容对象
+        self._owns_client = async_client is None
+        self.max_total_tokens = max_total_tokens
+        self.max_total_cost = max_total_cost
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._cooldown_until = 0.0  # 收到 429 后，所有请求在此时刻 (monotonic) 之前暂停
+        self._counters = {"requests": 0, "retries": 0, "rate_limited": 0, "errors": 0,
+                          "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+    # --- 生命周期 ---
+    def start(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=loop.run_forever, name="llm-client-loop", daemon=True)
+            self._thread.start()
+            self._loop = loop
+            asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+
+    async def _setup(self):
+        # 限流器、信号量和 HTTP 客户端都要在事件循环线程中创建
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._request_limiter = _RateLimiter(self.requests_per_minute) if self.requests_per_minute else None
+        self._token_limiter = _RateLimiter(self.tokens_per_minute) if self.tokens_per_minute else None
+        self._budget = _Budget(self.max_total_tokens, self.max_total_cost)
+        if self._async_client is None:
+            import httpx
+            import openai
+            http_client = openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency,
+                                    keepalive_expiry=60.0),
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+            )
+            # 重试由本类负责，关闭 SDK 自带的重试以免叠加
+            self._async_client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                                    http_client=http_client, max_retries=0, timeout=self.timeout)
+
+    def close(self):
+        with self._start_lock:
+            loop, self._loop = self._loop, None
+            if loop is None:
+                return
+            if self._owns_client and self._async_client is not None:
+                try:
+                    asyncio.run_coroutine_threadsafe(self._async_client.close(), loop).result(timeout=10)
+                except Exception:
+                    pass
+                self._async_client = None
+            loop.call_soon_threadsafe(loop.stop)
+            self._thread.join(timeout=10)
+            loop.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --- 请求接口 ---
+    def complete(self, request_kwargs: dict, estimated_prompt_tokens: int = 0):
+        """
+        发起一次 chat.completions 请求并阻塞等待结果 (可在任意线程中调用)。
+        estimated_prompt_tokens 为输入 token 的预估值，用于 TPM 限流和预算预留。
+        预算用完时抛出 BudgetExhaustedError；重试耗尽后抛出最后一次的错误。
+        """
+        if self._loop is None:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(self._complete(request_kwargs, estimated_prompt_tokens), self._loop).result()
+
+    def _cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        matches = [name for name in self.prices_per_million if model.startswith(name)]
+        if not matches:
+            return 0.0
+        input_price, output_price = self.prices_per_million[max(matches, key=len)]
+        return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+    async def _complete(self, request_kwargs: dict, estimated_prompt_tokens: int):
+        # 输出 token 的上限按采样数 n 计算
+        estimated_completion_tokens = request_kwargs.get("max_tokens", 0) * request_kwargs.get("n", 1)
+        estimated_tokens = estimated_prompt_tokens + estimated_completion_tokens
+        estimated_cost = self._cost(request_kwargs.get("model", ""), estimated_prompt_tokens, estimated_completion_tokens)
+        await self._budget.reserve(estimated_tokens, estimated_cost)
+        used_tokens, cost = 0, 0.0
+        try:
+            async with self._semaphore:
+                for attempt in range(self.max_retries + 1):
+                    cooldown = self._cooldown_until - time.monotonic()
+                    if cooldown > 0:
+                        await asyncio.sleep(cooldown)
+                    if self._request_limiter:
+                        await self._request_limiter.acquire(1)
+                    if self._token_limiter:
+                        await self._token_limiter.acquire(estimated_tokens)
+
+                    self._counters["requests"] += 1
+                    try:
+                        response = await self._async_client.chat.completions.create(**request_kwargs)
+                    except Exception as e:
+                        if self._token_limiter:
+                            # 失败的尝试没有消耗 token：退还本次预扣，重试时重新预扣，避免 429 风暴中反复扣减额度
+                            self._token_limiter.adjust(-estimated_tokens)
+                        if attempt >= self.max_retries or not _is_retryable(e):
+                            self._counters["errors"] += 1
+                            raise
+                        delay = self._backoff_delay(attempt, e)
+                        self._counters["retries"] += 1
+                        print(f"⚠️ LLM 请求失败 ({type(e).__name__})，{delay:.1f} 秒后重试 ({attempt + 1}/{self.max_retries})")
+                        await asyncio.sleep(delay)
+                        continue
+
+                    usage = getattr(response, "usage", None)
+                    if usage is not None:
+                        used_tokens = usage.total_tokens or 0
+                        self._counters["prompt_tokens"] += usage.prompt_tokens or 0
+                        self._counters["completion_tokens"] += usage.completion_tokens or 0
+                        self._counters["total_tokens"] += used_tokens
+                        cost = self._cost(request_kwargs.get("model", ""), usage.prompt_tokens or 0, usage.completion_tokens or 0)
+                        if self._token_limiter:
+                            self._token_limiter.adjust(used_tokens - estimated_tokens)
+                    else:
+                        used_tokens = estimated_tokens
+                    return response
+        finally:
+            await self._budget.settle(estimated_tokens, estimated_cost, used_tokens, cost)
+
+    def _backoff_delay(self, attempt: int, error: Exception) -> float:
+        """
+        带完全抖动的指数退避；服务端给出 Retry-After 时以它为准 (另加少量抖动，避免所有请求同时醒来)。
+        """
+        import openai
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.backoff_base)
+        else:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if isinstance(error, openai.RateLimitError):
+            self._counters["rate_limited"] += 1
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+        return delay
+
+    def stats(self) -> dict:
+        stats = dict(self._counters)
+        budget = getattr(self, "_budget", None)
+        stats["cost_usd"] = round(budget.spent_cost, 6) if budget else 0.0
+        stats["budget_exhausted"] = budget.exhausted if budget else False
+        return stats
@@ -0,0 +1,126 @@
+import os
+import queue
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def metric_process_context():
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(start_method)
+
+
+class BatchPipeline:
+    """
+    批量处理数据集的并发流水线。
+    每个项目依次经过三个阶段：LLM 调用 (I/O 密集，线程并发)、渲染 (交给渲染服务)、
+    指标计算 (CPU 密集，进程池)。每个阶段的并发数单独限制；同时在途的项目总数也有上限，
+    下游阶段饱和时上游会被阻塞 (背压)，不会无限堆积请求或内存。
+    """
+
+    def __init__(self, llm_workers: int = 4, render_workers: int = 2, metric_workers: int = 2, max_inflight: int = None):
+        self.llm_workers = max(1, llm_workers)
+        self.render_workers = max(1, render_workers)
+        self.metric_workers = max(0, metric_workers)
+        # 默认允许每个阶段各有一批项目在排队，保证流水线不断流
+        self.max_inflight = max_inflight or 2 * (self.llm_workers + self.render_workers + max(1, self.metric_workers))
+
+        self._llm_slots = threading.BoundedSemaphore(self.llm_workers)
+        self._render_slots = threading.BoundedSemaphore(self.render_workers)
+        # metric_workers 为 0 时在当前线程内直接计算指标
+        # 流水线创建时渲染服务的读线程、LLM 客户端的事件循环线程可能已经在运行，
+        # 在多线程进程中 fork 可能让子进程死锁在被复制的锁上，因此用 forkserver (不支持时用 spawn) 启动指标进程
+        self._metric_pool = ProcessPoolExecutor(max_workers=self.metric_workers, mp_context=metric_process_context()) if self.metric_workers else None
+
+    # --- 各阶段的并发控制 ---
+    @contextmanager
+    def llm_stage(self):
+        with self._llm_slots:
+            yield
+
+    @contextmanager
+    def render_stage(self):
+        with self._render_slots:
+            yield
+
+    def run_metrics(self, fn, *args, **kwargs):
+        """
+        在指标进程池中执行 fn 并等待结果。fn 及其参数必须可以被 pickle。
+        """
+        return self.submit_metrics(fn, *args, **kwargs).result()
+
+    def submit_metrics(self, fn, *args, **kwargs) -> Future:
+        """
+        把 fn 提交到指标进程池并立即返回 Future，便于同一项目的多个计算并行执行。
+        metric_workers 为 0 时在当前线程内直接计算，返回已完成的 Future。
+        """
+        if self._metric_pool is not None:
+            return self._metric_pool.submit(fn, *args, **kwargs)
+        return completed_future(fn, *args, **kwargs)
+
+    # --- 批量调度 ---
+    def map(self, process_item, items: list, on_result=None, collect: bool = True) -> list:
+        """
+        并发地对每个 item 调用 process_item(item)，按输入顺序返回结果列表。
+        on_result(item, result) 在主线程中按完成顺序回调，可用于打印进度。
+        collect 为 False 时不保留结果 (返回空列表)，结果只交给 on_result，内存占用不随项目数增长。
+        process_item 抛出的异常会被转换为 {"status": "error", ...} 结果。
+        """
+        results = [None] * len(items) if collect else []
+        done_queue = queue.Queue()
+        inflight = threading.BoundedSemaphore(self.max_inflight)
+
+        def run(index, item):
+            try:
+                result = process_item(item)
+            except Exception as e:
+                result = {"status": "error", "message": f"总错误: {e}", "metrics": {}}
+            finally:
+                inflight.release()
+            done_queue.put((index, item, result))
+
+        def feed(drivers):
+            # 在独立线程中提交任务：在途项目达到上限时阻塞，形成背压
+            for index, item in enumerate(items):
+                inflight.acquire()
+                drivers.submit(run, index, item)
+
+        with ThreadPoolExecutor(max_workers=self.max_inflight, thread_name_prefix='pipeline') as drivers:
+            feeder = threading.Thread(target=feed, args=(drivers,), daemon=True)
+            feeder.start()
+            for _ in range(len(items)):
+                index, item, result = done_queue.get()
+                if collect:
+                    results[index] = result
+                if on_result is not None:
+                    on_result(item, result)
+            feeder.join()
+
+        return results
+
+    def close(self):
+        if self._metric_pool is not None:
+            self._metric_pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def default_metric_workers() -> int:
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def completed_future(fn, *args, **kwargs) -> Future:
+    """
+    在当前线程内执行 fn，把结果 (或异常) 包装为已完成的 Future。
+    """
+    future = Future()
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
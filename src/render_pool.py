@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import itertools
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+# 假设 renderer 目录在项目根目录下，与 src 目录同级
+current_script_dir = os.path.dirname(os.path.abspath(__file__))
+RENDERER_SCRIPT_PATH = os.path.join(os.path.dirname(current_script_dir), 'renderer', 'render_jsx.js')
+
+# 渲染服务的日志级别：off 不写日志；errors 只在出错时写错误日志；summary 每个任务写几行关键信息；
+# trace 记录全部细节，并保存编译前后的代码、页面 HTML 和最终 DOM 等调试文件
+RENDER_LOG_LEVELS = ('off', 'errors', 'summary', 'trace')
+
+
+class RenderPool:
+    """
+    常驻的 Node.js 渲染服务。
+    只启动一次 `node render_jsx.js --server`，由它维护 N 个预热好的无头浏览器上下文；
+    Python 端通过 stdin/stdout 逐行收发 JSON 消息，每个任务带独立的超时时间。
+    需要截图字节时，响应行中的 screenshot_bytes 给出 PNG 长度，原始字节紧跟在该行之后 (不经过 base64 或磁盘)。
+    线程安全：多个线程可以同时调用 render()。
+    """
+
+    def __init__(self, workers: int = 2, job_timeout: float = 60.0, startup_timeout: float = 60.0,
+                 ready_timeout: float = 10.0, headful: bool = False, node_command: str = 'node',
+                 script_path: str = RENDERER_SCRIPT_PATH, compile_cache_dir: str = None,
+                 compile_cache_read_only: bool = False, log_level: str = 'errors'):
+        if log_level not in RENDER_LOG_LEVELS:
+            raise ValueError(f"未知的渲染日志级别：{log_level}，可选值为 {', '.join(RENDER_LOG_LEVELS)}")
+        self.workers = max(1, workers)
+        self.job_timeout = job_timeout
+        self.ready_timeout = ready_timeout  # 等待页面就绪 (React 提交 + 图片解码) 的上限，超过后直接截图
+        self.startup_timeout = startup_timeout
+        self.headful = headful
+        self.node_command = node_command
+        self.script_path = script_path
+        # Sass/Babel 编译结果的磁盘缓存目录 (为 None 时只在渲染服务进程内存中缓存)
+        self.compile_cache_dir = compile_cache_dir
+        self.compile_cache_read_only = compile_cache_read_only
+        self.log_level = log_level
+
+        self._process = None
+        self._ready = threading.Event()
+        self._ready_message = None           # 渲染服务启动完成时发来的 ready 消息
+        self.startup_ms = None               # 最近一次启动渲染服务 (Node.js + 浏览器 + 全部上下文) 的耗时
+        self._lock = threading.Lock()        # 保护进程的启动与关闭
+        self._write_lock = threading.Lock()  # 保证每条请求完整地写入 stdin
+        self._pending = {}                   # 任务 id -> Future
+        self._started_at = {}                # 任务 id -> 渲染服务开始执行该任务的时刻 (monotonic)，排队中的任务不在其中
+        self._pending_lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self._stderr_tail = deque(maxlen=200)  # 保留最近的渲染日志，出错时用于诊断
+
+    # --- 进程管理 ---
+    def start(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                return
+            if not os.path.exists(self.script_path):
+                raise FileNotFoundError(f"JSX 渲染脚本未找到：{self.script_path}。请确保已设置 renderer 目录。")
+
+            command = [self.node_command, self.script_path, '--server', '--workers', str(self.workers),
+                       '--log-level', self.log_level]
+            if self.headful:
+                command.append('--headful')
+            if self.compile_cache_dir:
+                command.extend(['--compile-cache-dir', os.path.abspath(self.compile_cache_dir)])
+                if self.compile_cache_read_only:
+                    command.append('--compile-cache-read-only')
+
+            self._ready.clear()
+            self._ready_message = None
+            started_at = time.perf_counter()
+            try:
+                self._process = subprocess.Popen(
+                    command,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+            except OSError as e:
+                raise RuntimeError(f"无法启动渲染服务 ({self.node_command})：{e}。请确保 Node.js 已安装并配置在 PATH 中。") from e
+            process = self._process
+            threading.Thread(target=self._read_stdout, args=(process,), daemon=True).start()
+            threading.Thread(target=self._read_stderr, args=(process,), daemon=True).start()
+
+            if not self._ready.wait(self.startup_timeout) or self._ready_message is None:
+                self._kill(process)
+                raise RuntimeError(f"渲染服务启动失败或超时。最近日志:\n{self._format_stderr_tail()}")
+            self.startup_ms = (time.perf_counter() - started_at) * 1000
+            print(f"✅ 渲染服务已启动 (pid={process.pid}, 并发上下文数={self.workers})")
+
+    def close(self):
+        with self._lock:
+            process, self._process = self._process, None
+            if process is None:
+                return
+            try:
+                # 关闭 stdin 后，渲染服务会等待进行中的任务完成再退出
+                process.stdin.close()
+                process.wait(timeout=self.job_timeout)
+            except Exception:
+                self._kill(process)
+            self._fail_pending("渲染服务已关闭")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def _kill(process):
+        try:
+            process.kill()
+            process.wait(timeout=5)
+        except Exception:
+            pass
+
+    def _read_stdout(self, process):
+        for line in process.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                self._stderr_tail.append(f"[stdout] {line.decode('utf-8', errors='replace')}")
+                continue
+
+            payload_size = message.get('screenshot_bytes')
+            if payload_size:
+                payload = process.stdout.read(payload_size)
+                if len(payload) < payload_size:
+                    break  # 渲染进程在写出截图的过程中退出
+                message['screenshot'] = payload
+
+            if message.get('type') == 'ready':
+                self._ready_message = message
+                self._ready.set()
+                continue
+            if message.get('type') == 'started':
+                with self._pending_lock:
+                    if str(message.get('id')) in self._pending:
+                        self._started_at[str(message.get('id'))] = time.monotonic()
+                continue
+
+            with self._pending_lock:
+                future = self._pending.pop(str(message.get('id')), None)
+                self._started_at.pop(str(message.get('id')), None)
+            if future is not None and not future.done():
+                future.set_result(message)
+
+        # stdout 结束说明渲染进程已退出：让所有等待中的任务立即失败，下次调用时自动重启。
+        # 只有当前进程的读取线程才唤醒 start()；已被替换的旧进程不能把新进程误标为就绪
+        if self._process is process:
+            self._ready.set()
+            process.wait()
+            self._fail_pending(f"渲染服务意外退出 (退出码: {process.returncode})。最近日志:\n{self._format_stderr_tail()}")
+
+    def _read_stderr(self, process):
+        for line in process.stderr:
+            self._stderr_tail.append(line.decode('utf-8', errors='replace').rstrip('\n'))
+
+    def _fail_pending(self, reason: str):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+            self._started_at.clear()
+        for job_id, future in pending.items():
+            if not future.done():
+                future.set_result({"id": job_id, "ok": False, "error": reason})
+
+    def _format_stderr_tail(self, lines: int = 20) -> str:
+        return "\n".join(list(self._stderr_tail)[-lines:])
+
+    # --- 渲染接口 ---
+    def render(self, jsx_code: str, scss_code: str, output_path: str, timeout: float | None = None,
+               log_level: str | None = None, return_screenshot: bool = False, write_file: bool = True) -> dict:
+        """
+        提交一个渲染任务并阻塞等待结果。
+        返回渲染服务的响应字典，至少包含 ok 和 error 两个字段；
+        成功时还包含 ready_ms (从开始加载页面到就绪的毫秒数) 和 ready_timed_out；
+        compile_cache_hit 表示 Sass/Babel 编译是否全部命中缓存；
+        timings 为渲染服务内各阶段的耗时 (queue_ms / startup_ms / compile_ms / load_ms / screenshot_ms)。
+        log_level 可为单个任务覆盖渲染服务的日志级别 (例如只对某个项目开启 trace)。
+        return_screenshot 为 True 时，成功截图的 PNG 字节放在结果的 screenshot 字段中直接返回；
+        write_file 为 False 时不把截图写到 output_path (该目录仍用于提供 assets 和存放日志)。
+        """
+        return self.render_many([{"jsx_code": jsx_code, "scss_code": scss_code, "output_path": output_path}],
+                                timeout=timeout, log_level=log_level, return_screenshot=return_screenshot,
+                                write_file=write_file)[0]
+
+    def render_many(self, jobs: list, timeout: float | None = None, log_level: str | None = None,
+                    return_screenshot: bool = False, write_file: bool = True) -> list:
+        """
+        一次提交多个渲染任务 (每个为 {"jsx_code", "scss_code", "output_path"})，由渲染服务的各个上下文并行执行，
+        按输入顺序返回结果列表。结果格式和其余参数与 render() 相同。每个任务的超时单独计算 (见 _wait)。
+        """
+        timeout = timeout or self.job_timeout
+        with self._lock:
+            alive = self._process is not None and self._process.poll() is None
+        if not alive:
+            self.start()
+
+        submitted = [self._submit(job, timeout, log_level, return_screenshot, write_file) for job in jobs]
+        # 提交失败时直接是错误结果
+        return [self._wait(job_id, future, timeout) if isinstance(future, Future) else future for job_id, future in submitted]
+
+    def _wait(self, job_id: str, future: Future, timeout: float) -> dict:
+        """
+        等待单个任务的结果。超时从渲染服务报告 started (任务拿到浏览器上下文) 时算起，排队的时间不计入；
+        排队期间渲染进程退出时，读取线程会让任务立即失败，因此不会无限等待。
+        """
+        while True:
+            with self._pending_lock:
+                started_at = self._started_at.get(job_id)
+            # 渲染服务自身也会按 timeout_ms 终止任务 (并重建上下文)，这里多留一点余量
+            wait_seconds = 1.0 if started_at is None else started_at + timeout + 10 - time.monotonic()
+            try:
+                return future.result(timeout=max(0.0, wait_seconds))
+            except FutureTimeoutError:
+                if started_at is None:
+                    continue
+                with self._pending_lock:
+                    self._pending.pop(job_id, None)
+                    self._started_at.pop(job_id, None)
+                return {"id": job_id, "ok": False, "error": f"渲染超时 ({timeout:.0f} 秒)"}
+
+    def _submit(self, job: dict, timeout: float, log_level: str | None, return_screenshot: bool, write_file: bool):
+        job_id = str(next(self._job_ids))
+        future = Future()
+        with self._pending_lock:
+            self._pending[job_id] = future
+
+        request = {
+            "id": job_id,
+            "output_path": os.path.abspath(job["output_path"]),
+            "jsx": job["jsx_code"],
+            "scss": job["scss_code"],
+            "timeout_ms": int(timeout * 1000),
+            "ready_timeout_ms": int(self.ready_timeout * 1000),
+        }
+        if log_level is not None:
+            request["log_level"] = log_level
+        if return_screenshot:
+            request["return_screenshot"] = True
+        if not write_file:
+            request["write_file"] = False
+        try:
+            with self._write_lock:
+                self._process.stdin.write(json.dumps(request).encode('utf-8') + b"\n")
+                self._process.stdin.flush()
+        except (OSError, ValueError, AttributeError) as e:
+            with self._pending_lock:
+                self._pending.pop(job_id, None)
+            return job_id, {"id": job_id, "ok": False, "error": f"无法向渲染服务提交任务: {e}"}
+        return job_id, future
@@ -0,0 +1,152 @@
+import os
+import time
+import json
+import hashlib
+import threading
+
+CACHE_MODES = ('read-write', 'read-only', 'bypass')
+
+
+class DiskCache:
+    """
+    以内容哈希为键的磁盘缓存。
+    每个条目是 <cache_dir>/<namespace>/<key 前两位>/<key> 下的一个文件，写入时先写临时文件再原子替换，
+    因此多个线程或进程可以安全地共享同一个缓存目录。
+    mode:
+      - read-write: 命中则直接返回，未命中时写入新结果
+      - read-only:  只读取已有结果，不写入
+      - bypass:     完全不读也不写
+    超过 max_age_seconds 的条目会被淘汰；总大小超过 max_bytes 时按最近使用时间从旧到新淘汰。
+    """
+
+    def __init__(self, cache_dir: str, namespace: str, mode: str = 'read-write',
+                 max_bytes: int = None, max_age_seconds: float = None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"未知的缓存模式：{mode}，可选值为 {', '.join(CACHE_MODES)}")
+        self.root = os.path.join(cache_dir, namespace)
+        self.namespace = namespace
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        if self.mode != 'bypass':
+            os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(payload) -> str:
+        """
+        把请求负载规范化为 JSON (键排序) 后计算 SHA-256，作为缓存键。
+        """
+        canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, key: str) -> bytes | None:
+        if self.mode == 'bypass':
+            return None
+        entry_path = self._entry_path(key)
+        try:
+            if self.max_age_seconds is not None and time.time() - os.path.getmtime(entry_path) > self.max_age_seconds:
+                self._count("misses")
+                return None
+            with open(entry_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        except OSError as e:
+            print(f"⚠️ 警告：读取缓存条目 {entry_path} 失败：{e}")
+            self._count("misses")
+            return None
+        try:
+            # 刷新修改时间，按大小淘汰时优先保留最近用过的条目
+            os.utime(entry_path)
+        except OSError:
+            pass
+        self._count("hits")
+        return data
+
+    def put(self, key: str, data: bytes):
+        if self.mode != 'read-write':
+            return
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, entry_path)
+            self._count("writes")
+        except OSError as e:
+            print(f"⚠️ 警告：写入缓存条目 {entry_path} 失败：{e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def get_text(self, key: str) -> str | None:
+        data = self.get(key)
+        return data.decode('utf-8') if data is not None else None
+
+    def put_text(self, key: str, text: str):
+        self.put(key, text.encode('utf-8'))
+
+    def evict(self):
+        """
+        按年龄和总大小淘汰条目。只在 read-write 模式下生效。
+        """
+        if self.mode != 'read-write' or not os.path.isdir(self.root):
+            return
+        now = time.time()
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                entry_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        evicted = 0
+        kept = []
+        for mtime, size, entry_path in entries:
+            if self.max_age_seconds is not None and now - mtime > self.max_age_seconds:
+                evicted += self._remove(entry_path)
+            else:
+                kept.append((mtime, size, entry_path))
+
+        if self.max_bytes is not None:
+            total_bytes = sum(size for _, size, _ in kept)
+            for mtime, size, entry_path in sorted(kept):
+                if total_bytes <= self.max_bytes:
+                    break
+                evicted += self._remove(entry_path)
+                total_bytes -= size
+
+        if evicted:
+            self._count("evictions", evicted)
+
+    @staticmethod
+    def _remove(entry_path: str) -> int:
+        try:
+            os.remove(entry_path)
+            return 1
+        except OSError:
+            return 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        counters["mode"] = self.mode
+        return counters
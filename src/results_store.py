@@ -0,0 +1,228 @@
+import json
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+
+RESULTS_DB_FILENAME = 'results.sqlite'
+# aggregate() 可用的分组字段
+GROUP_BY_FIELDS = ('run_id', 'model')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    output_dir TEXT,
+    started_at TEXT,
+    config TEXT,
+    config_key TEXT
+);
+CREATE TABLE IF NOT EXISTS prompts (
+    prompt_hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    recorded_at TEXT NOT NULL,
+    status TEXT,
+    model TEXT,
+    system_prompt_hash TEXT,
+    user_prompt_hash TEXT,
+    generation_success INTEGER,
+    rendering_success INTEGER,
+    metrics_computed INTEGER,
+    ssim REAL,
+    ms_ssim REAL,
+    code_similarity REAL,
+    scss_similarity REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    reused INTEGER,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_run_item ON results (run_id, item_id, id);
+CREATE INDEX IF NOT EXISTS results_item ON results (item_id);
+CREATE VIEW IF NOT EXISTS latest_results AS
+    SELECT * FROM results WHERE id IN (SELECT MAX(id) FROM results GROUP BY run_id, item_id);
+"""
+
+
+def prompt_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultsStore:
+    """
+    只追加的结果库 (SQLite)。每个项目每次保存追加一行并立即提交，同一 (run_id, item_id) 以最新的一行为准，
+    因此运行中途崩溃也不会丢失已完成项目的结果，断点续跑只需继续追加。
+    prompt 文本按 SHA-256 去重存放在 prompts 表，结果中只记录哈希。
+    常用指标 (成功标记、相似度、token 用量) 单独成列，aggregate() 直接用 SQL 跨运行、跨模型汇总，无需读取每个项目的元数据。
+    多个线程可以共享同一个实例。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._known_prompts = set()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL") # 写入时不阻塞其他进程读取 (例如运行中执行 summarize)
+            self._conn.executescript(_SCHEMA)
+            # 早期的结果库没有 runs.config_key 列
+            if "config_key" not in {row["name"] for row in self._conn.execute("PRAGMA table_info(runs)")}:
+                self._conn.execute("ALTER TABLE runs ADD COLUMN config_key TEXT")
+            # 早期的结果库没有 results.reused 列：按元数据中的 reused_from 补齐
+            if "reused" not in {row["name"] for row in self._conn.execute("PRAGMA table_info(results)")}:
+                self._conn.execute("ALTER TABLE results ADD COLUMN reused INTEGER")
+                self._conn.execute("UPDATE results SET reused = json_extract(metadata, '$.reused_from') IS NOT NULL")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --- 写入接口 ---
+    def start_run(self, run_id: str, output_dir: str = None, config: dict = None, config_key: str = None):
+        """
+        登记一次运行；断点续跑时沿用已有的记录。
+        config_key 是生成配置 (模型、prompt、采样参数等) 的哈希，相同 config_key 的运行对同一项目的结果可以互相复用。
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO runs (run_id, output_dir, started_at, config, config_key) VALUES (?, ?, ?, ?, ?)",
+                (run_id, output_dir, datetime.now().isoformat(), json.dumps(config or {}, ensure_ascii=False), config_key)
+            )
+            self._conn.commit()
+
+    def put_prompt(self, text: str) -> str:
+        """
+        保存 prompt 文本 (已存在则跳过)，返回其哈希。
+        """
+        text_hash = prompt_hash(text)
+        with self._lock:
+            if text_hash not in self._known_prompts:
+                self._conn.execute("INSERT OR IGNORE INTO prompts (prompt_hash, text) VALUES (?, ?)", (text_hash, text))
+                self._conn.commit()
+                self._known_prompts.add(text_hash)
+        return text_hash
+
+    def append_result(self, run_id: str, item_id: str, metadata: dict, status: str = None):
+        """
+        追加一个项目的结果并立即提交。metadata 与 metadata.json 的格式相同 (prompt 以哈希代替原文)。
+        metadata 中有 reused_from 时，该结果是从其他运行复用的 (reused = 1)，其 token 用量和耗时属于原来的运行。
+        """
+        metrics = metadata.get("metrics", {})
+        token_usage = metrics.get("token_usage") or {}
+        row = (
+            run_id, item_id, metadata.get("timestamp") or datetime.now().isoformat(), status,
+            metadata.get("model_used"), metadata.get("system_prompt_hash"), metadata.get("user_prompt_hash"),
+            int(bool(metrics.get("generation_success"))), int(bool(metrics.get("rendering_success"))),
+            int(bool(metrics.get("metrics_computed"))),
+            metrics.get("visual_similarity_ssim_score") if metrics.get("rendering_success") else None,
+            (metrics.get("visual_metrics") or {}).get("ms_ssim") if metrics.get("rendering_success") else None,
+            metrics.get("code_similarity_score") if metrics.get("generation_success") else None,
+            metrics.get("scss_similarity_score") if metrics.get("generation_success") else None,
+            token_usage.get("prompt_tokens"), token_usage.get("completion_tokens"), token_usage.get("total_tokens"),
+            int(bool(metadata.get("reused_from"))), json.dumps(metadata, ensure_ascii=False)
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO results (run_id, item_id, recorded_at, status, model, system_prompt_hash, user_prompt_hash, "
+                "generation_success, rendering_success, metrics_computed, ssim, ms_ssim, code_similarity, scss_similarity, "
+                "prompt_tokens, completion_tokens, total_tokens, reused, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row
+            )
+            self._conn.commit()
+
+    # --- 查询接口 ---
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get_prompt(self, text_hash: str) -> str | None:
+        rows = self._query("SELECT text FROM prompts WHERE prompt_hash = ?", (text_hash,))
+        return rows[0]["text"] if rows else None
+
+    def runs(self) -> list:
+        """
+        所有运行 (按开始时间排序)：[{"run_id", "output_dir", "started_at", "config"}, ...]。
+        """
+        rows = self._query("SELECT * FROM runs ORDER BY started_at, run_id")
+        return [{**dict(row), "config": json.loads(row["config"] or "{}")} for row in rows]
+
+    def has_run(self, run_id: str) -> bool:
+        return bool(self._query("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)))
+
+    def find_run(self, output_dir: str) -> str | None:
+        """
+        输出目录为 output_dir (绝对路径) 的运行的 run_id；有多次运行时取最近开始的一次，没有时返回 None。
+        """
+        rows = self._query("SELECT run_id FROM runs WHERE output_dir = ? ORDER BY started_at DESC LIMIT 1", (output_dir,))
+        return rows[0]["run_id"] if rows else None
+
+    def latest_metadata(self, run_id: str, item_id: str) -> dict | None:
+        """
+        该项目最新一次保存的元数据；没有记录时返回 None。
+        """
+        rows = self._query("SELECT metadata FROM results WHERE run_id = ? AND item_id = ? ORDER BY id DESC LIMIT 1", (run_id, item_id))
+        return json.loads(rows[0]["metadata"]) if rows else None
+
+    def latest_results(self, run_id: str) -> list:
+        """
+        某次运行中每个项目的最新结果，格式与 generate 返回的结果相同：[{"item_id", "status", "metrics", "resumed"}, ...] (按项目名排序)。
+        从其他运行复用的结果 resumed 为 True，汇总时不计入本次运行的耗时和 token 用量。
+        """
+        rows = self._query("SELECT item_id, status, reused, metadata FROM latest_results WHERE run_id = ? ORDER BY item_id", (run_id,))
+        return [{"item_id": row["item_id"], "status": row["status"], "metrics": json.loads(row["metadata"]).get("metrics", {}),
+                 "resumed": bool(row["reused"])} for row in rows]
+
+    def find_completed(self, config_key: str, item_id: str, exclude_run_id: str = None) -> dict | None:
+        """
+        查找相同 config_key 的运行中该项目最新的已完成结果 (指标已计算)。
+        返回 {"run_id", "output_dir", "status", "metadata"}；没有时返回 None。
+        """
+        rows = self._query(
+            "SELECT r.run_id, r.status, r.metadata, runs.output_dir FROM latest_results AS r JOIN runs ON runs.run_id = r.run_id "
+            "WHERE runs.config_key = ? AND r.item_id = ? AND r.metrics_computed = 1 AND r.run_id IS NOT ? ORDER BY r.id DESC LIMIT 1",
+            (config_key, item_id, exclude_run_id)
+        )
+        if not rows:
+            return None
+        return {"run_id": rows[0]["run_id"], "output_dir": rows[0]["output_dir"], "status": rows[0]["status"],
+                "metadata": json.loads(rows[0]["metadata"])}
+
+    def aggregate(self, group_by: tuple = GROUP_BY_FIELDS, run_ids: list = None, models: list = None) -> list:
+        """
+        按 group_by 分组汇总每个项目的最新结果：项目数、生成 / 渲染成功数、平均相似度和 token 用量。
+        平均代码相似度只统计生成成功的项目，平均视觉相似度只统计渲染成功的项目；
+        token 用量不含从其他运行复用的结果 (已计入原来的运行)，reused 为复用的项目数。可用 run_ids / models 过滤。
+        """
+        unknown = [field for field in group_by if field not in GROUP_BY_FIELDS]
+        if unknown:
+            raise ValueError(f"未知的分组字段：{', '.join(unknown)}，可选值为 {', '.join(GROUP_BY_FIELDS)}")
+        conditions, params = [], []
+        for field, values in (("run_id", run_ids), ("model", models)):
+            if values:
+                conditions.append(f"{field} IN ({', '.join('?' for _ in values)})")
+                params.extend(values)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        columns = ", ".join(group_by)
+        rows = self._query(
+            f"SELECT {columns + ', ' if columns else ''}COUNT(*) AS items, SUM(generation_success) AS generated, "
+            "SUM(rendering_success) AS rendered, AVG(ssim) AS avg_ssim, AVG(ms_ssim) AS avg_ms_ssim, "
+            "AVG(code_similarity) AS avg_code_similarity, AVG(scss_similarity) AS avg_scss_similarity, "
+            "SUM(reused) AS reused, SUM(prompt_tokens) FILTER (WHERE reused IS NOT 1) AS prompt_tokens, "
+            "SUM(completion_tokens) FILTER (WHERE reused IS NOT 1) AS completion_tokens, SUM(total_tokens) FILTER (WHERE reused IS NOT 1) AS total_tokens "
+            f"FROM latest_results {where} {'GROUP BY ' + columns + ' ORDER BY ' + columns if columns else ''}",
+            tuple(params)
+        )
+        return [dict(row) for row in rows]
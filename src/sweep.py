@@ -0,0 +1,359 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+from datetime import datetime
+from contextlib import ExitStack
+
+import gpt4o_codegen
+from gpt4o_codegen import generate_code_from_screenshot, summarize_results, add_run_arguments, create_caches, image_options_from_args, open_run_services
+from codegen_config import Prompts, PromptConfigError
+from response_cache import DiskCache
+from dataset_index import DatasetIndex, link_assets
+from results_store import ResultsStore, RESULTS_DB_FILENAME
+
+FEW_SHOT_CHOICES = {"off": (False,), "on": (True,), "both": (False, True)}
+
+
+class SweepConfig:
+    """
+    扫参网格中的一个配置：模型 × prompt 变体 × 是否 few-shot × 采样温度。
+    """
+
+    def __init__(self, model: str, prompt_variant: str, prompts: Prompts, few_shot: bool, temperature: float):
+        self.model = model
+        self.prompt_variant = prompt_variant
+        self.prompts = prompts
+        self.few_shot = few_shot
+        self.temperature = temperature
+        self.name = f"{re.sub(r'[^A-Za-z0-9._-]+', '-', model)}__{prompt_variant}__{'fewshot' if few_shot else 'zeroshot'}__t{temperature:g}"
+        self.key = None        # 生成配置的哈希，见 compute_key
+        self.run_id = None     # 结果库中的 run_id: <sweep_id>/<name>
+        self.output_dir = None
+
+    def compute_key(self, generation_options: dict) -> str:
+        """
+        配置的哈希：覆盖实际发给模型的 prompt 文本 (而不是变体名) 和所有影响结果的生成参数，
+        相同哈希的 (项目, 配置) 无论在哪次扫参中都只需计算一次。
+        """
+        self.key = DiskCache.make_key({
+            "model": self.model,
+            "temperature": self.temperature,
+            "few_shot": self.few_shot,
+            "system": self.prompts.system,
+            "user_template": self.prompts.user_template,
+            "shot0": [self.prompts.shot0_user, self.prompts.shot0_assistant] if self.few_shot else None,
+            "refine_user_template": self.prompts.refine_user_template if generation_options.get("refine_rounds") else None,
+            **generation_options
+        })
+        return self.key
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "prompt_variant": self.prompt_variant,
+            "few_shot": self.few_shot,
+            "temperature": self.temperature,
+            "config_key": self.key
+        }
+
+
+def parse_prompt_variants(specs: list) -> dict:
+    """
+    把 NAME=DIR (或只有 DIR，此时以目录名为变体名) 解析为 {变体名: Prompts}。必需的 prompt 为空时抛出 PromptConfigError。
+    """
+    variants = {}
+    for spec in specs:
+        name, _, prompts_dir = spec.rpartition('=') if '=' in spec else (os.path.basename(os.path.normpath(spec)), '', spec)
+        variants[name] = Prompts.load(prompts_dir)
+    return variants
+
+
+def build_sweep_grid(models: list, prompt_variants: dict, few_shot_options: tuple, temperatures: list, refine: bool = False) -> list:
+    """
+    展开 模型 × prompt 变体 × few-shot × 温度 的网格。few-shot 需要变体中有 shot0 示例，
+    refine 为 True (启用视觉反馈修正) 时需要变体中有修正 prompt 模板，否则抛出 PromptConfigError。
+    """
+    grid = []
+    for model in models:
+        for variant_name, prompts in prompt_variants.items():
+            if refine and not prompts.refine_user_template:
+                raise PromptConfigError(f"prompt 变体 {variant_name} 缺少修正 prompt 模板 (refine_user_template.txt)，无法使用 --refine-rounds。")
+            for few_shot in few_shot_options:
+                if few_shot and not (prompts.shot0_user and prompts.shot0_assistant):
+                    raise PromptConfigError(f"prompt 变体 {variant_name} 缺少 few-shot 示例 (shot0_user.txt / shot0_assistant.txt)。")
+                for temperature in temperatures:
+                    grid.append(SweepConfig(model, variant_name, prompts, few_shot, temperature))
+    return grid
+
+
+def deduplicate_configs(configs: list) -> list:
+    """
+    去掉哈希相同的重复配置 (例如内容相同的两个 prompt 变体)，保留第一个。
+    """
+    unique = {}
+    for sweep_config in configs:
+        if sweep_config.key in unique:
+            print(f"⚠️ 配置 {sweep_config.name} 与 {unique[sweep_config.key].name} 完全相同，只运行一次。")
+            continue
+        unique[sweep_config.key] = sweep_config
+    return list(unique.values())
+
+
+def copy_item_outputs(source_item_dir: str, target_item_dir: str):
+    """
+    把之前运行的项目目录复制到本次的项目目录：生成的代码、截图和候选 / 修正记录逐个复制，
+    之后重跑或修改本次的结果不会影响之前的运行；只有只读的 assets/ 以链接方式放入。已存在的文件保持不变。
+    """
+    os.makedirs(target_item_dir, exist_ok=True)
+    for entry in os.scandir(source_item_dir):
+        target_path = os.path.join(target_item_dir, entry.name)
+        if entry.name == 'assets' and entry.is_dir():
+            link_assets(entry.path, target_path)
+        elif os.path.lexists(target_path):
+            continue
+        elif entry.is_dir():
+            shutil.copytree(entry.path, target_path)
+        else:
+            shutil.copy2(entry.path, target_path)
+
+
+def reuse_completed_result(results_store: ResultsStore, sweep_config: SweepConfig, item_id: str) -> dict | None:
+    """
+    结果库中已有相同配置对该项目的完整结果时 (之前的扫参或断点续跑前的本次扫参)，把它复制进本次扫参，不再重新生成。
+    代码和截图复制到本次的项目目录 (见 copy_item_outputs)，元数据追加到本次的 run_id 下并记录来源。
+    返回复用的结果；没有可复用的结果时返回 None。
+    """
+    previous = results_store.find_completed(sweep_config.key, item_id)
+    if previous is None:
+        return None
+    metadata = dict(previous["metadata"])
+    if previous["run_id"] != sweep_config.run_id:
+        previous_item_dir = os.path.join(previous["output_dir"] or "", item_id)
+        item_output_dir = os.path.join(sweep_config.output_dir, item_id)
+        if os.path.isdir(previous_item_dir):
+            copy_item_outputs(previous_item_dir, item_output_dir)
+        if metadata.get("generated_screenshot_path"):
+            metadata["generated_screenshot_path"] = os.path.join(item_output_dir, 'rendered_screenshot.png')
+        metadata["reused_from"] = previous["run_id"]
+        results_store.append_result(sweep_config.run_id, item_id, metadata, previous["status"])
+    return {"status": previous["status"], "metrics": metadata.get("metrics", {}), "item_id": item_id, "resumed": True}
+
+
+def summarize_sweep(results_store: ResultsStore, configs: list, total_items: int) -> list:
+    """
+    每个配置一行的对比结果：成功数、复用数、平均相似度、token 用量和单个项目总耗时的中位数。
+    从其他运行复用的结果计入成功数和平均分，但不计入 token 用量和耗时 (已计入原来的运行)。
+    """
+    rows = []
+    for sweep_config in configs:
+        summary = summarize_results(results_store.latest_results(sweep_config.run_id), total_items=total_items)
+        rows.append({
+            **sweep_config.as_dict(),
+            "run_id": sweep_config.run_id,
+            "generated": summary["generated"],
+            "rendered": summary["rendered"],
+            "reused": summary["resumed"],
+            "avg_ssim": summary["avg_ssim"],
+            "avg_ms_ssim": summary["avg_ms_ssim"],
+            "avg_code_similarity": summary["avg_code_similarity"],
+            "avg_scss_similarity": summary["avg_scss_similarity"],
+            "total_tokens": summary["token_usage"].get("total_tokens", 0),
+            "p50_total_ms": summary["timings"].get("total", {}).get("p50")
+        })
+    return rows
+
+
+def print_sweep_table(rows: list, total_items: int):
+    """
+    打印扫参对比表，平均 SSIM 最高的配置以 ★ 标出。
+    """
+    if not rows:
+        return
+    best_ssim = max(row["avg_ssim"] for row in rows)
+    has_winner = len({row["avg_ssim"] for row in rows}) > 1
+    name_width = max(len(row["name"]) for row in rows) + 2
+    print("\n--- 📊 扫参对比 (Sweep Comparison) 📊 ---")
+    print(f"{'配置':<{name_width}}{'生成':>8}{'渲染':>8}{'SSIM':>9}{'MS-SSIM':>9}{'代码':>8}{'SCSS':>8}{'tokens':>10}{'p50 ms':>10}")
+    for row in rows:
+        p50_total = f"{row['p50_total_ms']:.0f}" if row["p50_total_ms"] is not None else "-"
+        marker = " ★" if row["avg_ssim"] == best_ssim and has_winner else ""
+        print(f"{row['name']:<{name_width}}{row['generated']:>4}/{total_items:<3}{row['rendered']:>4}/{total_items:<3}"
+              f"{row['avg_ssim']:>9.4f}{row['avg_ms_ssim']:>9.4f}{row['avg_code_similarity']:>8.4f}{row['avg_scss_similarity']:>8.4f}"
+              f"{row['total_tokens']:>10}{p50_total:>10}{marker}")
+
+
+def run_sweep(args) -> int:
+    config = gpt4o_codegen.get_config()
+    if not os.path.isdir(args.dataset):
+        print(f"❌ 错误：数据集目录不存在：{args.dataset}")
+        return 1
+    try:
+        prompt_variants = parse_prompt_variants(args.prompt_variants or [f"default={config.prompts_dir}"])
+        grid = build_sweep_grid(args.models, prompt_variants, FEW_SHOT_CHOICES[args.few_shot], args.temperatures,
+                                refine=args.refine_rounds > 0)
+    except PromptConfigError as e:
+        print(f"❌ 错误：{e}")
+        return 1
+
+    if args.resume:
+        if not os.path.isdir(args.resume):
+            print(f"❌ 错误：要继续的扫参目录不存在：{args.resume}")
+            return 1
+        sweep_dir = args.resume
+    else:
+        sweep_dir = os.path.join(args.output_root, f"sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(sweep_dir, exist_ok=True)
+    sweep_id = os.path.basename(os.path.normpath(sweep_dir))
+
+    dataset_index = DatasetIndex.load_or_build(args.dataset, args.dataset_index)
+    item_ids = dataset_index.item_ids()
+    if args.items:
+        item_ids = item_ids[:args.items]
+
+    image_options = image_options_from_args(args)
+    generation_options = {
+        "dataset": os.path.abspath(args.dataset),
+        "num_samples": args.num_samples,
+        "selection_objective": args.selection_objective if args.num_samples > 1 else None,
+        "refine_rounds": args.refine_rounds,
+        "refine": [args.refine_min_gain, args.refine_max_seconds, args.refine_max_tokens] if args.refine_rounds else None,
+        "image_options": image_options
+    }
+    for sweep_config in grid:
+        sweep_config.compute_key(generation_options)
+    configs = deduplicate_configs(grid)
+
+    caches = create_caches(args)
+    results_db_path = args.results_db or os.path.join(os.path.dirname(os.path.abspath(sweep_dir)), RESULTS_DB_FILENAME)
+    results_store = ResultsStore(results_db_path)
+    for sweep_config in configs:
+        sweep_config.run_id = f"{sweep_id}/{sweep_config.name}"
+        sweep_config.output_dir = os.path.join(sweep_dir, sweep_config.name)
+        results_store.start_run(sweep_config.run_id, os.path.abspath(sweep_config.output_dir),
+                                {**sweep_config.as_dict(), **generation_options}, sweep_config.key)
+
+    print(f"🚀 扫参 {sweep_id}: {len(configs)} 个配置 × {len(item_ids)} 个项目")
+    for sweep_config in configs:
+        print(f"  - {sweep_config.name}")
+    print(f"结果库: {results_db_path}")
+
+    # 按项目为主序排列任务：同一项目的各个配置相邻，参考截图的解码 / 预处理结果在进程内缓存中命中
+    tasks = []
+    reused_count = 0
+    for item_id in item_ids:
+        for sweep_config in configs:
+            if not args.no_reuse and reuse_completed_result(results_store, sweep_config, item_id) is not None:
+                reused_count += 1
+                continue
+            tasks.append((sweep_config, item_id))
+    if reused_count:
+        print(f"♻️ {reused_count} 个 (项目, 配置) 已有完整结果，直接复用。")
+
+    started_at = time.perf_counter()
+    completed_count = 0
+    with results_store, ExitStack() as services:
+        try:
+            render_pool, llm_client, pipeline = services.enter_context(open_run_services(config, args, caches["compile"]))
+        except (OSError, RuntimeError) as e:
+            print(f"❌ 错误：{e}")
+            return 1
+
+        def process_task(task):
+            sweep_config, item_id = task
+            source_assets_dir = os.path.join(dataset_index.item_dir(item_id), 'assets')
+            if os.path.isdir(source_assets_dir):
+                link_assets(source_assets_dir, os.path.join(sweep_config.output_dir, item_id, 'assets'))
+            return generate_code_from_screenshot(
+                dataset_index.screenshot_path(item_id),
+                output_base_dir=sweep_config.output_dir,
+                model=sweep_config.model,
+                render_pool=render_pool,
+                pipeline=pipeline,
+                llm_cache=caches["llm"],
+                render_cache=caches["render"],
+                resume=bool(args.resume),
+                image_options=image_options,
+                image_cache=caches["image_prep"],
+                save_screenshots=not args.no_save_screenshots,
+                dataset_index=dataset_index,
+                llm_client=llm_client,
+                num_samples=args.num_samples,
+                selection_objective=args.selection_objective,
+                refine_rounds=args.refine_rounds,
+                refine_min_gain=args.refine_min_gain,
+                refine_max_seconds=args.refine_max_seconds,
+                refine_max_tokens=args.refine_max_tokens,
+                results_store=results_store,
+                run_id=sweep_config.run_id,
+                prompts=sweep_config.prompts,
+                few_shot=sweep_config.few_shot,
+                temperature=sweep_config.temperature
+            )
+
+        def on_task_done(task, result):
+            nonlocal completed_count
+            completed_count += 1
+            sweep_config, item_id = task
+            metrics = result.get("metrics", {})
+            print(f"[{completed_count}/{len(tasks)}] {sweep_config.name} {item_id}: {result.get('status')} "
+                  f"(SSIM {metrics.get('visual_similarity_ssim_score', 0.0):.4f})")
+
+        pipeline.map(process_task, tasks, on_result=on_task_done, collect=False)
+        rows = summarize_sweep(results_store, configs, len(item_ids))
+    wall_seconds = time.perf_counter() - started_at
+
+    llm_stats = llm_client.stats()
+    summary_filepath = os.path.join(sweep_dir, 'sweep_summary.json')
+    with open(summary_filepath, 'w', encoding='utf-8') as f:
+        json.dump({
+            "sweep_id": sweep_id,
+            "dataset": args.dataset,
+            "items": len(item_ids),
+            "tasks": len(tasks),
+            "reused": reused_count,
+            "wall_seconds": round(wall_seconds, 3),
+            "results_db": os.path.abspath(results_db_path),
+            "generation_options": generation_options,
+            "llm": llm_stats,
+            "cache": {"llm": caches["llm"].stats(), "render": caches["render"].stats()},
+            "configs": rows
+        }, f, indent=4, ensure_ascii=False)
+
+    print_sweep_table(rows, len(item_ids))
+    print(f"\n共 {len(tasks)} 个任务 (复用 {reused_count} 个)，耗时 {wall_seconds:.1f} 秒；LLM 请求 {llm_stats['requests']} 次，估算费用 ${llm_stats['cost_usd']:.4f}")
+    print(f"✅ 扫参结果已保存到: {summary_filepath}")
+    return 0
+
+
+SWEEP_DESCRIPTION = ("扫参：在一次运行中对数据集跑 模型 × prompt 变体 × few-shot × 温度 的网格，"
+                     "所有配置共享 LLM 客户端、渲染服务和指标进程池，最后输出对比表。")
+
+
+def add_sweep_arguments(parser: argparse.ArgumentParser, config):
+    """
+    扫参的命令行参数 (网格定义 + 与 generate 共用的运行参数)，供本脚本和 gpt4o_codegen 的 sweep 子命令使用。
+    """
+    parser.add_argument('--models', nargs='+', default=['gpt-4o'], help="参与比较的模型")
+    parser.add_argument('--prompt-variants', nargs='+', default=None, metavar='NAME=DIR',
+                        help="prompt 变体 (包含 ui2code_system_prompt.txt 等文件的目录)，默认只使用当前配置的 prompt 目录")
+    parser.add_argument('--few-shot', choices=sorted(FEW_SHOT_CHOICES), default='off', help="是否加入 shot0 示例对话；both 表示两种都跑")
+    parser.add_argument('--temperatures', nargs='+', type=float, default=[0.7], help="采样温度")
+    parser.add_argument('--items', type=int, default=0, help="只使用前 N 个项目 (0 表示全部)")
+    parser.add_argument('--no-reuse', action='store_true', help="不复用结果库中相同 (项目, 配置) 的已有结果")
+    add_run_arguments(parser, config)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=SWEEP_DESCRIPTION)
+    add_sweep_arguments(parser, gpt4o_codegen.get_config())
+    args = parser.parse_args(argv)
+    return run_sweep(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
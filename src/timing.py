@@ -0,0 +1,101 @@
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """
+    记录单个项目各阶段的墙钟耗时 (毫秒)。同名阶段多次计时会累加；
+    as_dict() 额外给出 total，即从创建计时器到当前的总耗时。
+    用法：
+        timer = StageTimer()
+        with timer.stage("llm"):
+            ...
+        timer.add("render_compile", 12.5)
+    """
+
+    def __init__(self):
+        self._started_at = time.perf_counter()
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - started_at) * 1000)
+
+    def add(self, name: str, elapsed_ms: float | None):
+        if elapsed_ms is None:
+            return
+        with self._lock:
+            self._timings[name] = self._timings.get(name, 0.0) + float(elapsed_ms)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            timings = {name: round(elapsed_ms, 3) for name, elapsed_ms in self._timings.items()}
+        timings["total"] = round((time.perf_counter() - self._started_at) * 1000, 3)
+        return timings
+
+
+TIMING_RESERVOIR_SIZE = 4096 # TimingAggregate 每个阶段保留的样本数上限
+
+
+def summarize_timings(timings_list: list) -> dict:
+    """
+    汇总多个项目的阶段耗时：timings_list 为若干 {阶段名: 毫秒} 字典，
+    返回 {阶段名: {"count", "p50", "p95", "max"}}，按阶段名排序。
+    """
+    aggregate = TimingAggregate(max_samples=None)
+    for timings in timings_list:
+        aggregate.add(timings)
+    return aggregate.summary()
+
+
+class TimingAggregate:
+    """
+    增量汇总多个项目的阶段耗时，每完成一个项目调用一次 add()。
+    每个阶段精确记录次数和最大值；p50 / p95 由最多 max_samples 个样本的蓄水池抽样估计
+    (样本数未超过上限时是精确值)，内存占用不随项目数增长。max_samples 为 None 时保留全部样本。
+    """
+
+    def __init__(self, max_samples: int | None = TIMING_RESERVOIR_SIZE, seed: int = 0):
+        self.max_samples = max_samples
+        self._stages = {} # 阶段名 -> [次数, 最大值, 样本列表]
+        self._random = random.Random(seed)
+
+    def add(self, timings: dict):
+        for name, elapsed_ms in (timings or {}).items():
+            if elapsed_ms is None:
+                continue
+            stage = self._stages.setdefault(name, [0, float(elapsed_ms), []])
+            stage[0] += 1
+            stage[1] = max(stage[1], float(elapsed_ms))
+            samples = stage[2]
+            if self.max_samples is None or len(samples) < self.max_samples:
+                samples.append(elapsed_ms)
+            else:
+                # 蓄水池抽样：第 n 个样本以 max_samples / n 的概率替换一个已有样本
+                slot = self._random.randrange(stage[0])
+                if slot < self.max_samples:
+                    samples[slot] = elapsed_ms
+
+    def summary(self) -> dict:
+        """
+        返回 {阶段名: {"count", "p50", "p95", "max"}}，按阶段名排序。
+        """
+        import numpy as np
+        summary = {}
+        for name in sorted(self._stages):
+            count, max_ms, samples = self._stages[name]
+            values = np.asarray(samples, dtype=np.float64)
+            summary[name] = {
+                "count": count,
+                "p50": round(float(np.percentile(values, 50)), 3),
+                "p95": round(float(np.percentile(values, 95)), 3),
+                "max": round(max_ms, 3),
+            }
+        return summary
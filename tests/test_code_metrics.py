@@ -0,0 +1,20 @@
+import code_metrics
+
+
+def test_chinese_text_is_tokenized():
+    # 只有中文文本不同的两段 JSX 不能被判定为完全相同
+    result = code_metrics.compare_code('<div>立即抽奖</div>', '<div>完全不同</div>')
+    assert result["lcs_ratio"] < 1.0
+    assert result["shingle_jaccard"] < 1.0
+
+
+def test_identical_chinese_text_matches():
+    result = code_metrics.compare_code('<div>立即抽奖</div>', '<div>立即抽奖</div>')
+    assert result["lcs_ratio"] == 1.0
+
+
+def test_short_inputs_are_order_sensitive():
+    # 少于 SHINGLE_SIZE 个 token 的代码也按顺序比较，顺序颠倒不能得到 1.0
+    result = code_metrics.compare_code('a b c', 'c b a')
+    assert result["shingle_jaccard"] < 1.0
+    assert code_metrics.compare_code('a b c', 'a b c')["shingle_jaccard"] == 1.0